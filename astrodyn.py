@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+# Two-body astrodynamics without Apex
+#
+# Vectorized building blocks of iod and propagate: sidereal time, the
+# transformation of J2000 directions to the true equator and equinox of date
+# (TOD), station positions, Kepler's equation, conversions between
+# osculating elements and states, and two-body propagation of states with f
+# and g functions, with analytic partial derivatives for orbit fitting. All
+# functions take arrays and broadcast over leading dimensions; vectors are
+# in the last one.
+#
+# Precession is IAU 1976 and nutation the largest terms of IAU 1980, which
+# is good to about 0.1". Times are MJD (UTC), used in place of UT1 and TT;
+# polar motion, aberration and perturbations are neglected. Distances are in
+# km, velocities in km/s, angles in degrees unless noted otherwise.
+
+import numpy as np
+
+# Gravitational parameter of the Earth, km^3/s^2
+mu = 398600.4418
+
+# WGS84 equatorial radius, km, and flattening
+r_earth = 6378.137
+flattening = 1/298.257223563
+
+# Rotation rate of the Earth, rad/s
+omega_earth = 7.292115e-5
+
+# Speed of light, km/s
+c_light = 299792.458
+
+# Seconds per day
+day = 86400.0
+
+_ARCSEC = np.pi/(180*3600)
+
+
+def _centuries(mjd):
+    return (np.asarray(mjd, float) - 51544.5)/36525
+
+
+def gmst(mjd):
+    '''
+    :return: Greenwich mean sidereal time (IAU 1982), radians in [0, 2pi)
+    '''
+    d = np.asarray(mjd, float) - 51544.5
+    t = d/36525
+    return np.deg2rad(280.46061837 + 360.98564736629*d +
+                      t*t*(0.000387933 - t/38710000.0)) % (2*np.pi)
+
+
+# Largest terms of the IAU 1980 nutation series: multipliers of l, l', F, D,
+# Omega, then dpsi = (A + B*T)*sin(arg), deps = (C + D*T)*cos(arg), 0.0001"
+_NUTATION = np.array([
+    (0, 0, 0, 0, 1, -171996, -174.2, 92025, 8.9),
+    (0, 0, 2, -2, 2, -13187, -1.6, 5736, -3.1),
+    (0, 0, 2, 0, 2, -2274, -0.2, 977, -0.5),
+    (0, 0, 0, 0, 2, 2062, 0.2, -895, 0.5),
+    (0, 1, 0, 0, 0, 1426, -3.4, 54, -0.1),
+    (1, 0, 0, 0, 0, 712, 0.1, -7, 0),
+    (0, 1, 2, -2, 2, -517, 1.2, 224, -0.6),
+    (0, 0, 2, 0, 1, -386, -0.4, 200, 0),
+    (1, 0, 2, 0, 2, -301, 0, 129, -0.1),
+    (0, -1, 2, -2, 2, 217, -0.5, -95, 0.3),
+], float)
+
+
+def nutation(mjd):
+    '''
+    :return: dpsi, deps, eps - nutation in longitude and obliquity and the
+        mean obliquity of date, radians
+    '''
+    t = _centuries(mjd)
+    args = np.deg2rad(np.stack([
+        134.96298139 + 477198.8673981*t,   # l
+        357.52772333 + 35999.0503400*t,    # l'
+        93.27191028 + 483202.0175381*t,    # F
+        297.85036306 + 445267.1114800*t,   # D
+        125.04452222 - 1934.1362608*t],    # Omega
+        -1))
+    arg = np.dot(args, _NUTATION[:, :5].T)
+    t = t[..., None]
+    dpsi = ((_NUTATION[:, 5] + _NUTATION[:, 6]*t)*np.sin(arg)).sum(-1)
+    deps = ((_NUTATION[:, 7] + _NUTATION[:, 8]*t)*np.cos(arg)).sum(-1)
+    t = t[..., 0]
+    eps = 84381.448 - t*(46.8150 + t*(0.00059 - t*0.001813))
+    return dpsi*1e-4*_ARCSEC, deps*1e-4*_ARCSEC, eps*_ARCSEC
+
+
+def gast(mjd):
+    '''
+    :return: Greenwich apparent sidereal time, radians in [0, 2pi)
+    '''
+    dpsi, deps, eps = nutation(mjd)
+    return (gmst(mjd) + dpsi*np.cos(eps + deps)) % (2*np.pi)
+
+
+def _rotation(axis, angle):
+    # Matrices rotating the coordinate frame by angle (radians) about axis
+    angle = np.asarray(angle, float)
+    c, s = np.cos(angle), np.sin(angle)
+    m = np.zeros(angle.shape + (3, 3))
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    m[..., axis, axis] = 1
+    m[..., i, i] = m[..., j, j] = c
+    m[..., i, j] = s
+    m[..., j, i] = -s
+    return m
+
+
+def tod_matrix(mjd):
+    '''
+    :return: (..., 3, 3) matrices transforming J2000 vectors to TOD
+    '''
+    t = _centuries(mjd)
+    zeta = (2306.2181 + (0.30188 + 0.017998*t)*t)*t*_ARCSEC
+    z = (2306.2181 + (1.09468 + 0.018203*t)*t)*t*_ARCSEC
+    theta = (2004.3109 - (0.42665 + 0.041833*t)*t)*t*_ARCSEC
+    dpsi, deps, eps = nutation(mjd)
+    precession = np.matmul(_rotation(2, -z), np.matmul(
+        _rotation(1, theta), _rotation(2, -zeta)))
+    nut = np.matmul(_rotation(0, -(eps + deps)), np.matmul(
+        _rotation(2, -dpsi), _rotation(0, eps)))
+    return np.matmul(nut, precession)
+
+
+def j2000_to_tod(xyz, mjd):
+    '''
+    :param xyz: (..., 3) J2000 vectors
+    :param mjd: epochs, broadcast against xyz[..., 0]
+    :return: TOD vectors
+    '''
+    return np.matmul(tod_matrix(mjd), np.asarray(xyz, float)[..., None])[
+        ..., 0]
+
+
+def site_state(latitude, longitude, altitude, mjd):
+    '''
+    :param latitude, longitude: geodetic coordinates, degrees (east positive)
+    :param altitude: height above the WGS84 ellipsoid, km
+    :param mjd: epochs
+    :return: r, v - (..., 3) TOD position and velocity of the station
+    '''
+    lat, lon = np.deg2rad(latitude), np.deg2rad(longitude)
+    e2 = flattening*(2 - flattening)
+    n = r_earth/np.sqrt(1 - e2*np.sin(lat)**2)
+    rho = (n + altitude)*np.cos(lat)
+    z = (n*(1 - e2) + altitude)*np.sin(lat)
+    theta = gast(mjd) + lon
+    r = np.stack(np.broadcast_arrays(rho*np.cos(theta), rho*np.sin(theta), z),
+                 -1)
+    v = np.stack([-omega_earth*r[..., 1], omega_earth*r[..., 0],
+                  np.zeros_like(r[..., 2])], -1)
+    return r, v
+
+
+def kepler(M, e, tol=1e-12, max_iter=50):
+    '''
+    Solve Kepler's equation E - e sin E = M for elliptic orbits
+    :param M: mean anomaly, radians
+    :param e: eccentricity, 0 <= e < 1
+    :return: eccentric anomaly, radians
+    '''
+    M, e = np.broadcast_arrays(np.asarray(M, float), np.asarray(e, float))
+    M = np.remainder(M + np.pi, 2*np.pi) - np.pi
+    E = np.where(e < 0.8, M + e*np.sin(M), np.pi*np.sign(M))
+    # Newton's method converges quadratically: the error left after a step
+    # dE is below e/(1 - e) dE^2
+    bound = e/(1 - e)
+    for _ in xrange(max_iter):
+        dE = (E - e*np.sin(E) - M)/(1 - e*np.cos(E))
+        E = E - dE
+        if not (bound*dE*dE > tol).any():
+            break
+    return E
+
+
+def elements_to_state(a, e, i, W, w, M):
+    '''
+    :param a: semi-major axis, km
+    :param e: eccentricity
+    :param i, W, w, M: inclination, longitude of the ascending node,
+        argument of perigee and mean anomaly, degrees
+    :return: r, v - (..., 3) position and velocity
+    '''
+    a, e = np.asarray(a, float), np.asarray(e, float)
+    i, W, w, M = [np.deg2rad(x) for x in (i, W, w, M)]
+    E = kepler(M, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    b = a*np.sqrt(1 - e*e)
+    # Perifocal coordinates
+    x, y = a*(cos_E - e), b*sin_E
+    r = a*(1 - e*cos_E)
+    k = np.sqrt(mu*a)/r
+    vx, vy = -k*sin_E, k*np.sqrt(1 - e*e)*cos_E
+    cW, sW, cw, sw, ci, si = (np.cos(W), np.sin(W), np.cos(w), np.sin(w),
+                              np.cos(i), np.sin(i))
+    P = np.stack([cW*cw - sW*sw*ci, sW*cw + cW*sw*ci, sw*si], -1)
+    Q = np.stack([-cW*sw - sW*cw*ci, -sW*sw + cW*cw*ci, cw*si], -1)
+    return (x[..., None]*P + y[..., None]*Q,
+            vx[..., None]*P + vy[..., None]*Q)
+
+
+def state_to_elements(r, v):
+    '''
+    :param r, v: (..., 3) position and velocity
+    :return: a, e, i, W, w, M - see elements_to_state(); W is 0 for
+        equatorial and w is measured from the node line (from the x axis for
+        equatorial orbits) for circular orbits, with M then being the
+        argument of latitude (true longitude)
+    '''
+    r, v = np.asarray(r, float), np.asarray(v, float)
+    rr = np.sqrt((r*r).sum(-1))
+    h = np.cross(r, v)
+    hh = np.sqrt((h*h).sum(-1))
+    node = np.stack([-h[..., 1], h[..., 0], np.zeros_like(hh)], -1)
+    nn = np.sqrt((node*node).sum(-1))
+    evec = np.cross(v, h)/mu - r/rr[..., None]
+    e = np.sqrt((evec*evec).sum(-1))
+    a = 1/(2/rr - (v*v).sum(-1)/mu)
+    i = np.arccos(np.clip(h[..., 2]/hh, -1, 1))
+
+    # Reference directions: node line (x axis if equatorial) and perigee
+    # (node line if circular)
+    equatorial = nn < 1e-12*hh
+    ex = np.where(equatorial[..., None], [1.0, 0, 0],
+                  node/np.where(equatorial, 1, nn)[..., None])
+    W = np.where(equatorial, 0.0, np.arctan2(ex[..., 1], ex[..., 0]))
+    ey = np.cross(h/hh[..., None], ex)
+    circular = e < 1e-12
+    pdir = np.where(circular[..., None], ex,
+                    evec/np.where(circular, 1, e)[..., None])
+    w = np.arctan2((pdir*ey).sum(-1), (pdir*ex).sum(-1))
+    qdir = np.cross(h/hh[..., None], pdir)
+    nu = np.arctan2((r*qdir).sum(-1), (r*pdir).sum(-1))
+    E = 2*np.arctan(np.sqrt((1 - e)/(1 + e))*np.tan(nu/2))
+    M = E - e*np.sin(E)
+    return (a, e, np.rad2deg(i), np.rad2deg(W) % 360, np.rad2deg(w) % 360,
+            np.rad2deg(M) % 360)
+
+
+def _propagate(r0, v0, dt, tol, max_iter):
+    # Eccentric anomaly change dE and the scalars of propagate_state()
+    r0, v0 = np.asarray(r0, float), np.asarray(v0, float)
+    dt = np.asarray(dt, float)
+    rr0 = np.sqrt((r0*r0).sum(-1))
+    inv_a = 2/rr0 - (v0*v0).sum(-1)/mu
+    a = np.where(inv_a > 0, 1/np.where(inv_a > 0, inv_a, 1), np.nan)
+    sqrt_a = np.sqrt(a)
+    n = np.sqrt(mu/a**3)
+    sigma = (r0*v0).sum(-1)/np.sqrt(mu)
+    c1 = sigma/sqrt_a
+    c2 = 1 - rr0/a
+    # dM = dE + c1 (1 - cos dE) - c2 sin dE, with |c1|, |c2| = e < 1
+    dM = n*dt
+    dE = dM.copy() if dM.ndim else np.array(dM)
+    for _ in xrange(max_iter):
+        s, c = np.sin(dE), np.cos(dE)
+        step = (dE + c1*(1 - c) - c2*s - dM)/(1 + c1*s - c2*c)
+        dE = dE - step
+        # NaN steps of non-elliptic orbits do not hold the loop
+        with np.errstate(invalid='ignore'):
+            if not (np.abs(step) > tol).any():
+                break
+    s, c = np.sin(dE), np.cos(dE)
+    f = 1 - a/rr0*(1 - c)
+    g = dt - (dE - s)/n
+    return r0, v0, dt, rr0, a, n, sigma, c1, c2, dE, s, c, f, g
+
+
+def propagate_state(r0, v0, dt, tol=1e-12, max_iter=50):
+    '''
+    Two-body propagation of elliptic orbits with f and g functions
+    :param r0, v0: (..., 3) position and velocity
+    :param dt: (...) time since the epoch of r0, v0, seconds
+    :return: r, v at epoch + dt; NaN for non-elliptic orbits
+    '''
+    r0, v0, dt, rr0, a, n, sigma, c1, c2, dE, s, c, f, g = _propagate(
+        r0, v0, dt, tol, max_iter)
+    rr = a + (rr0 - a)*c + sigma*np.sqrt(a)*s
+    fdot = -np.sqrt(mu*a)/(rr*rr0)*s
+    gdot = 1 - a/rr*(1 - c)
+    return (f[..., None]*r0 + g[..., None]*v0,
+            fdot[..., None]*r0 + gdot[..., None]*v0)
+
+
+def propagate_partials(r0, v0, dt, tol=1e-12, max_iter=50):
+    '''
+    Two-body propagation of positions with their partial derivatives
+    :param r0, v0, dt: see propagate_state()
+    :return: r, jac - position at epoch + dt and (..., 3, 6) derivatives of
+        it with respect to r0 and v0; NaN for non-elliptic orbits
+    '''
+    r0, v0, dt, rr0, a, n, sigma, c1, c2, dE, s, c, f, g = _propagate(
+        r0, v0, dt, tol, max_iter)
+    # f and g depend on the state through |r0|, r0.v0 and 1/a, directly
+    # and through dE, which is implicit in Kepler's equation
+    alpha = 1/a
+    sqrt_mu, sqrt_alpha = np.sqrt(mu), np.sqrt(alpha)
+    dn = 1.5*sqrt_mu*sqrt_alpha
+    kepler_dE = 1 + c1*s - c2*c
+    dE_R = -s*alpha/kepler_dE
+    dE_D = -(1 - c)*sqrt_alpha/sqrt_mu/kepler_dE
+    dE_alpha = -((1 - c)*sigma/(2*sqrt_alpha) + s*rr0 - dt*dn)/kepler_dE
+    f_dE = -s/(alpha*rr0)
+    g_dE = -(1 - c)/n
+    f_R = (1 - c)/(alpha*rr0*rr0) + f_dE*dE_R
+    f_D = f_dE*dE_D
+    f_alpha = (1 - c)/(alpha*alpha*rr0) + f_dE*dE_alpha
+    g_R = g_dE*dE_R
+    g_D = g_dE*dE_D
+    g_alpha = (dE - s)/(n*n)*dn + g_dE*dE_alpha
+    # Gradients of |r0|, r0.v0 and 1/a with respect to (r0, v0)
+    zero = np.zeros_like(r0)
+    grad_R = np.concatenate([r0/rr0[..., None], zero], -1)
+    grad_D = np.concatenate([v0, r0], -1)
+    grad_alpha = np.concatenate([-2*r0/(rr0**3)[..., None], -2*v0/mu], -1)
+    grad = lambda x_R, x_D, x_alpha: (x_R[..., None]*grad_R +
+                                      x_D[..., None]*grad_D +
+                                      x_alpha[..., None]*grad_alpha)
+    jac = r0[..., :, None]*grad(f_R, f_D, f_alpha)[..., None, :] + \
+        v0[..., :, None]*grad(g_R, g_D, g_alpha)[..., None, :]
+    eye = np.eye(3)
+    jac[..., :3] += f[..., None, None]*eye
+    jac[..., 3:] += g[..., None, None]*eye
+    return f[..., None]*r0 + g[..., None]*v0, jac
+
+
+def sublon(r, mjd):
+    '''
+    :param r: (..., 3) TOD positions
+    :return: east longitude of the sub-satellite point, degrees in [0, 360)
+    '''
+    r = np.asarray(r, float)
+    return np.rad2deg(np.arctan2(r[..., 1], r[..., 0]) - gast(mjd)) % 360
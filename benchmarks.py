@@ -0,0 +1,890 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmarks of the Uzhgorod geo catalog modules
+#
+# Usage:
+#   python benchmarks.py <name> [<option>=<value> ...]
+#
+# Without arguments, lists the available benchmarks.
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sample_res = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '20140512_10092.res')
+
+benchmarks = {}
+
+
+def benchmark(func):
+    benchmarks[func.__name__] = func
+    return func
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - t0, result
+
+
+def scaled_copy(src, rows=None, size=None, suffix=''):
+    '''
+    Write src repeated until it holds at least "rows" measurement lines or
+    "size" bytes
+    :return: name of the temporary file
+    '''
+    data = open(src, 'rb').read()
+    if size is None:
+        per_copy = sum(1 for line in data.splitlines()
+                       if len(line.split()) == 5)
+        copies = max(1, -(-rows//per_copy))
+    else:
+        copies = max(1, -(-size//len(data)))
+    fd, name = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'wb') as f:
+        for _ in xrange(copies):
+            f.write(data)
+    return name
+
+
+def same_series(meas, series, ref):
+    '''
+    :param meas, series: arrays of read_res_arrays()
+    :param ref: list of seriya of the per-line reader
+    :return: True if both hold the same series and values
+    '''
+    if [(s['st_id'], s['ser_id'], s['stop'] - s['start']) for s in series] \
+            != [(s.st_id, s.ser_id, len(s.coord)) for s in ref]:
+        return False
+    return meas.tolist() == [(c.date, c.time, c.RA, c.DEC, c.m)
+                             for s in ref for c in s.coord]
+
+
+@benchmark
+def res(rows=10**6):
+    '''Per-line iter_res vs columnar read_res_arrays'''
+    import coord
+    rows = int(float(rows))
+    fn = scaled_copy(sample_res, rows, suffix='.res')
+    try:
+        size = os.path.getsize(fn)/1e6
+        t_arr, (meas, series) = timed(coord.read_res_arrays, fn)
+        print 'read_res_arrays: %d rows, %d series, %.3f s (%.1f MB/s)' % (
+            len(meas), len(series), t_arr, size/t_arr)
+        t_ref, ref = timed(list, coord.iter_res(fn))
+        print 'per-line reader: %.3f s (%.1f MB/s)' % (t_ref, size/t_ref)
+        print 'speedup: %.1fx' % (t_ref/t_arr)
+        assert same_series(meas, series, ref), \
+            'read_res_arrays differs from the per-line reader'
+        print 'same series as the per-line reader: OK'
+    finally:
+        os.remove(fn)
+
+
+@benchmark
+def check(size_mb=100):
+    '''read_check_arrays throughput and peak memory'''
+    import coord
+    fn = scaled_copy(sample_res + '.check', size=int(float(size_mb)*1e6),
+                     suffix='.check')
+    try:
+        size = os.path.getsize(fn)/1e6
+        rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t, tables = timed(coord.read_check_arrays, fn)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print 'read_check_arrays: %.0f MB, %d series, %d residuals, ' \
+            '%.3f s (%.1f MB/s)' % (size, len(tables.series),
+                                    len(tables.residuals), t, size/t)
+        print 'peak RSS growth: %.0f MB; output tables: %.0f MB' % (
+            (rss - rss0)/1024.0,
+            sum(a.nbytes for a in (tables.series, tables.residuals,
+                                   tables.iod, tables.matched))/1e6)
+    finally:
+        os.remove(fn)
+
+
+class _dict_coord(object):
+    # Layout of the original __dict__-based coord class
+    def __init__(self, date, time, RA, DEC, m):
+        self.date = date
+        self.time = time
+        self.RA = RA
+        self.DEC = DEC
+        self.m = m
+
+
+def object_size(obj):
+    '''Size of a coord-like object with its attribute values, bytes'''
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size + sum(sys.getsizeof(getattr(obj, name))
+                      for name in ('date', 'time', 'RA', 'DEC', 'm'))
+
+
+@benchmark
+def memory(rows=10**6):
+    '''Bytes per measurement: dict objects, slotted objects, SeriesBlock'''
+    import coord
+    rows = int(float(rows))
+    fn = scaled_copy(sample_res, rows, suffix='.res')
+    try:
+        meas, series = coord.read_res_arrays(fn)
+        # Each measurement also costs a pointer in the seriya.coord list
+        row = meas[0].tolist()
+        print '__dict__ coord  %6.1f bytes/measurement' % (
+            object_size(_dict_coord(*row)) + 8)
+        print '__slots__ coord %6.1f bytes/measurement' % (
+            object_size(coord.coord(*row)) + 8)
+        print 'SeriesBlock     %6.1f bytes/measurement' % (
+            float(coord.SeriesBlock(meas, series).nbytes)/len(meas))
+    finally:
+        os.remove(fn)
+
+
+@benchmark
+def cache(size_mb=100):
+    '''Reopening a .res file and its .check through the parse cache'''
+    import shutil
+    import rescache
+    size = int(float(size_mb)*1e6)
+    fn = scaled_copy(sample_res, size=size, suffix='.res')
+    os.rename(scaled_copy(sample_res + '.check', size=size, suffix='.check'),
+              fn + '.check')
+    cache = rescache.ParseCache(tempfile.mkdtemp(), max_bytes=1 << 40)
+    try:
+        for attempt in ('cold', 'warm'):
+            t, _ = timed(lambda: (cache.load_res(fn),
+                                  cache.load_check(fn + '.check')))
+            print '%s: %.3f s' % (attempt, t)
+        print cache.stats()
+    finally:
+        shutil.rmtree(cache.dirname)
+        os.remove(fn)
+        os.remove(fn + '.check')
+
+
+@benchmark
+def insert(rows=10**6, synchronous='NORMAL'):
+    '''BulkWriter inserts/s'''
+    import shutil
+    import numpy as np
+    import catdb
+    import coord
+    rows = int(float(rows))
+    fn = scaled_copy(sample_res, rows, suffix='.res')
+    dirname = tempfile.mkdtemp()
+    try:
+        meas, series = coord.read_res_arrays(fn)
+        # Make every copy of the sample a distinct satellite
+        series['ser_id'] = np.arange(len(series))
+        res_conn, el_conn = catdb.connect(
+            os.path.join(dirname, 'res.db'), os.path.join(dirname, 'el.db'),
+            synchronous=synchronous)
+        writer = catdb.BulkWriter(res_conn, el_conn)
+        t, _ = timed(lambda: (writer.add_arrays(meas, series),
+                              writer.flush()))
+        print '%d measurements in %.3f s: %.0f inserts/s' % (
+            writer.count, t, writer.count/t)
+    finally:
+        shutil.rmtree(dirname)
+        os.remove(fn)
+
+
+@benchmark
+def select(lookups=1000):
+    '''Selection latency: linear scan of check vs CatalogIndex'''
+    import random
+    import coord
+    lookups = int(float(lookups))
+    for n in (10**3, 10**4, 10**5):
+        check = [coord.elements(str(k)) for k in xrange(n)]
+        check_match = [coord.elements() for _ in xrange(n)]
+        index = coord.CatalogIndex()
+        index.add_elements(check, check_match)
+        ids = [str(random.randrange(n)) for _ in xrange(lookups)]
+
+        def scan(ids):
+            # What show_el used to do for every click
+            for sat_ID in ids:
+                for el in check:
+                    if el.sat_ID == sat_ID:
+                        check_match[check.index(el)]
+
+        def lookup(ids):
+            for sat_ID in ids:
+                for k in index.element_rows(sat_ID):
+                    index.check[k], index.check_match[k]
+
+        # The scan is too slow to repeat for every lookup on large sets
+        t_scan, _ = timed(scan, ids[:max(1, lookups*1000//n)])
+        t_scan /= max(1, lookups*1000//n)
+        t_index, _ = timed(lookup, ids)
+        t_index /= lookups
+        print '%6d series: scan %9.3f us, index %6.3f us per selection' % (
+            n, t_scan*1e6, t_index*1e6)
+
+
+@benchmark
+def plot(points=10**6, width=800):
+    '''Min/max decimation and switching between cached element plots'''
+    import numpy as np
+    import plotting
+    points, width = int(float(points)), int(width)
+    epoch = np.sort(np.random.uniform(56000, 56000 + 3653, points))
+    value = 42164 + np.random.normal(0, 5, points)
+    t, (x, y) = timed(plotting.minmax_decimate, epoch, value,
+                      epoch[0], epoch[-1], width)
+    print 'minmax_decimate: %d -> %d points in %.1f ms' % (
+        points, len(x), t*1e3)
+    t, _ = timed(plotting.minmax_decimate, epoch, value,
+                 epoch[points//2], epoch[points//2] + 30, width)
+    print 'zoomed to 30 days: %.1f ms' % (t*1e3)
+    try:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+    except ImportError:
+        print 'matplotlib is not available, plot switching not measured'
+        return
+    fig = Figure((width/100.0, 3.0), dpi=100)
+    FigureCanvasAgg(fig)
+    element_plot = plotting.ElementPlot(fig.add_subplot(111))
+    for element in ('a', 'e'):
+        t, _ = timed(element_plot.show, (1, element), (epoch, value))
+        print 'first plot of %s: %.1f ms' % (element, t*1e3)
+    for element in ('a', 'e'):
+        t, _ = timed(element_plot.show, (1, element))
+        print 'switch back to %s: %.1f ms' % (element, t*1e3)
+
+
+def geo_states(n, seed=0):
+    '''
+    Stub of the Apex ephemeris and site functions: topocentric states of GEO
+    objects and their measured RA (hours) and Dec (degrees) with noise
+    '''
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    lon = rng.uniform(0, 2*np.pi, n)
+    r, v = 42164.0, 3.0747
+    p = np.column_stack((r*np.cos(lon), r*np.sin(lon), rng.normal(0, 50, n)))
+    vel = np.column_stack((-v*np.sin(lon), v*np.cos(lon), np.zeros(n)))
+    site = 6378.0*np.array([np.cos(0.85), 0, np.sin(0.85)])
+    pv = np.column_stack((p - site, vel))
+    d = pv[:, :3] + rng.normal(0, 1e-3, (n, 3))
+    ra = np.rad2deg(np.arctan2(d[:, 1], d[:, 0])) % 360/15
+    dec = np.rad2deg(np.arcsin(d[:, 2]/np.sqrt((d**2).sum(1))))
+    return ra, dec, pv
+
+
+@benchmark
+def residuals(points=10**5):
+    '''Batched vs per-point external residuals'''
+    import numpy as np
+    import residuals
+    ra, dec, pv = geo_states(int(float(points)))
+    t_batch, (dtan, dnorm) = timed(residuals.ext_residuals, ra, dec, pv)
+    t_ref, ref = timed(lambda: np.array([
+        residuals.ext_residual(*args) for args in zip(ra, dec, pv)]))
+    print 'batch: %.3f s, per point: %.3f s, speedup %.0fx' % (
+        t_batch, t_ref, t_ref/t_batch)
+
+
+@benchmark
+def match(detections=10**4, catalog=10**5, radius=30):
+    '''SkyIndex nearest neighbour matching in the GEO belt'''
+    import numpy as np
+    import spatial
+    detections, catalog = int(float(detections)), int(float(catalog))
+    radius = float(radius)
+    rng = np.random.RandomState(1)
+    ra = rng.uniform(0, 24, catalog)
+    dec = rng.uniform(-10, 10, catalog)
+    # Half of the detections are near catalog objects
+    k = rng.randint(0, catalog, detections)
+    q_ra = np.where(np.arange(detections) % 2, ra[k] + 1e-4,
+                    rng.uniform(0, 24, detections)) % 24
+    q_dec = np.where(np.arange(detections) % 2, dec[k] - 2e-3,
+                     rng.uniform(-10, 10, detections))
+    results = {}
+    for use_scipy in (True, False):
+        if use_scipy and spatial.cKDTree is None:
+            print 'scipy is not available'
+            continue
+        name = 'cKDTree' if use_scipy else 'grid'
+        t_build, index = timed(spatial.SkyIndex, ra, dec, use_scipy)
+        index.nearest(q_ra[:1], q_dec[:1], radius)  # build the grid
+        t_query, results[name] = timed(index.nearest, q_ra, q_dec, radius)
+        print '%-8s build %.1f ms, %d queries %.1f ms, %d matched' % (
+            name, t_build*1e3, detections, t_query*1e3,
+            (results[name][0] >= 0).sum())
+
+    # Brute force check of a sample of the queries
+    sample = np.arange(0, detections, max(1, detections//200))
+    xyz = spatial.directions(ra, dec)
+    d = np.sqrt(((spatial.directions(q_ra[sample], q_dec[sample])[:, None] -
+                  xyz[None])**2).sum(2))
+    best = d.argmin(1)
+    expected = np.where(d[np.arange(len(sample)), best] <=
+                        spatial.chord(radius), best, -1)
+    for name, (index, sep) in sorted(results.items()):
+        print '%s agrees with brute force: %s' % (
+            name, 'OK' if (index[sample] == expected).all() else 'FAILED')
+
+
+def fits_header(cards):
+    '''Primary FITS header made of (keyword, value) pairs'''
+    text = ''.join(('%-8s= %20s' % (key, "'%s'" % value
+                                     if isinstance(value, str) else value)
+                    ).ljust(80) for key, value in cards) + 'END'.ljust(80)
+    return text.ljust(-(-len(text)//2880)*2880)
+
+
+@benchmark
+def frames(count=2000, threads=8):
+    '''Cold and warm frame epoch discovery through the frame index'''
+    import datetime
+    import shutil
+    import frameindex
+    count, threads = int(float(count)), int(threads)
+    dirname = tempfile.mkdtemp()
+    try:
+        t0 = datetime.datetime(2014, 5, 12, 20)
+        names = []
+        for k in xrange(count):
+            name = os.path.join(dirname, 'frame%05d.fits' % k)
+            epoch = t0 + datetime.timedelta(seconds=30.5*k)
+            cards = [('SIMPLE', 'T'), ('BITPIX', 16), ('NAXIS', 2),
+                     ('NAXIS1', 1024), ('NAXIS2', 1024)] + \
+                [('COMMENT%d' % i, i) for i in xrange(100)] + \
+                [('DATE-OBS', epoch.strftime('%Y-%m-%dT%H:%M:%S.%f'))]
+            with open(name, 'wb') as f:
+                f.write(fits_header(cards) + '\0'*2880*8)
+            names.append(name)
+        names.append(os.path.join(dirname, 'notes.txt'))
+        open(names[-1], 'w').write('not a frame\n')
+        index = os.path.join(dirname, '.frame_epochs')
+        for attempt in ('cold', 'warm'):
+            t, epochs = timed(frameindex.frame_epochs, names,
+                              frameindex.fits_epoch, index, 'fits', threads)
+            print '%s: %d frames in %.3f s' % (attempt, len(epochs), t)
+        print 'epochs correct:', 'OK' if all(
+            epochs[name] == t0 + datetime.timedelta(seconds=30.5*k)
+            for k, name in enumerate(names[:-1])) else 'FAILED'
+    finally:
+        shutil.rmtree(dirname)
+
+
+def legacy_rows(f, mjd0, mjd, ra, ha, dec, mag, int_tan, int_norm, ext_tan,
+                ext_norm, match, tan_flags, norm_flags):
+    # Residual rows as orbit_dump.main() used to print them
+    fmt = lambda d: '%+09.2f' % d if d is not None else ''
+    for res in zip(mjd - mjd0, ra, ha, dec,
+                   ['%5.2f' % m if m else '' for m in mag],
+                   map(fmt, int_tan), tan_flags, map(fmt, int_norm),
+                   norm_flags, map(fmt, ext_tan), map(fmt, ext_norm), match):
+        print >> f, '%11.8f  %010.7f  %010.7f  %+010.6f  ' \
+            '%5s  %9s%c  %9s%c  %9s  %9s  %s' % res
+
+
+@benchmark
+def report(rows=10**6):
+    '''Golden check of the .check writer and its throughput'''
+    import numpy as np
+    import coord
+    import checkreport
+    from StringIO import StringIO
+    rows = int(float(rows))
+
+    check = sample_res + '.check'
+    out = StringIO()
+    checkreport.write_tables(out, coord.read_check_arrays(check))
+    assert out.getvalue() == open(check, 'rb').read(), \
+        'rewritten %s differs' % os.path.basename(check)
+
+    # One series holding all residuals of the scaled sample
+    res = coord.read_check_arrays(check).residuals
+    res = np.tile(res, -(-rows//len(res)))[:rows]
+    mjd0 = int(res['mjd'].min())
+    names = ('int_tan', 'int_norm', 'ext_tan', 'ext_norm')
+    match = ['%d/2014-001A' % k for k in res['match']]
+    flags = [np.where(res[name], '*', ' ').tolist()
+             for name in ('int_tan_outlier', 'int_norm_outlier')]
+    # Unmeasured magnitudes are 0 in orbit_dump
+    columns = [res[name] for name in ('mjd', 'RA', 'HA', 'DEC')] + [
+        np.nan_to_num(res['mag'])] + [
+        [None if d != d else d for d in res[name].tolist()]
+        for name in names] + [match] + flags
+    out = StringIO()
+    t_ref, _ = timed(legacy_rows, out, mjd0, *columns)
+    print 'per-line writer: %d rows, %.3f s' % (rows, t_ref)
+    t, text = timed(checkreport.residual_table, mjd0,
+                    *(columns + [(None,)*4, (None,)*4]))
+    print 'residual_table, lists with None:  %.3f s (%.1fx)' % (t,
+                                                                t_ref/t)
+    assert ''.join(text.splitlines(True)[4:-1]) == out.getvalue(), \
+        'residual_table differs from the per-line writer'
+    columns[5:9] = [res[name] for name in names]
+    t, text_arrays = timed(checkreport.residual_table, mjd0,
+                           *(columns + [(None,)*4, (None,)*4]))
+    print 'residual_table, arrays with NaN:  %.3f s (%.1fx)' % (t,
+                                                                t_ref/t)
+    assert text_arrays == text
+
+
+def legacy_tracks(mjd, max_len, labels):
+    # Series splitting as orbit_dump.main() used to do it
+    tracks = []
+    for label in sorted(set(labels)):
+        indices = [i for i in xrange(len(mjd)) if labels[i] == label]
+        t = mjd[indices]
+        istart = 0
+        for i in xrange(len(t)):
+            if i == len(t) - 1:
+                iend = i + 1
+            elif t[i] - t[istart] > max_len:
+                iend = i
+            else:
+                continue
+            tracks.append(indices[istart:iend])
+            istart = iend
+    return tracks
+
+
+@benchmark
+def tracks(points=10**4, labels=50, max_len=20):
+    '''split_tracks vs the per-label loops of orbit_dump'''
+    import numpy as np
+    import tracks
+    points, labels = int(float(points)), int(labels)
+    max_len = float(max_len)/1440
+    rng = np.random.RandomState(0)
+    mjd = 56789 + np.cumsum(rng.exponential(30.0/86400, points))
+    names = ['%05d' % k for k in rng.randint(0, labels, points)]
+    # Best of several runs
+    t_ref, ref = min(timed(legacy_tracks, mjd, max_len, names)
+                     for _ in xrange(5))
+    t, result = min(timed(tracks.split_tracks, mjd, max_len, names)
+                    for _ in xrange(5))
+    t_bounds, _ = min(timed(tracks.track_bounds, mjd, max_len)
+                      for _ in xrange(5))
+    print '%d points, %d labels: %d tracks' % (points, labels, len(result))
+    print 'per-label loops: %.0f us' % (t_ref*1e6)
+    print 'split_tracks:    %.0f us' % (t*1e6)
+    print 'speedup: %.1fx' % (t_ref/t)
+    print 'track_bounds without labels: %.0f us' % (t_bounds*1e6)
+    assert [list(rows) for rows in result] == ref, \
+        'split_tracks differs from the per-label loops'
+
+
+@benchmark
+def timing(calls=10**6):
+    '''Cost of a timed stage, disabled and enabled'''
+    import timing
+    calls = int(float(calls))
+    timings = timing.Timings(enabled=False)
+
+    def stages():
+        for _ in xrange(calls):
+            with timings.stage('stage'):
+                pass
+
+    t_loop, _ = timed(lambda: [None for _ in xrange(calls)])
+    for timings.enabled in (False, True):
+        t, _ = timed(stages)
+        print '%-8s %.3f us/stage' % (
+            'enabled' if timings.enabled else 'disabled',
+            max(t - t_loop, 0)/calls*1e6)
+    print timings.summary()
+
+
+@benchmark
+def startup(runs=5):
+    '''Time to first frame of cat.pyw, import time of deferred modules'''
+    import re
+    import subprocess
+    runs = int(runs)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in ('numpy', 'coord', 'catdb', 'plotting',
+                   'matplotlib.figure'):
+        cmd = 'import time; t = time.time(); import %s; ' \
+            'print time.time() - t' % module
+        try:
+            t = min(float(subprocess.check_output([sys.executable, '-c', cmd],
+                                                  cwd=here,
+                                                  stderr=subprocess.STDOUT))
+                    for _ in xrange(runs))
+            print 'import %-18s %.3f s' % (module, t)
+        except (subprocess.CalledProcessError, ValueError):
+            print 'import %-18s not available' % module
+    first, total = [], []
+    for _ in xrange(runs):
+        t0 = time.time()
+        p = subprocess.Popen([sys.executable, 'cat.pyw', '--startup-time'],
+                             cwd=here, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        out = p.communicate()[0]
+        found = re.search(r'Time to first frame: ([0-9.]+) s', out)
+        if p.returncode or not found:
+            print 'cat.pyw failed:\n' + out
+            return
+        total.append(time.time() - t0)
+        first.append(float(found.group(1)))
+    print 'cat.pyw: first frame %.3f s after start of import, ' \
+        '%.3f s from launch to exit (best of %d)' % (min(first), min(total),
+                                                     runs)
+
+
+@benchmark
+def pool(rows=10**6, readers=4, batch=200):
+    '''Read latency of pooled connections while the writer is ingesting'''
+    import shutil
+    import threading
+    import numpy as np
+    import catdb
+    import coord
+    import dbpool
+    rows, readers, batch = int(float(rows)), int(readers), int(batch)
+    fn = scaled_copy(sample_res, rows, suffix='.res')
+    dirname = tempfile.mkdtemp()
+    try:
+        meas, series = coord.read_res_arrays(fn)
+        series['ser_id'] = np.arange(len(series))
+        pool = dbpool.ConnectionPool(os.path.join(dirname, 'res.db'),
+                                     os.path.join(dirname, 'el.db'))
+
+        def ingest(res_conn, el_conn, part):
+            with catdb.BulkWriter(res_conn, el_conn, 0) as writer:
+                writer.add_arrays(meas, part)
+
+        t0 = time.time()
+        writes = [pool.write(ingest, (series[i:i + batch],))
+                  for i in xrange(0, len(series), batch)]
+        latencies = []
+        stop = threading.Event()
+
+        def read():
+            conn = pool.reader()
+            while not stop.is_set():
+                sat_id = np.random.randint(len(series))
+                t = time.time()
+                conn.execute('''SELECT COUNT(*) FROM observations
+                                WHERE sat_id = ?''', (sat_id,)).fetchone()
+                latencies.append(time.time() - t)
+                time.sleep(0.001)
+
+        threads = [threading.Thread(target=read) for _ in xrange(readers)]
+        for thread in threads:
+            thread.start()
+        for pending in writes:
+            pending.wait()
+        t_write = time.time() - t0
+        stop.set()
+        for thread in threads:
+            thread.join()
+        latencies = np.array(latencies)*1e3
+        print 'ingest of %d measurements in %d jobs: %.3f s' % (
+            len(meas), len(writes), t_write)
+        print '%d reads by %d threads meanwhile: median %.2f ms, ' \
+            '99%% %.2f ms, max %.2f ms' % (
+                len(latencies), readers, np.median(latencies),
+                np.percentile(latencies, 99), latencies.max())
+
+        # Cross-database join through the attached elements database
+        conn = pool.reader()
+        groups = conn.execute('''
+            SELECT sat_id, station, series_id, MIN(epoch), MAX(epoch),
+                   COUNT(*)
+            FROM observations GROUP BY sat_id, station, series_id
+            LIMIT 10''').fetchall()
+
+        def add_elements(res_conn, el_conn):
+            el_conn.executemany(catdb._insert_elements, [
+                (sat_id, station, sid, (t1 + t2)/2, t1, t2,
+                 42164.0, 0, 0, 0, 0, 0, 0, None)
+                for sat_id, station, sid, t1, t2, n in groups])
+            el_conn.commit()
+
+        pool.write(add_elements).wait()
+        joined = conn.execute('''
+            SELECT COUNT(*) FROM observations o JOIN el.elements e
+                ON e.sat_id = o.sat_id AND e.station = o.station
+                AND e.series_id = o.series_id''').fetchone()[0]
+        print 'observations joined with elements:', \
+            'OK' if joined == sum(g[-1] for g in groups) else 'FAILED'
+        pool.close()
+    finally:
+        shutil.rmtree(dirname)
+        os.remove(fn)
+
+
+@benchmark
+def iod(copies=100):
+    '''Batched IOD vs the Apex elements of the sample .check, throughput'''
+    import numpy as np
+    import coord
+    import iod
+    copies = int(float(copies))
+    # Station of the sample; its longitude follows from RA - HA
+    site = (48.5635, 22.4565, 0.231)
+
+    meas, series = coord.read_res_arrays(sample_res)
+    check = coord.read_check_arrays(sample_res + '.check')
+    t, (elements, residuals) = timed(iod.fit_res, meas, series, site)
+    print '%d series: %.3f s, %d converged, median %d iterations' % (
+        len(series), t, elements['converged'].sum(),
+        np.median(elements['iterations']))
+
+    # Series of both files by the epoch and RA of the first measurement;
+    # objects in the same frames share epochs
+    mjd = coord.res_mjd(meas['date'], meas['time'])
+    key = lambda t, ra: (round(t, 6), round(ra, 5))
+    first = dict((key(check.residuals['mjd'][s['start']],
+                      check.residuals['RA'][s['start']]), k)
+                 for k, s in enumerate(check.series))
+    ref = dict((r['series'], r) for r in check.iod)
+    pairs = [(k, first.get(key(mjd[s['start']], meas['RA'][s['start']])))
+             for k, s in enumerate(series)]
+    pairs = [(k, c) for k, c in pairs if c in ref]
+    for k, c in pairs:
+        if not elements['converged'][k]:
+            print 'not converged: series %d of %d points, a = %.0f km, ' \
+                'e = %.6f (Apex: %.0f km, %.6f)' % (
+                    k, series['stop'][k] - series['start'][k],
+                    elements['a'][k], elements['e'][k], ref[c]['a'],
+                    ref[c]['e'])
+    pairs = [(k, c) for k, c in pairs if elements['converged'][k]]
+    ours = elements[[k for k, c in pairs]]
+    apex = np.array([ref[c] for k, c in pairs])
+    apex_rms = np.hypot([check.series[c]['int_tan_rms'] for k, c in pairs],
+                        [check.series[c]['int_norm_rms'] for k, c in pairs])
+    diff = [('a, km', np.abs(ours['a'] - apex['a'])),
+            ('e', np.abs(ours['e'] - apex['e'])),
+            ('i, deg', np.abs(ours['i'] - apex['i'])),
+            ('Lon, deg',
+             np.abs((ours['Lon'] - apex['Lon'] + 180) % 360 - 180)),
+            ('RMS, "', np.hypot(ours['tan_rms'], ours['norm_rms']) - apex_rms)]
+    print 'difference from Apex for %d converged series:' % len(pairs)
+    for name, d in diff:
+        print '  %-9s median %10.4f  max %12.4f' % (
+            name, np.median(d), np.abs(d).max())
+
+    # Sample series repeated
+    n = len(meas)
+    offsets = np.repeat(np.arange(copies)*n, len(series))
+    t, (elements, residuals) = timed(
+        iod.fit_arcs, np.tile(mjd, copies), np.tile(meas['RA'], copies),
+        np.tile(meas['DEC'], copies),
+        np.tile(series['start'], copies) + offsets,
+        np.tile(series['stop'], copies) + offsets, site)
+    print '%d series: %.3f s, %.0f series/s' % (len(elements), t,
+                                               len(elements)/t)
+
+
+def scalar_ephemeris(elements, epoch, t, site):
+    # One object at one epoch with the math module, without light time
+    import math
+    import astrodyn
+    a, e, i, W, w, M = elements
+    M = math.radians(M) + math.sqrt(astrodyn.mu/a**3)*(t - epoch)*86400
+    M = math.fmod(M, 2*math.pi)
+    E = M
+    for _ in xrange(50):
+        dE = (E - e*math.sin(E) - M)/(1 - e*math.cos(E))
+        E -= dE
+        if abs(dE) < 1e-12:
+            break
+    i, W, w = math.radians(i), math.radians(W), math.radians(w)
+    x = a*(math.cos(E) - e)
+    y = a*math.sqrt(1 - e*e)*math.sin(E)
+    # Rotate by -w, -i, -W
+    x, y = (x*math.cos(w) - y*math.sin(w), x*math.sin(w) + y*math.cos(w))
+    y, z = y*math.cos(i), y*math.sin(i)
+    x, y = (x*math.cos(W) - y*math.sin(W), x*math.sin(W) + y*math.cos(W))
+    theta = float(astrodyn.gast(t))
+    lon = math.degrees(math.atan2(y, x) - theta) % 360
+    obs = astrodyn.site_state(site[0], site[1], site[2], t)[0]
+    dx, dy, dz = x - obs[0], y - obs[1], z - obs[2]
+    ra = math.degrees(math.atan2(dy, dx)) % 360/15
+    dec = math.degrees(math.atan2(dz, math.hypot(dx, dy)))
+    return (x, y, z), ra, dec, lon
+
+
+@benchmark
+def propagate(objects=1500, hours=12, step=1):
+    '''Batched ephemeris of a GEO catalog vs a per-point reference'''
+    import numpy as np
+    import astrodyn
+    import propagate
+    objects = int(float(objects))
+    # Catalog of the GEO region
+    rng = np.random.RandomState(0)
+    elements = np.column_stack((
+        42164.0 + rng.normal(0, 50, objects), rng.uniform(0, 0.01, objects),
+        rng.uniform(0, 15, objects), rng.uniform(0, 360, objects),
+        rng.uniform(0, 360, objects), rng.uniform(0, 360, objects)))
+    epoch = 56789.0 + rng.uniform(-10, 0, objects)
+    mjd = 56789.75 + np.arange(0, float(hours)*60, float(step))/1440
+    site = (48.5635, 22.4565, 0.231)
+
+    t, eph = timed(propagate.ephemeris, elements, epoch, mjd, site)
+    print '%d objects x %d epochs: %.3f s (%.0f points/s)' % (
+        objects, len(mjd), t, eph.size/t)
+
+    # Reference on a sample; directions differ by the light time, up to
+    # 0.12 s of motion (1.8" in RA for GEO). The reference shares the
+    # sidereal time and station of astrodyn; tests/test_propagate.py checks
+    # against independent ones
+    geo = propagate.ephemeris(elements, epoch, mjd)
+    k = rng.randint(0, objects, 200)
+    j = rng.randint(0, len(mjd), 200)
+    t_ref, ref = timed(lambda: [scalar_ephemeris(elements[a], epoch[a],
+                                                 mjd[b], site)
+                                for a, b in zip(k, j)])
+    print 'per point: %.0f points/s' % (len(ref)/t_ref)
+    dr = max(np.abs(geo['r'][a, b] - r).max()
+             for (a, b), (r, ra, dec, lon) in zip(zip(k, j), ref))
+    dlon = max(abs((eph['Lon'][a, b] - lon + 180) % 360 - 180)
+               for (a, b), (r, ra, dec, lon) in zip(zip(k, j), ref))
+    dra = max(abs((eph['RA'][a, b] - ra + 12) % 24 - 12)*15*3600
+              for (a, b), (r, ra, dec, lon) in zip(zip(k, j), ref))
+    ddec = max(abs(eph['DEC'][a, b] - dec)*3600
+               for (a, b), (r, ra, dec, lon) in zip(zip(k, j), ref))
+    print 'max difference: position %.1e km, Lon %.1e deg' % (dr, dlon)
+    print 'max difference with light time: RA %.2f", Dec %.2f"' % (dra, ddec)
+    assert dr < 1e-6 and dlon < 1e-9, 'ephemeris differs from the reference'
+    assert dra < 3 and ddec < 3, 'directions differ from the reference'
+    r, v = propagate.states(elements, epoch, epoch[:, None])
+    r0, v0 = astrodyn.elements_to_state(*elements.T)
+    dv = np.abs(v[:, 0] - v0).max()
+    print 'velocity at the epoch of the elements: %.1e km/s' % dv
+    assert dv < 1e-9, 'velocity differs from elements_to_state()'
+
+
+def synthetic_catalog(res_conn, el_conn, objects, years, series, points):
+    # GEO objects observed at random nights, "series" tracks each over the
+    # years, with elements at the middle of every track
+    import numpy as np
+    import astrodyn
+    import catdb
+    rng = np.random.RandomState(0)
+    t_start = 56658.0
+    for sat_id in xrange(10000, 10000 + objects):
+        epochs = np.sort(t_start + rng.uniform(0, 365.25*years, series))
+        el = np.column_stack((
+            42164.0 + rng.normal(0, 30, series),
+            rng.uniform(0, 1e-3, series), rng.uniform(0, 15, series),
+            rng.uniform(0, 360, (3, series)).T))
+        lon = astrodyn.sublon(astrodyn.elements_to_state(*el.T)[0], epochs)
+        t = epochs[:, None] + np.arange(points)/1440.0
+        sids = [catdb.series_id(e) for e in epochs]
+        res_conn.executemany(catdb._insert_observations, (
+            (sat_id, 1, sids[k], t[k, j], None, None, rng.uniform(0, 24),
+             rng.uniform(-10, 10), None)
+            for k in xrange(series) for j in xrange(points)))
+        mid = t[:, points//2]
+        el_conn.executemany(catdb._insert_elements, (
+            (sat_id, 1, sids[k], mid[k], t[k, 0], t[k, -1]) +
+            tuple(el[k]) + (lon[k], None) for k in xrange(series)))
+    res_conn.commit()
+    el_conn.commit()
+    return t_start
+
+
+def query_plan(conn, sql, args):
+    return '; '.join(row[-1] for row in conn.execute(
+        'EXPLAIN QUERY PLAN ' + sql, args))
+
+
+@benchmark
+def query(objects=2000, years=10, series=100, points=10, lookups=100):
+    '''Range queries on a synthetic multi-year catalog'''
+    import shutil
+    import numpy as np
+    import catdb
+    import propagate
+    import query
+    objects, years = int(float(objects)), float(years)
+    series, points = int(float(series)), int(float(points))
+    lookups = int(lookups)
+    dirname = tempfile.mkdtemp()
+    try:
+        res_conn, el_conn = catdb.connect(
+            os.path.join(dirname, 'res.db'), os.path.join(dirname, 'el.db'),
+            synchronous='OFF')
+        t, t_start = timed(synthetic_catalog, res_conn, el_conn, objects,
+                           years, series, points)
+        print '%d objects, %.0f years: %d observations, %d elements, ' \
+            'built in %.1f s' % (
+                objects, years, objects*series*points, objects*series, t)
+        rng = np.random.RandomState(1)
+        sats = 10000 + rng.randint(0, objects, lookups)
+        t0s = t_start + rng.uniform(0, 365.25*(years - 1), lookups)
+
+        t, result = timed(lambda: [query.observations(res_conn, sat, t0,
+                                                      t0 + 365.25)
+                                   for sat, t0 in zip(sats, t0s)])
+        print 'observations, 1 year of one object: %.2f ms, %.0f rows' % (
+            t/lookups*1e3, np.mean([len(r) for r in result]))
+        sql = """SELECT epoch, station, series_id, RA, DEC, m FROM
+            observations NOT INDEXED WHERE sat_id = ? AND epoch >= ? AND
+            epoch <= ? ORDER BY epoch"""
+        t_ref, ref = timed(lambda: [query.fetch_array(res_conn.execute(
+            sql, (sat, t0, t0 + 365.25)), query.OBSERVATION_DTYPE)
+            for sat, t0 in zip(sats[:3], t0s[:3])])
+        print '  without indexes: %.2f ms (%s)' % (
+            t_ref/3*1e3, 'same rows' if all(
+                a.tobytes() == b.tobytes() for a, b in zip(ref, result))
+            else 'DIFFERS')
+        print '  plan:', query_plan(res_conn, sql.replace(' NOT INDEXED', ''),
+                                    (sats[0], t0s[0], t0s[0] + 365.25))
+
+        t, result = timed(lambda: [query.elements_history(
+            el_conn, sat, ('a', 'Lon')) for sat in sats])
+        print 'elements_history, a and Lon over %.0f years: %.2f ms' % (
+            years, t/lookups*1e3)
+
+        epoch = t_start + 365.25*years/2
+        t, band = timed(query.objects_in_longitude_band, el_conn, 350, 60,
+                        epoch)
+        print 'objects_in_longitude_band 350..60 deg: %.2f ms, %d objects' \
+            % (t*1e3, len(band))
+        print '  plan:', query_plan(el_conn, """SELECT sat_id, MAX(epoch)
+            FROM elements WHERE epoch BETWEEN ? AND ? AND a IS NOT NULL
+            GROUP BY sat_id""", (epoch - query.max_age, epoch))
+
+        # All elements read and reduced in NumPy
+        def full_scan():
+            rows = query.fetch_array(el_conn.execute(
+                """SELECT sat_id, station, series_id, epoch, a, e, i, W, we,
+                          M, Lon FROM elements"""), query.BAND_DTYPE)
+            rows = rows[(rows['epoch'] <= epoch) &
+                        (rows['epoch'] >= epoch - query.max_age)]
+            rows = rows[np.lexsort((rows['epoch'], rows['sat_id']))]
+            last = np.r_[rows['sat_id'][1:] != rows['sat_id'][:-1], True]
+            rows = rows[last]
+            lon = propagate.ephemeris(
+                np.column_stack([rows[name] for name in
+                                 ('a', 'e', 'i', 'W', 'w', 'M')]),
+                rows['epoch'], [epoch])['Lon'][:, 0]
+            return rows['sat_id'][(lon >= 350) | (lon <= 60)]
+        t_ref, ref = timed(full_scan)
+        print '  full table scan: %.2f ms (%s)' % (
+            t_ref*1e3, 'same objects' if np.array_equal(
+                ref, band['sat_id']) else 'DIFFERS')
+        res_conn.close()
+        el_conn.close()
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print 'Available benchmarks:'
+        for name in sorted(benchmarks):
+            print '  %-12s %s' % (name, benchmarks[name].__doc__)
+        sys.exit(1)
+    benchmarks[sys.argv[1]](**dict(arg.split('=', 1) for arg in sys.argv[2:]))
@@ -3,29 +3,39 @@
 
 # This is a main unit of Uzhgorod geo catalog program
 # Dependences: wx, matplotlib, numpy
+#
+# Only wx is imported before the main window is shown; numpy, matplotlib and
+# the catalog modules are imported by the worker thread right after that,
+# and the plot is created once they are loaded or when the View page is
+# opened, whichever comes first. Databases are opened on first use. The time
+# to the first frame is printed; with --startup-time the program exits right
+# after that.
+
+import time
+start_time = time.time()
 
 import wx
 import wx.xrc as xrc
 wx = wx  # just the trick :)
 import os
-import sqlite3
-import matplotlib
-matplotlib.use('WXAgg')
-import matplotlib.figure as figure
-import matplotlib.backends.backend_wxagg as wxagg
-import numpy as np
-
-res = []
-check, check_match = [], []
+import Queue
+import sys
+import threading
+import traceback
 
+index = None  # coord.CatalogIndex of the loaded files
 
-res_conn = sqlite3.connect("cat_res.db")
-res_c = res_conn.cursor()
-print 'Connecting to RES database ...'
 
-el_conn = sqlite3.connect("cat_elemants.db")
-el_c = el_conn.cursor()
-print 'Connecting to ELEMENTS database ...'
+def preload():
+    '''
+    Worker job: import the modules needed for loading files and plotting
+    '''
+    import numpy
+    import coord
+    import rescache
+    import catdb
+    import plotting
+    import matplotlib.figure
 
 
 def warn(parent, message, caption='Warning!'):
@@ -34,7 +44,84 @@ def warn(parent, message, caption='Warning!'):
     dlg.Destroy()
 
 
+class Worker(threading.Thread):
+    """
+    Background thread running file parsing and database reading jobs one at
+    a time. Writes to the catalog databases go to the writer thread of the
+    connection pool, so that reading is never blocked by them.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self, name='catalog worker')
+        self.daemon = True
+        self.jobs = Queue.Queue()
+        # Cancellation flag of the running job
+        self.cancelled = threading.Event()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.start()
+
+    def submit(self, job, done=None, *args):
+        '''
+        Queue job(*args) for execution
+        :param done: called on the main thread with the job result, or with
+            None if the job failed
+        :return: threading.Event cancelling the job, even before it starts;
+            the job polls it as self.cancelled
+        '''
+        cancelled = threading.Event()
+        self.jobs.put((job, args, done, cancelled))
+        return cancelled
+
+    def cancel(self):
+        '''
+        Ask the running job to stop
+        '''
+        self.cancelled.set()
+
+    def pool(self):
+        '''
+        Called by worker jobs only, so that the databases are never opened
+        on the main thread
+        :return: dbpool.ConnectionPool of the catalog databases, created on
+            first use
+        '''
+        with self._pool_lock:
+            if self._pool is None:
+                import dbpool
+                print 'Connecting to RES and ELEMENTS databases ...'
+                self._pool = dbpool.ConnectionPool()
+            return self._pool
+
+    def stop(self):
+        self.cancel()
+        self.jobs.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                break
+            job, args, done, self.cancelled = item
+            result = None
+            try:
+                result = job(*args)
+            except Exception as E:
+                traceback.print_exc()
+                wx.CallAfter(warn, None, "%s failed\n%s: %s" % (
+                    getattr(job, '__name__', 'Job'), type(E).__name__, E))
+            finally:
+                if done is not None:
+                    wx.CallAfter(done, result)
+        if self._pool is not None:
+            print "Close database..."
+            self._pool.close()
+
+
 class MyApp(wx.App):
+    # Number of series appended to the list box at a time
+    list_chunk = 2000
+
     def OnInit(self):
         if os.path.exists("cat_gui.xrc"):
             self.res = xrc.XmlResource("cat_gui.xrc")
@@ -43,11 +130,24 @@ class MyApp(wx.App):
             self.panel = xrc.XRCCTRL(self.frame, "panel_1")
             # self.panel2 = xrc.XRCCTRL(self.frame, "panel_2")
             self.statusbar = xrc.XRCCTRL(self.frame, "frame_1_statusbar")
+            self.statusbar.SetFieldsCount(2)
+            self.statusbar.SetStatusWidths([-1, 150])
             self.statusbar.SetStatusText('FileName=', 0)
+            self.gauge = wx.Gauge(self.statusbar, range=1000,
+                                  style=wx.GA_HORIZONTAL | wx.GA_SMOOTH)
+            self.statusbar.Bind(wx.EVT_SIZE, self.place_gauge)
+            self.place_gauge()
+            self.parse_cache = None
+            self.plot = None
+            self.sats = []
+            self.loading = 0  # number of the current file load, 0 if idle
+            self.loads = 0
+            self.worker = Worker()
 
             self.list_box = xrc.XRCCTRL(self.frame, "list_box_1")
             self.notebook = xrc.XRCCTRL(self.frame, "notebook_1")
             self.load_bt = xrc.XRCCTRL(self.panel, "button_1")
+            self.load_label = self.load_bt.GetLabel()
             self.list_ctrl = xrc.XRCCTRL(self.frame, "list_ctrl_1")
             self.combo_box = xrc.XRCCTRL(self.frame, "combo_box_1")
             self.radio_box = xrc.XRCCTRL(self.frame, "radio_box_1")
@@ -74,7 +174,7 @@ class MyApp(wx.App):
             self.frame.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.load_db, id=xrc.XRCID("notebook_1"))
             # self.frame.Bind(wx.EVT_CHECKBOX, self.On_m0_ch, id=xrc.XRCID('checkbox_1'))
             self.Bind(wx.EVT_BUTTON, self.OnAdd, id=xrc.XRCID("button_2"))
-            # self.Bind(wx.EVT_COMBOBOX, self.select_sat, id=xrc.XRCID("combo_box_1"))
+            self.Bind(wx.EVT_COMBOBOX, self.draw_element, id=xrc.XRCID("combo_box_1"))
             self.Bind(wx.EVT_RADIOBOX, self.draw_element, id=xrc.XRCID("radio_box_1"))
 
             # self.Bind(wx.EVT_KEY_DOWN, self.OnKeyLb, id=xrc.XRCID('lb_nps'))
@@ -85,17 +185,32 @@ class MyApp(wx.App):
             # global self_path
             # self_path = os.path.dirname(os.path.abspath(__file__))
             wx.CallAfter(self.list_box.SetFocus)
-            self.create_main_panel()
+            wx.CallAfter(self.first_frame)
         else:
             print "File cat_gui.xrc don't find"
         return True
 
+    def first_frame(self):
+        print 'Time to first frame: %.3f s' % (time.time() - start_time)
+        if '--startup-time' in sys.argv[1:]:
+            self.frame.Close()
+        else:
+            self.worker.submit(preload,
+                               lambda result: self.create_main_panel())
+
     def create_main_panel(self):
         """ Creates the main panel with all the controls on it:
              * mpl canvas
              * mpl navigation toolbar
              * Control panel for interaction
         """
+        if self.plot is not None:
+            return
+        import matplotlib
+        matplotlib.use('WXAgg')
+        import matplotlib.figure as figure
+        import matplotlib.backends.backend_wxagg as wxagg
+        from plotting import ElementPlot
         self.panel3 = xrc.XRCCTRL(self.frame, "panel_3")
         # Create the mpl Figure and FigCanvas objects.
         # 5x3 inches, 100 dots-per-inch
@@ -104,6 +219,7 @@ class MyApp(wx.App):
         self.fig = figure.Figure((5.0, 3.0), dpi=self.dpi)
         self.canvas = wxagg.FigureCanvasWxAgg(self.panel3, -1, self.fig)
         self.axes = self.fig.add_subplot(111)
+        self.plot = ElementPlot(self.axes)
         # Create the navigation toolbar, tied to the canvas
         self.toolbar = wxagg.NavigationToolbar2WxAgg(self.canvas)
         #
@@ -117,106 +233,216 @@ class MyApp(wx.App):
         self.panel3.SetSizer(self.vbox)
         self.vbox.Fit(self.panel3)
 
+    def place_gauge(self, evt=None):
+        rect = self.statusbar.GetFieldRect(1)
+        self.gauge.SetPosition((rect.x + 1, rect.y + 1))
+        self.gauge.SetSize((rect.width - 2, rect.height - 2))
+        if evt is not None:
+            evt.Skip()
+
+    def progress(self, load, fraction, text=None):
+        if load == self.loading:
+            self.gauge.SetValue(int(fraction*self.gauge.GetRange()))
+            if text is not None:
+                self.statusbar.SetStatusText(text, 0)
+
     def load_res(self, evt):
-        from coord import read_res, read_check
-        self.list_box.Set("")
-        wildcard = "RES(*.res)|*.res;*.RES"
+        if self.loading:
+            # The button reads "Cancel" while files are being loaded
+            self.load_cancelled.set()
+            return
+        wildcard = "RES(*.res)|*.res;*.RES;*.res.gz;*.res.bz2;*.res.xz"
         dlg = wx.FileDialog(self.frame, message="Choose File", defaultDir=os.getcwd(),
                             defaultFile='', wildcard=wildcard, style=wx.OPEN | wx.CHANGE_DIR)
         if dlg.ShowModal() == wx.ID_OK:
-            paths = dlg.GetPaths()
-            global res, check, check_match
-            for path in paths:
-                try:
-                    res = read_res(path)
-                    for sat in res:
-                        self.list_box.Append(str(sat.ser_id))
-                    check, check_match = read_check(path + ".check")
-                    # print res[1].ser_id, check_match[1].sat_ID, check[1].a, check_match[1].a
-                except:
-                    warn(self.frame, "Wrong file format probably")
-            self.statusbar.SetStatusText('FileName=' + os.path.basename(path), 0)
+            from coord import CatalogIndex
+            global index
+            index = CatalogIndex()
+            self.list_box.Set([])
+            self.loads += 1
+            self.loading = self.loads
+            self.load_bt.SetLabel('Cancel')
+            self.load_cancelled = self.worker.submit(
+                self.read_files, self.files_loaded, self.loading,
+                dlg.GetPaths())
         dlg.Destroy()
 
+    def read_files(self, load, paths):
+        '''
+        Worker job: parse the .res files and their .check files, posting the
+        series to the list box in chunks
+        '''
+        from coord import SeriesBlock, check_elements, check_name
+        from rescache import ParseCache
+        if self.parse_cache is None:
+            self.parse_cache = ParseCache()
+        cancelled = self.worker.cancelled
+        path = ''
+        for n, path in enumerate(paths):
+            if cancelled.is_set():
+                break
+            wx.CallAfter(self.progress, load, float(n)/len(paths),
+                         'Reading ' + os.path.basename(path))
+            try:
+                block = SeriesBlock(*self.parse_cache.load_res(path))
+            except Exception:
+                traceback.print_exc()
+                wx.CallAfter(warn, self.frame,
+                             "Wrong file format probably\n" + path)
+                continue
+            # The series are listed even without their elements
+            try:
+                elements = check_elements(
+                    self.parse_cache.load_check(check_name(path)))
+            except Exception:
+                traceback.print_exc()
+                wx.CallAfter(warn, self.frame,
+                             "Cannot read elements\n" + check_name(path))
+            else:
+                wx.CallAfter(self.append_elements, load, *elements)
+            for i in xrange(0, len(block), self.list_chunk):
+                if cancelled.is_set():
+                    break
+                wx.CallAfter(self.append_series, load,
+                             block[i:i + self.list_chunk])
+                wx.CallAfter(self.progress, load,
+                             (n + float(i)/len(block))/len(paths))
+        print self.parse_cache.stats()
+        return load, path, cancelled.is_set()
+
+    def append_elements(self, load, el, el_match):
+        if load == self.loading:
+            index.add_elements(el, el_match)
+
+    def append_series(self, load, series):
+        if load == self.loading:
+            index.add_series(series)
+            self.list_box.AppendItems([str(ser.ser_id) for ser in series])
+
+    def files_loaded(self, result):
+        self.loading = 0
+        self.load_bt.SetLabel(self.load_label)
+        self.gauge.SetValue(0)
+        if result is None:
+            self.statusbar.SetStatusText('Loading failed', 0)
+            return
+        load, path, cancelled = result
+        if cancelled:
+            self.statusbar.SetStatusText('Loading cancelled', 0)
+        else:
+            self.statusbar.SetStatusText('FileName=' + os.path.basename(path), 0)
+
     def show_el(self, evt):
         sel = self.list_box.GetSelections()
-        # print sel, len(sel)
-        if sel:
-            sel = sel[0]
-        # print "graph", self.list_box.GetItems()[sel]
-        global check, check_match
-        if check:
-            for el in check:
-                if el.sat_ID == self.list_box.GetItems()[sel]:
-                    self.list_ctrl.SetStringItem(0, 1, el.sat_ID)
-                    self.list_ctrl.SetStringItem(1, 1, '%.7f' % el.a)
-                    self.list_ctrl.SetStringItem(2, 1, '%.10f' % el.e)
-                    self.list_ctrl.SetStringItem(3, 1, '%.10f' % el.i)
-                    self.list_ctrl.SetStringItem(4, 1, '%.10f' % el.W)
-                    self.list_ctrl.SetStringItem(5, 1, '%.10f' % el.w)
-                    self.list_ctrl.SetStringItem(6, 1, '%.10f' % el.M)
-                    self.list_ctrl.SetStringItem(7, 1, '%.2f' % el.Lon)
-                    elm = check_match[check.index(el)]  # matched elements
-                    self.list_ctrl.SetStringItem(0, 2, elm.sat_ID)
-                    self.list_ctrl.SetStringItem(1, 2, '%.7f' % elm.a)
-                    self.list_ctrl.SetStringItem(2, 2, '%.10f' % elm.e)
-                    self.list_ctrl.SetStringItem(3, 2, '%.10f' % elm.i)
-                    self.list_ctrl.SetStringItem(4, 2, '%.10f' % elm.W)
-                    self.list_ctrl.SetStringItem(5, 2, '%.10f' % elm.w)
-                    self.list_ctrl.SetStringItem(6, 2, '%.10f' % elm.M)
+        if not sel or index is None:
+            return
+        rows = index.element_rows(index.series[sel[0]].ser_id)
+        if rows:
+            k = rows[0]
+            el = index.check[k]
+            self.list_ctrl.SetStringItem(0, 1, el.sat_ID)
+            self.list_ctrl.SetStringItem(1, 1, '%.7f' % el.a)
+            self.list_ctrl.SetStringItem(2, 1, '%.10f' % el.e)
+            self.list_ctrl.SetStringItem(3, 1, '%.10f' % el.i)
+            self.list_ctrl.SetStringItem(4, 1, '%.10f' % el.W)
+            self.list_ctrl.SetStringItem(5, 1, '%.10f' % el.w)
+            self.list_ctrl.SetStringItem(6, 1, '%.10f' % el.M)
+            self.list_ctrl.SetStringItem(7, 1, '%.2f' % el.Lon)
+            elm = index.check_match[k]  # matched elements
+            self.list_ctrl.SetStringItem(0, 2, elm.sat_ID)
+            self.list_ctrl.SetStringItem(1, 2, '%.7f' % elm.a)
+            self.list_ctrl.SetStringItem(2, 2, '%.10f' % elm.e)
+            self.list_ctrl.SetStringItem(3, 2, '%.10f' % elm.i)
+            self.list_ctrl.SetStringItem(4, 2, '%.10f' % elm.W)
+            self.list_ctrl.SetStringItem(5, 2, '%.10f' % elm.w)
+            self.list_ctrl.SetStringItem(6, 2, '%.10f' % elm.M)
 
     def load_db(self, evt):
         if self.notebook.GetSelection() == 1:  # View page
+            self.create_main_panel()
             print "Read elements db..."
-            sat_list = el_conn.execute("SELECT name FROM sqlite_master WHERE type='table' ").fetchall()
-            sl = []
-            for t in sat_list:
-                sl.append(t[0])
-            self.combo_box.Clear()
-            self.combo_box.AppendItems(sl)
-            self.combo_box.SetSelection(0)
+            self.worker.submit(self.read_satellites, self.fill_satellites)
+
+    def read_satellites(self):
+        '''
+        Worker job: IDs of the satellites in the elements database
+        '''
+        import catdb
+        return catdb.satellites(self.worker.pool().reader())
+
+    def fill_satellites(self, sats):
+        if sats is None:
+            return
+        self.sats = sats
+        self.combo_box.Clear()
+        self.combo_box.AppendItems([str(sat_id) for sat_id in sats])
+        self.combo_box.SetSelection(0)
+        self.draw_element(None)
 
     def OnAdd(self, evt):
         sel = self.list_box.GetSelections()
-        # print sel, len(sel)
-        if sel:
-            sel = sel[0]
-        s_id = self.list_box.GetItems()[sel]
+        if not sel or index is None:
+            return
+        sel = sel[0]
+        s_id = self.list_box.GetString(sel)
         if s_id[-1] != '+':
-            res_c.execute("""CREATE TABLE if not exists '%s' (satid INTEGER, date INTEGER, time FLOAT UNIQUE, RA FLOAT, DEC FLOAT, m FLOAT)""" % s_id)
-            el_c.execute("""CREATE TABLE if not exists '%s' (satid INTEGER, date INTEGER, time1 FLOAT UNIQUE, time2 FLOAT, a FLOAT, e FLOAT, i FLOAT, W FLOAT, we FLOAT, M FLOAT, Lon FLOAT)""" % s_id)
-            global res, check, check_match
-            coo = res[sel].coord
-            for c in coo:
-                res_c.execute("""insert or ignore into '%s' values (%s,%i,%f,%f,%f,%f)"""
-                              % (s_id, s_id, c.date, c.time, c.RA, c.DEC, c.m))
-            for el in check:
-                if el.sat_ID == self.list_box.GetItems()[sel]:
-                    el_c.execute("""insert or ignore into '%s' values (%s,%i,%f,%f,%f,%f,%f,%f,%f,%f,%f)"""
-                                 % (el.sat_ID, el.sat_ID, coo[0].date, coo[0].time, coo[-1].time, el.a, el.e, el.i, el.W, el.w, el.M, el.Lon))
-            res_conn.commit()
-            el_conn.commit()
-            print s_id, "Added to DB"
+            ser = index.series[sel]
+            check, check_match = index.elements(ser.ser_id)
+            self.worker.submit(self.add_series, None, ser, check, check_match,
+                               sel)
+
+    def add_series(self, ser, check, check_match, sel):
+        '''
+        Worker job: queue the series for the writer thread of the pool
+        '''
+        import catdb
+        self.worker.pool().write(
+            catdb.add_series, (ser, check, check_match),
+            lambda pending: wx.CallAfter(self.series_added, pending, sel,
+                                         ser.ser_id))
+
+    def series_added(self, pending, sel, sat_id):
+        s_id = str(sat_id)
+        if pending.error is not None:
+            warn(self.frame, "Cannot add %s to DB\n%s" % (s_id, pending.error))
+            return
+        print s_id, "Added to DB"
+        if self.plot is not None:
+            self.plot.forget(sat_id)
+        if self.list_box.GetString(sel) == s_id:
             self.list_box.SetString(sel, s_id + "+")
 
     def draw_element(self, evt):
-        n_e = self.radio_box.GetSelection()
         n_s = self.combo_box.GetSelection()
-        print "Graph " + self.radio_box.GetString(n_e) + " for " + self.combo_box.GetString(n_s)
-        """ Redraws the figure"""
-        # clear the axes and redraw the plot anew
-        #
-        self.axes.clear()
-        x, y = np.random.random((10, 2)).T
-        self.axes.scatter(x, y)
-        self.canvas.draw()
+        if not 0 <= n_s < len(self.sats):
+            return
+        key = (self.sats[n_s],
+               self.radio_box.GetString(self.radio_box.GetSelection()))
+        if self.plot.cached(key):
+            self.plot.show(key)
+        else:
+            self.worker.submit(self.read_element, self.element_read, key)
+
+    def read_element(self, key):
+        '''
+        Worker job: epochs and values of an element of a satellite
+        '''
+        import query
+        sat_id, element = key
+        history = query.elements_history(self.worker.pool().reader(), sat_id,
+                                         (element,))
+        # Skip NULL (NaN) values
+        history = history[history[element] == history[element]]
+        return key, (history['epoch'], history[element])
+
+    def element_read(self, result):
+        if result is not None:
+            self.plot.show(*result)
 
     def OnDestroy(self, event):
         ## clean up resources as needed here
         # event.Skip()
-        print "Close database..."
-        res_conn.close()
-        el_conn.close()
+        self.worker.stop()
         self.Exit()
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@ sat_N = 95232
 
 from coord import *
 
-res = read_res(filename)
-check, check_match = read_check(filename+'.check')
-print res[1].ser_id, check_match[1].sat_ID, check[1].a, check_match[1].a
+for ser in iter_res(filename):
+    print ser.st_id, ser.ser_id, len(ser.coord)
+for el, el_match in iter_check(check_name(filename)):
+    print el.sat_ID, el_match.sat_ID, el.a, el_match.a
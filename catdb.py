@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+
+# Catalog databases
+#
+# cat_res.db holds all measurements in the "observations" table and
+# cat_elemants.db all orbital elements in the "elements" table. Rows of both
+# are keyed by (sat_id, station, series_id, epoch), where epoch is MJD (UTC)
+# of the measurement or of the osculating elements, and series_id identifies
+# a series by the epoch of its first measurement in integer seconds since
+# MJD 0, so that re-ingesting the same file never duplicates rows. SQLite
+# column names are case-insensitive, so the argument of perigee w is stored
+# as "we" next to the node longitude W.
+#
+# Element sets are first committed to "pending_elements" in cat_res.db, in
+# one transaction with their observations, and then moved to the elements
+# table; a flush interrupted in between is completed by the next one, so
+# observations are never left without their elements.
+#
+# Earlier versions kept one table per satellite in both files; migrate()
+# converts such databases.
+#
+# Usage:
+#   python catdb.py migrate [--station N] [--drop] [--res-db <res db>]
+#                           [--el-db <elements db>]
+
+import sqlite3
+
+import numpy as np
+
+from coord import res_mjd, round_res
+from tracks import track_starts
+
+res_db = 'cat_res.db'
+el_db = 'cat_elemants.db'
+
+res_schema = """
+CREATE TABLE IF NOT EXISTS observations (
+    sat_id INTEGER NOT NULL,
+    station INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    epoch REAL NOT NULL,
+    date INTEGER,
+    time REAL,
+    RA REAL,
+    DEC REAL,
+    m REAL,
+    UNIQUE (sat_id, station, series_id, epoch));
+CREATE INDEX IF NOT EXISTS observations_sat_epoch
+    ON observations (sat_id, epoch);
+CREATE INDEX IF NOT EXISTS observations_epoch ON observations (epoch);
+CREATE TABLE IF NOT EXISTS pending_elements (
+    sat_id INTEGER NOT NULL,
+    station INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    epoch REAL NOT NULL,
+    t_start REAL,
+    t_stop REAL,
+    a REAL,
+    e REAL,
+    i REAL,
+    W REAL,
+    we REAL,
+    M REAL,
+    Lon REAL,
+    match_id TEXT);
+"""
+
+el_schema = """
+CREATE TABLE IF NOT EXISTS elements (
+    sat_id INTEGER NOT NULL,
+    station INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    epoch REAL NOT NULL,
+    t_start REAL,
+    t_stop REAL,
+    a REAL,
+    e REAL,
+    i REAL,
+    W REAL,
+    we REAL,
+    M REAL,
+    Lon REAL,
+    match_id TEXT,
+    UNIQUE (sat_id, station, series_id, epoch));
+CREATE INDEX IF NOT EXISTS elements_sat_epoch ON elements (sat_id, epoch);
+CREATE INDEX IF NOT EXISTS elements_epoch ON elements (epoch);
+CREATE INDEX IF NOT EXISTS elements_a ON elements (a);
+"""
+
+# Largest distance of the elements epoch from the series, days
+epoch_tolerance = 1.0/1440
+
+# Gap between measurements that starts a new series when migrating, days
+series_gap = 1.0/24
+
+
+def series_id(epoch):
+    '''
+    :param epoch: MJD of the first measurement of a series
+    :return: series ID
+    '''
+    return int(round(epoch*86400))
+
+
+# Measurements already stored with the same satellite and epoch, e.g. by
+# migrate() under another series or station, are skipped
+_insert_observations = \
+    """INSERT OR IGNORE INTO observations
+       SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9 WHERE NOT EXISTS (
+           SELECT 1 FROM observations WHERE sat_id = ?1 AND epoch = ?4)"""
+# Likewise, element sets of a series already stored are skipped: migrate()
+# keys them by the middle of the series and the given station, ingesting by
+# the osculating epoch and the real station, so the series is recognized by
+# the satellite and the overlap of the measurement time spans
+_insert_elements = \
+    """INSERT OR IGNORE INTO elements
+       SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11, ?12, ?13, ?14
+       WHERE NOT EXISTS (
+           SELECT 1 FROM elements WHERE sat_id = ?1 AND t_start <= ?6 AND
+               t_stop >= ?5)"""
+
+_insert_pending = \
+    """INSERT INTO pending_elements VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"""
+
+_synchronous_modes = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def connect(res_name=res_db, el_name=el_db, wal=True, synchronous='NORMAL'):
+    '''
+    :param wal: use write-ahead logging, so that readers are not blocked by
+        a writer
+    :param synchronous: SQLite synchronous mode, one of OFF, NORMAL, FULL,
+        EXTRA; NORMAL is safe in WAL mode
+    :return: (res_conn, el_conn) - connections to both catalog databases,
+        with the schema created if needed
+    '''
+    synchronous = synchronous.upper()
+    if synchronous not in _synchronous_modes:
+        raise ValueError('Unknown synchronous mode: %s' % synchronous)
+    conns = sqlite3.connect(res_name), sqlite3.connect(el_name)
+    for conn, schema in zip(conns, (res_schema, el_schema)):
+        if wal:
+            conn.execute("""PRAGMA journal_mode=WAL""")
+        conn.execute("""PRAGMA synchronous=%s""" % synchronous)
+        conn.executescript(schema)
+    return conns
+
+
+def _element_rows(sat_id, station, sid, t_start, t_stop, check, check_match):
+    sat_ID = str(sat_id)
+    el_rows = []
+    for k, el in enumerate(check):
+        if el.sat_ID != sat_ID:
+            continue
+        epoch = el.epoch
+        if epoch is None:
+            epoch = (t_start + t_stop)/2
+        elif not (t_start - epoch_tolerance <= epoch <=
+                  t_stop + epoch_tolerance):
+            continue
+        match_id = check_match[k].sat_ID if check_match else ''
+        el_rows.append((sat_id, station, sid, epoch, t_start, t_stop,
+                        el.a, el.e, el.i, el.W, el.w, el.M, el.Lon,
+                        match_id or None))
+    return el_rows
+
+
+class BulkWriter(object):
+    """
+    Buffered writer of observations and elements
+
+    Rows are inserted with executemany() and bound parameters, so values keep
+    their full float64 precision. Each flush commits the observations with
+    their element sets in one transaction, and then moves the element sets
+    to the elements database (see recover()). Buffers are flushed
+    automatically once they hold batch_size observations (never if
+    batch_size is 0). Usable as a context manager, which flushes on exit.
+    """
+    def __init__(self, res_conn, el_conn, batch_size=100000):
+        self.res_conn = res_conn
+        self.el_conn = el_conn
+        self.batch_size = batch_size
+        self.obs_rows = []
+        self.el_rows = []
+        self.count = 0
+
+    def add_series(self, ser, check=(), check_match=None):
+        '''
+        :param ser: seriya (or a SeriesBlock view)
+        :param check: array of elements class; those of the same satellite
+            with the epoch within the series are stored along with it
+        :param check_match: matched elements, parallel to check
+        '''
+        coo = ser.coord
+        if not len(coo):
+            return
+        rows = [(c.date, c.time, c.RA, c.DEC, c.m) for c in coo]
+        date, time = zip(*rows)[:2]
+        epochs = res_mjd(date, time).tolist()
+        sid = series_id(epochs[0])
+        self.obs_rows.extend((ser.ser_id, ser.st_id, sid, epoch) + row
+                             for epoch, row in zip(epochs, rows))
+        self.el_rows.extend(_element_rows(
+            ser.ser_id, ser.st_id, sid, epochs[0], epochs[-1], check,
+            check_match))
+        self._added(len(rows))
+
+    def add_arrays(self, meas, series, check=(), check_match=None):
+        '''
+        Add all series of a file at once
+        :param meas, series: arrays as returned by coord.read_res_arrays()
+        :param check, check_match: as in add_series()
+        '''
+        series = series[series['stop'] > series['start']]
+        if not len(series):
+            return
+        epochs = res_mjd(meas['date'], meas['time'])
+        start, stop = series['start'], series['stop']
+        lengths = stop - start
+        rows = np.repeat(np.arange(len(series)), lengths)
+        idx = np.concatenate([np.arange(a, b) for a, b in zip(start, stop)])
+        sids = [series_id(t) for t in epochs[start].tolist()]
+        obs_rows = zip(
+            series['ser_id'][rows].tolist(), series['st_id'][rows].tolist(),
+            np.array(sids, np.int64)[rows].tolist(), epochs[idx].tolist(),
+            meas['date'][idx].tolist(), meas['time'][idx].tolist(),
+            meas['RA'][idx].tolist(), meas['DEC'][idx].tolist(),
+            meas['m'][idx].tolist())
+        el_rows = []
+        for (st_id, ser_id, _, _), sid, t_start, t_stop in zip(
+                series.tolist(), sids, epochs[start].tolist(),
+                epochs[stop - 1].tolist()):
+            el_rows.extend(_element_rows(
+                ser_id, st_id, sid, t_start, t_stop, check, check_match))
+        self.obs_rows.extend(obs_rows)
+        self.el_rows.extend(el_rows)
+        self._added(len(idx))
+
+    def _added(self, n):
+        self.count += n
+        if self.batch_size and len(self.obs_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write buffered rows
+        '''
+        try:
+            self.res_conn.executemany(_insert_observations, self.obs_rows)
+            self.res_conn.executemany(_insert_pending, self.el_rows)
+            self.res_conn.commit()
+        except:
+            self.res_conn.rollback()
+            raise
+        finally:
+            self.obs_rows = []
+            self.el_rows = []
+        self.recover()
+
+    def recover(self):
+        '''
+        Move element sets committed along with their observations to the
+        elements database, including those left by an interrupted flush
+        :return: number of element sets moved
+        '''
+        rows = self.res_conn.execute(
+            """SELECT rowid, * FROM pending_elements ORDER BY rowid"""
+        ).fetchall()
+        if not rows:
+            return 0
+        try:
+            self.el_conn.executemany(_insert_elements,
+                                     [row[1:] for row in rows])
+            self.el_conn.commit()
+        except:
+            self.el_conn.rollback()
+            raise
+        # Moving the same rows again after a failure here inserts nothing
+        self.res_conn.execute(
+            """DELETE FROM pending_elements WHERE rowid <= ?""",
+            (rows[-1][0],))
+        self.res_conn.commit()
+        return len(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.obs_rows = []
+            self.el_rows = []
+
+
+def add_series(res_conn, el_conn, ser, check, check_match=None):
+    '''
+    Store a series and its elements in one transaction
+    :param res_conn: connection to the measurements database
+    :param el_conn: connection to the elements database
+    :param ser: seriya (or a SeriesBlock view)
+    :param check: array of elements class; those of the same satellite with
+        the epoch within the series are stored along with it
+    :param check_match: matched elements, parallel to check
+    '''
+    with BulkWriter(res_conn, el_conn) as writer:
+        writer.add_series(ser, check, check_match)
+
+
+def satellites(el_conn):
+    '''
+    :return: sorted list of satellite IDs having elements
+    '''
+    return [row[0] for row in el_conn.execute(
+        """SELECT DISTINCT sat_id FROM elements ORDER BY sat_id""")]
+
+
+# Columns of the elements table by element name
+element_columns = {'a': 'a', 'e': 'e', 'i': 'i', 'W': 'W', 'w': 'we',
+                   'M': 'M', 'Lon': 'Lon'}
+
+
+def _legacy_tables(conn):
+    return [row[0] for row in conn.execute(
+        """SELECT name FROM sqlite_master WHERE type='table'
+           AND name NOT IN ('observations', 'elements', 'pending_elements')
+           AND name NOT LIKE 'sqlite_%'""")]
+
+
+def migrate(res_conn, el_conn, station=0, drop=False):
+    '''
+    Convert per-satellite tables to the observations/elements schema
+    :param station: station ID to assign (the old tables have none)
+    :param drop: remove the old tables after conversion
+    :return: (number of satellites, observations, element sets) converted
+    '''
+    res_conn.executescript(res_schema)
+    el_conn.executescript(el_schema)
+    nobs = nel = 0
+    res_tables = set(_legacy_tables(res_conn))
+    el_tables = set(_legacy_tables(el_conn))
+    for table in sorted(res_tables | el_tables):
+        sat_id = int(table)
+
+        # Series known from the elements tables
+        windows = []
+        el_rows = []
+        if table in el_tables:
+            for date, time1, time2, a, e, i, W, w, M, Lon in el_conn.execute(
+                    """SELECT date, time1, time2, a, e, i, W, we, M, Lon
+                       FROM '%s' ORDER BY time1""" % table):
+                time1, time2 = round_res([time1, time2], 0, 0, 0)[0]
+                t_start = float(res_mjd(date, time1))
+                t_stop = float(res_mjd(date, time2))
+                if t_stop < t_start:
+                    # Series crossing midnight
+                    t_stop += 1
+                windows.append((t_start, t_stop))
+                el_rows.append((sat_id, station, series_id(t_start),
+                                (t_start + t_stop)/2, t_start, t_stop,
+                                a, e, i, W, w, M, Lon, None))
+
+        obs_rows = []
+        if table in res_tables:
+            obs = res_conn.execute(
+                """SELECT date, time, RA, DEC, m FROM '%s'""" % table
+            ).fetchall()
+            if obs:
+                # The old tables hold values printed with "%f"; restore the
+                # values of the .res files, so that the epochs are those of
+                # the same measurements ingested again
+                date, time, ra, dec, m = np.array(obs, float).T
+                time, ra, dec, m = round_res(time, ra, dec, m)
+                obs = zip(date.astype(int).tolist(), time.tolist(),
+                          ra.tolist(), dec.tolist(), m.tolist())
+                epochs = res_mjd(date.astype(int), time)
+                order = np.argsort(epochs, kind='mergesort')
+                epochs = epochs[order]
+                sids = np.zeros(len(epochs), np.int64)
+                # Measurements within a known series, the first one wins
+                found = np.zeros(len(epochs), bool)
+                for t_start, t_stop in windows:
+                    inside = ~found & (t_start - epoch_tolerance <= epochs) & \
+                        (epochs <= t_stop + epoch_tolerance)
+                    sids[inside] = series_id(t_start)
+                    found |= inside
+                # Others start a new series after a gap since the previous
+                # measurement
+                other = np.flatnonzero(~found)
+                if len(other):
+                    starts = other[track_starts(epochs, series_gap)[other]]
+                    if not len(starts) or starts[0] != other[0]:
+                        starts = np.append(other[0], starts)
+                    first = starts[np.searchsorted(starts, other, 'right') - 1]
+                    sids[other] = [series_id(t) for t in epochs[first]]
+                obs_rows = [(sat_id, station, sid, epoch) + tuple(obs[k])
+                            for sid, epoch, k in zip(sids.tolist(),
+                                                     epochs.tolist(), order)]
+
+        res_conn.executemany(_insert_observations, obs_rows)
+        el_conn.executemany(_insert_elements, el_rows)
+        nobs += len(obs_rows)
+        nel += len(el_rows)
+        if drop:
+            if table in res_tables:
+                res_conn.execute("""DROP TABLE '%s'""" % table)
+            if table in el_tables:
+                el_conn.execute("""DROP TABLE '%s'""" % table)
+    res_conn.commit()
+    el_conn.commit()
+    return len(res_tables | el_tables), nobs, nel
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Catalog database maintenance')
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('--res-db', default=res_db,
+                        help='measurements database (default: %(default)s)')
+    parser.add_argument('--el-db', default=el_db,
+                        help='elements database (default: %(default)s)')
+    parser.add_argument('--station', type=int, default=0,
+                        help='station ID for migrated rows (default: 0)')
+    parser.add_argument('--drop', action='store_true',
+                        help='drop per-satellite tables after migration')
+    args = parser.parse_args()
+    res_conn, el_conn = sqlite3.connect(args.res_db), \
+        sqlite3.connect(args.el_db)
+    print '%d satellite(s), %d observation(s), %d element set(s) ' \
+        'migrated' % migrate(res_conn, el_conn, args.station, args.drop)
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# Writer of .check reports
+#
+# Produces the fixed-width layout written by orbit_dump.main() and parsed by
+# coord.read_check(). Residual tables are formatted a whole series at a
+# time: numbers are rounded and split into digits with integer arithmetic in
+# NumPy, straight into one preallocated character buffer of all rows, which
+# is returned as a single string to be written in one piece. Only values
+# whose rounding cannot be reproduced that way (within rounding error of a
+# tie, or not finite) are formatted one by one with "%".
+#
+# write_tables() writes a complete report from coord.CheckTables, e.g. to
+# rewrite a parsed report.
+
+import numpy as np
+
+_UNITS = {'a': 'km', 'e': None}
+
+
+def _column(values):
+    '''
+    :return: float array with None replaced by NaN
+    '''
+    try:
+        return np.asarray(values, float)
+    except TypeError:
+        return np.array([np.nan if v is None else v for v in values], float)
+
+
+def _defined(value):
+    return value is not None and value == value
+
+
+def _fmt(fmt, value):
+    return fmt % value if _defined(value) else ''
+
+
+class _Field(object):
+    """Column formatted with "%[+][0]<width>.<precision>f" """
+    def __init__(self, values, width, precision, plus=False, zero=False,
+                 blank=True):
+        '''
+        :param values: float array
+        :param blank: NaN gives a blank field rather than "nan"
+        '''
+        v = np.asarray(values, float)
+        self.min_width, self.precision, self.zero = width, precision, zero
+        self.blank = np.isnan(v) if blank else np.zeros(len(v), bool)
+        x = np.abs(np.where(self.blank, 0, v))*10.0**precision
+        # The product is within half an ulp of the exact one, so it rounds
+        # to the same integer unless it is that close to a tie
+        frac = x - np.floor(x)
+        exact = (x < 1e15) & (np.abs(frac - 0.5) > 2*np.spacing(x))
+        self.k = np.floor(np.where(exact, x, 0) + 0.5).astype(np.int64)
+        self.other = np.flatnonzero(~exact).tolist()
+        fmt = '%%%s%s%d.%df' % ('+' if plus else '', '0' if zero else '',
+                                width, precision)
+        self.strings = [fmt % v[i] for i in self.other]
+        self.neg = np.signbit(v) & ~self.blank
+        self.signed = self.neg | plus
+        ip = self.k//10**precision
+        self.ndigits = 1 + sum((ip >= 10**j).astype(int) for j in
+                               xrange(1, len(str(ip.max())) if len(ip)
+                                      else 1))
+        # Values wider than the field widen it in their rows only
+        self.lengths = np.maximum(
+            self.signed + self.ndigits + 1 + precision, width)
+        self.lengths[self.blank] = width
+        self.lengths[self.other] = map(len, self.strings)
+        self.width = max(self.lengths.max() if len(v) else 0, width)
+
+    def write(self, out):
+        '''
+        :param out: (N,width) uint8 array; the values are right aligned, the
+            unused space on the left is filled with NUL
+        '''
+        width = self.width
+        dot = width - self.precision - 1
+        k = self.k
+        if not len(k) or k.max() < 2**31:
+            # 32-bit division is faster
+            k = k.astype(np.int32)
+        # Characters are made column by column in contiguous rows of a
+        # transposed block, which is copied to the strided output at once
+        chars = np.empty((width, len(k)), np.uint8)
+        for j in range(width - 1, dot, -1) + range(dot - 1, -1, -1):
+            k, chars[j] = np.divmod(k, 10)
+        chars += ord('0')
+        chars[dot] = ord('.')
+        # Padding, sign and NUL to the left of the integer digits
+        start = width - self.lengths
+        sign = np.where(self.neg, ord('-'), ord('+')).astype(np.uint8)
+        pad = ord('0') if self.zero else ord(' ')
+        for j in xrange(dot):
+            p = dot - 1 - j
+            if self.zero:
+                first = self.signed & (p == start)
+                c = np.where(first, sign, chars[p])
+            else:
+                c = np.where(j > self.ndigits, pad, chars[p])
+                c = np.where(j == self.ndigits,
+                             np.where(self.signed, sign, pad), c)
+            chars[p] = np.where(p < start, 0, c)
+        blank = self.blank
+        if blank.any():
+            chars[:, blank] = ord(' ')
+            chars[:width - self.min_width, blank] = 0
+        out[:] = chars.T
+        for i, s in zip(self.other, self.strings):
+            out[i] = 0
+            out[i, width - len(s):] = np.frombuffer(s, np.uint8)
+
+def target_header(tag, multiple=False):
+    '''
+    :param tag: target tag, printed with "%s"
+    :param multiple: measurements possibly contain multiple objects
+    '''
+    s = ('-- Target: %s ' % (tag,)).ljust(150, '-') + '\n'
+    if multiple:
+        s += '\nWARNING. Measurements possibly contain multiple objects\n'
+    return s
+
+
+# Printed after the last series of a target
+target_end = '\n\n'
+
+uncorrelated = '\nWARNING. The object is uncorrelated\n'
+
+
+def residual_table(mjd0, mjd, ra, ha, dec, mag, int_tan, int_norm, ext_tan,
+                   ext_norm, match, tan_flags, norm_flags, medians, rms,
+                   frame_names=None):
+    '''
+    Residual table of a series with its totals
+    :param mjd0: integer part of MJD of the series
+    :param mjd, ra, ha, dec: MJD, RA and HA (hours) and Dec (degrees)
+    :param mag: magnitudes, 0 or None if not measured
+    :param int_tan, int_norm, ext_tan, ext_norm: residuals, arcsec; None if
+        not available
+    :param match: full match IDs, '' for unmatched measurements
+    :param tan_flags, norm_flags: ' ' or '*' for outliers of the fit
+    :param medians: (int_tan, int_norm, ext_tan, ext_norm) medians or None
+    :param rms: (int_tan, int_norm, ext_tan, ext_norm) RMS or None
+    :param frame_names: frame file names (None if unknown) or None if there
+        is no frame column
+    :return: string
+    '''
+    n = len(mjd)
+    if frame_names is None:
+        frame_names = [None]*n
+    fnwidth = max([len(fn) if fn else 0 for fn in frame_names] or [0])
+    if fnwidth:
+        fnwidth += 2
+
+    # Header
+    s = '\n\n%-*s%11s  %10s  %10s  %10s  %5s  %22s  %42s  Match' \
+        '\n%-*s%11s  %-10s  %-10s  %-10s  %5s  %10s  %10s  %9s  %9s\n' % \
+        (fnwidth, 'Frame'.center(fnwidth - 2) if fnwidth else '',
+         'MJD - %5d' % mjd0, 'RA'.center(10), 'HA'.center(10),
+         'Dec'.center(10), 'mag'.center(5),
+         'Int. residuals ["]'.center(22),
+         'Ext. residuals ["]'.center(18),
+
+         fnwidth, '', '', '  h', '  h', '   d', '',
+         'Tangent'.center(10), 'Normal'.center(10),
+         'Tangent.'.center(9), 'Normal'.center(9),
+         )
+
+    # Rows: one row of the buffer per measurement, padded with NUL bytes
+    # that are dropped from the result
+    x = [_column(c) for c in (mjd, ra, ha, dec, mag, int_tan, int_norm,
+                              ext_tan, ext_norm)]
+    x[4] = np.where(x[4] == 0, np.nan, x[4])
+    fields = [_Field(x[0] - mjd0, 11, 8, blank=False),
+              _Field(x[1], 10, 7, zero=True, blank=False),
+              _Field(x[2], 10, 7, zero=True, blank=False),
+              _Field(x[3], 10, 6, True, True, blank=False),
+              _Field(x[4], 5, 2)] + \
+        [_Field(c, 9, 2, True, True) for c in x[5:]]
+    flags = [np.array(f, 'S1').view(np.uint8) for f in (tan_flags,
+                                                        norm_flags)]
+    match_width = max(map(len, match) + [1])
+    # (item, width, separator width) in the order of columns
+    columns = [(frame_names, fnwidth, 0)] + \
+        [(field, field.width, 2) for field in fields[:5]] + \
+        [(fields[5], fields[5].width, 0), (flags[0], 1, 2),
+         (fields[6], fields[6].width, 0), (flags[1], 1, 2),
+         (fields[7], fields[7].width, 2), (fields[8], fields[8].width, 2),
+         (match, match_width, 0)]
+    buf = np.empty((n, sum(w + sep for _, w, sep in columns) + 1), np.uint8)
+    pos = 0
+    for item, width, sep in columns:
+        out = buf[:, pos:pos + width]
+        if isinstance(item, _Field):
+            item.write(out)
+        elif item is flags[0] or item is flags[1]:
+            out[:, 0] = item
+        elif width:
+            # Frame names are left aligned with spaces, matches with NUL
+            chars = np.array(item, 'S%d' % width).view(np.uint8).reshape(
+                n, width)
+            out[:] = chars if item is match else \
+                np.where(chars, chars, ord(' '))
+        buf[:, pos + width:pos + width + sep] = ord(' ')
+        pos += width + sep
+    buf[:, -1] = ord('\n')
+    buf = buf.ravel()
+    s += buf[buf != 0].tostring()
+
+    # Totals
+    s += 'Median:' + ' '*(49 + fnwidth) + '%9s   %9s   %9s  %9s\n' % tuple(
+        _fmt('%+9.2f', v) for v in medians)
+    if any(_defined(v) for v in rms):
+        s += 'RMS:' + ' '*(52 + fnwidth) + '%9s   %9s   %9s  %9s\n' % tuple(
+            _fmt('%9.2f', v) for v in rms)
+    return s
+
+
+def format_element(name, value, unit=None):
+    '''
+    :param name: element name, '' to omit it
+    :return: e.g. "a: 42164.1 km"
+    '''
+    return '%s%s%s' % (name + ': ' if name else '', float(value),
+                       ' ' + unit if unit else '')
+
+
+def elements_block(epoch, iod, matches, lon=None):
+    '''
+    Osculating elements of a series
+    :param epoch: epoch of the fitted orbit, printed with "%s"
+    :param iod: {element name: value} of the fitted orbit, None if the fit
+        failed
+    :param matches: list of (catalog ID, {element name: value}) of the
+        matching catalog objects
+    :param lon: longitude of the sub-satellite point, degrees, or None
+    :return: string
+    '''
+    lines = []
+    if iod is None:
+        if matches:
+            lines.append('Osculating elements of catalog object(s)')
+    else:
+        lines.append('Osculating elements for epoch %s:' % epoch)
+    for name in ('a', 'e', 'i', 'W', 'w', 'M'):
+        unit = _UNITS.get(name, 'deg')
+        if iod is not None:
+            lines.append('  %s%s' % (format_element(name, iod[name], unit),
+                                     ' (IOD)' if matches else ''))
+        for k, (obj_id, elems) in enumerate(matches):
+            name_needed = iod is None and not k
+            lines.append('  %s%s (%s)' % (
+                '' if name_needed else '   ',
+                format_element(name if name_needed else '', elems[name],
+                               unit), obj_id))
+    if _defined(lon):
+        lines.append('Longitude of sub-satellite point: %.1f' % lon)
+    return ''.join(line + '\n' for line in lines)
+
+
+def _elements_dict(row):
+    return dict((name, row[name]) for name in ('a', 'e', 'i', 'W', 'w', 'M'))
+
+
+def write_tables(f, tables):
+    '''
+    Write a complete report
+    :param f: open file
+    :param tables: coord.CheckTables instance; targets are the runs of
+        series with the same (st_id, sat_ID)
+    '''
+    series = tables.series
+    res = tables.residuals
+    iod = dict((row['series'], row) for row in tables.iod)
+    matched = {}
+    for row in tables.matched:
+        matched.setdefault(row['series'], []).append(row)
+    # Unmatched rows refer to match -1, i.e. the appended blank ID
+    match_ids = np.append(tables.match_ids, '')
+    prev = None
+    for k, ser in enumerate(series):
+        tag = (ser['st_id'], ser['sat_ID'])
+        if tag != prev:
+            if prev is not None:
+                f.write(target_end)
+            f.write(target_header('(%s, %s)' % tag if tag[0] else
+                                  '(%s)' % tag[1], ser['multiple']))
+            prev = tag
+        rows = res[ser['start']:ser['stop']]
+        f.write(residual_table(
+            ser['mjd0'], rows['mjd'], rows['RA'], rows['HA'], rows['DEC'],
+            rows['mag'], rows['int_tan'], rows['int_norm'], rows['ext_tan'],
+            rows['ext_norm'], match_ids[rows['match']].tolist(),
+            np.where(rows['int_tan_outlier'], '*', ' ').tolist(),
+            np.where(rows['int_norm_outlier'], '*', ' ').tolist(),
+            [ser[name] for name in ('int_tan_median', 'int_norm_median',
+                                    'ext_tan_median', 'ext_norm_median')],
+            [ser[name] for name in ('int_tan_rms', 'int_norm_rms',
+                                    'ext_tan_rms', 'ext_norm_rms')]))
+        if ser['uncorrelated']:
+            f.write(uncorrelated)
+        matches = [(row['sat_ID'], _elements_dict(row))
+                   for row in matched.get(k, [])]
+        if k in iod:
+            lon = iod[k]['Lon']
+        elif k in matched:
+            lon = matched[k][0]['Lon']
+        else:
+            lon = None
+        f.write(elements_block(
+            ser['epoch'], _elements_dict(iod[k]) if k in iod else None,
+            matches, lon))
+    if prev is not None:
+        f.write(target_end)
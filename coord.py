@@ -1,4 +1,9 @@
-# import os
+import bz2
+import datetime
+import gzip
+import os
+
+import numpy as np
 
 filename = '20140512_10092.res'
 sat_N = 95232
@@ -6,7 +11,9 @@ sat_N = 95232
 
 class coord(object):
     """coord class"""
-    def __init__(self, date=0.0, time=0.0, RA=0.0, DEC=0.0, m=0.0):
+    __slots__ = ('date', 'time', 'RA', 'DEC', 'm')
+
+    def __init__(self, date=0, time=0.0, RA=0.0, DEC=0.0, m=0.0):
         self.date = date
         self.time = time
         self.RA = RA
@@ -16,62 +23,851 @@ class coord(object):
 
 class seriya(object):
     """Seriya class"""
-    def __init__(self, st_id='', ser_id=0, coord=[]):
-        self.st_id = ''
-        self.ser_id = 0
-        self.coord = []
+    __slots__ = ('st_id', 'ser_id', 'coord')
+
+    def __init__(self, st_id='', ser_id=0, coord=None):
+        self.st_id = st_id
+        self.ser_id = ser_id
+        self.coord = [] if coord is None else coord
 
 
 class elements(object):
     """seriya check class"""
-    def __init__(self, sat_ID='', a=0, e=0, i=0, W=0, w=0, M=0, Lon=0):
-        self.sat_ID = ''
-        self.a = 0
-        self.e = 0
-        self.i = 0
-        self.W = 0
-        self.w = 0
-        self.M = 0
-        self.Lon = 0
+    __slots__ = ('sat_ID', 'a', 'e', 'i', 'W', 'w', 'M', 'Lon', 'epoch')
+
+    def __init__(self, sat_ID='', a=0, e=0, i=0, W=0, w=0, M=0, Lon=0,
+                 epoch=None):
+        self.sat_ID = sat_ID
+        self.a = a
+        self.e = e
+        self.i = i
+        self.W = W
+        self.w = w
+        self.M = M
+        self.Lon = Lon
+        self.epoch = epoch  # MJD (UTC) of osculating elements, if known
+
+
+# Epochs
+
+_MJD0 = datetime.datetime(1858, 11, 17)
+
+
+def res_mjd(date, time):
+    '''
+    :param date: .res date(s), ddmmyy
+    :param time: UTC, hours
+    :return: MJD (UTC); scalars or arrays, as the arguments
+    '''
+    date = np.asarray(date, np.int64)
+    d, m, y = date//10000, date//100 % 100, date % 100
+    y = np.where(y < 57, 2000 + y, 1900 + y)
+    a = (14 - m)//12
+    y, m = y + 4800 - a, m + 12*a - 3
+    jdn = d + (153*m + 2)//5 + 365*y + y//4 - y//100 + y//400 - 32045
+    return (jdn - 2400001) + np.asarray(time)/24.0
+
+
+def round_res(time, RA, DEC, m):
+    '''
+    Round values to the resolution of .res files (0.01 s of time and RA,
+    0.01" of Dec, 0.01 mag), e.g. after storing them with fewer digits
+    :param time, RA: hours
+    :param DEC: degrees
+    :return: time, RA, DEC, m - arrays bit-identical to the values parsed
+        from a .res file
+    '''
+    def split(value):
+        # Whole units, minutes and hundredths of seconds
+        cs = np.round(np.abs(np.asarray(value, float))*360000).astype(
+            np.int64)
+        return cs//360000, cs//6000 % 60, cs % 6000
+
+    def hms(value):
+        h, mm, ss = split(value)
+        return h.astype(float) + mm/60.0 + (ss/100.0)/3600
+
+    d, mm, ss = split(DEC)
+    d = d.astype(float)
+    frac = mm/60.0 + (ss/100.0)/3600
+    DEC = np.where(np.asarray(DEC) < 0, -d - frac, d + frac)
+    m = np.round(np.asarray(m, float)*100)/100.0
+    return hms(time), hms(RA), DEC, m
+
+
+def utc_to_mjd(s):
+    '''
+    :param s: UTC as "yyyy-mm-dd hh:mm:ss[.ffffff]", as written to .check
+    :return: MJD (UTC)
+    '''
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in s else '%Y-%m-%d %H:%M:%S'
+    dt = datetime.datetime.strptime(s.strip(), fmt) - _MJD0
+    return dt.days + (dt.seconds + dt.microseconds*1e-6)/86400.0
+
+
+# Compressed inputs
+#
+# Sources may be gzip, bzip2 or xz compressed; the format is detected by the
+# magic bytes rather than by the file name suffix.
+
+_MAGIC = (('\x1f\x8b', 'gz'), ('BZh', 'bz2'), ('\xfd7zXZ\x00', 'xz'))
+
+_COMPRESSED_SUFFIXES = ('', '.gz', '.bz2', '.xz')
+
+# Decompression block size
+_READ_BLOCK = 1 << 20
+
+
+class _Decompressed(object):
+    """Read-only file-like wrapper decompressing an open file on the fly"""
+    def __init__(self, raw, decompressor):
+        self.raw = raw
+        self.decompressor = decompressor
+        # Decompressed data and the read position in it; consumed data is
+        # dropped only when a block is added, so reading stays linear
+        self.pending = ''
+        self.pos = 0
+
+    def _fill(self):
+        data = self.raw.read(_READ_BLOCK)
+        if not data:
+            return False
+        self.pending = self.pending[self.pos:] + \
+            self.decompressor.decompress(data)
+        self.pos = 0
+        return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.pending) - self.pos < size) and \
+                self._fill():
+            pass
+        if size < 0:
+            size = len(self.pending) - self.pos
+        data = self.pending[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            eol = self.pending.find('\n', self.pos)
+            while eol < 0:
+                start = len(self.pending) - self.pos
+                if not self._fill():
+                    break
+                eol = self.pending.find('\n', start)
+            if eol < 0:
+                if self.pos < len(self.pending):
+                    line = self.pending[self.pos:]
+                    self.pending, self.pos = '', 0
+                    yield line
+                return
+            line = self.pending[self.pos:eol + 1]
+            self.pos = eol + 1
+            yield line
+
+    def close(self):
+        self.pending, self.pos = '', 0
+
+
+def _compression(header):
+    for magic, kind in _MAGIC:
+        if header.startswith(magic):
+            return kind
+    return None
+
+
+def _lzma():
+    '''
+    :return: lzma module, imported on first use of xz-compressed input
+    '''
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise IOError('xz-compressed input requires the lzma module')
+    return lzma
+
+
+def open_source(source):
+    '''
+    Open a plain or compressed .res/.check file for reading
+    :param source: file name or open binary file
+    :return: file-like object supporting read() and line iteration; closing
+        it never closes a file passed by the caller
+    '''
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            kind = _compression(f.read(6))
+        if kind == 'gz':
+            return gzip.open(source, 'rb')
+        if kind == 'bz2':
+            return bz2.BZ2File(source, 'r')
+        if kind == 'xz':
+            return _lzma().open(source, 'rb')
+        return open(source, 'rb')
+
+    if hasattr(source, 'peek'):
+        kind = _compression(source.peek(6)[:6])
+    elif hasattr(source, 'seek'):
+        header = source.read(6)
+        source.seek(-len(header), 1)
+        kind = _compression(header)
+    else:
+        kind = None
+    if kind == 'gz':
+        return gzip.GzipFile(fileobj=source, mode='rb')
+    if kind == 'bz2':
+        return _Decompressed(source, bz2.BZ2Decompressor())
+    if kind == 'xz':
+        return _Decompressed(source, _lzma().LZMADecompressor())
+    return source
+
+
+def check_name(res_name):
+    '''
+    :param res_name: .res file name, possibly with a compression suffix
+    :return: name of the companion .check file (plain or compressed)
+    '''
+    base = res_name
+    for suffix in _COMPRESSED_SUFFIXES[1:]:
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+    for suffix in _COMPRESSED_SUFFIXES:
+        if os.path.exists(base + '.check' + suffix):
+            return base + '.check' + suffix
+    return base + '.check'
+
+
+# Columnar .res reader
+#
+# A .res file is a sequence of series, each one opened by a header line
+# "<tag> <st_id> <ser_id>", followed by measurement lines
+# "<date> <hhmmssss> <hhmmssss> <+ddmmssss> <mag*100>" and closed by a blank
+# line. read_res_arrays() parses the whole buffer with NumPy operations on the
+# raw bytes instead of splitting every line in Python.
+
+RES_DTYPE = np.dtype([('date', 'i4'),  # ddmmyy
+                      ('time', 'f8'),  # UTC, hours
+                      ('RA', 'f8'),    # hours
+                      ('DEC', 'f8'),   # degrees
+                      ('m', 'f8')])    # magnitude
+SERIES_DTYPE = np.dtype([('st_id', 'i8'), ('ser_id', 'i8'),
+                         ('start', 'i8'), ('stop', 'i8')])
+
+# Bytes treated as whitespace by str.split()
+_WS = np.zeros(256, bool)
+_WS[[9, 10, 11, 12, 13, 32]] = True
+
+# Size of a parsing block; blocks are always cut at line boundaries
+_RES_CHUNK = 1 << 25
+
+
+def _res_buffer(source):
+    '''
+    :param source: file name, open file, str or any object exporting a buffer
+    :return: uint8 array with the file contents (memory-mapped for names of
+        uncompressed files); IOError/OSError if a named file cannot be read
+    '''
+    if isinstance(source, np.ndarray):
+        return source.view(np.uint8).ravel()
+    if hasattr(source, 'read'):
+        return np.frombuffer(open_source(source).read(), np.uint8)
+    if isinstance(source, basestring) and source and '\n' not in source:
+        # A file name: file contents have at least one line break
+        if not os.path.getsize(source):
+            return np.zeros(0, np.uint8)
+        f = open_source(source)
+        try:
+            if isinstance(f, file):
+                return np.memmap(f, np.uint8, 'r')
+            return np.frombuffer(f.read(), np.uint8)
+        finally:
+            f.close()
+    return np.frombuffer(source, np.uint8)
+
+
+def _parse_int(buf, start, length):
+    '''
+    Vectorized int() of the signed decimals buf[start:start+length]
+    '''
+    if not len(start):
+        return np.zeros(0, np.int64)
+    sign = buf[start]
+    neg = sign == 45
+    signed = neg | (sign == 43)
+    start = start + signed
+    length = np.maximum(length - signed, 0)
+    # Right-align the digits so that every column has a fixed weight
+    width = max(length.max(), 1)
+    pos = np.arange(width)
+    pad = width - length
+    idx = (start + length - width)[:, None] + pos
+    digits = buf[np.maximum(idx, 0)] - 48.0
+    if pad.any():
+        digits[pos < pad[:, None]] = 0
+    value = digits.dot(10.0**pos[::-1]).astype(np.int64)
+    return np.where(neg, -value, value)
+
+
+def _parse_sexagesimal(buf, start, length):
+    '''
+    Vectorized "hh + mm/60 + (ssss/100)/3600" for the time and RA fields;
+    the operation order is that of the original per-line parser, so results
+    are bit-identical
+    '''
+    two = np.full(len(start), 2)
+    return _parse_int(buf, start, two).astype(float) + \
+        _parse_int(buf, start + 2, two)/60.0 + \
+        (_parse_int(buf, start + 4, np.clip(length - 4, 0, 4))/100.0)/3600
+
+
+def _scan_res_chunk(buf):
+    '''
+    Tokenize and parse a block of complete lines
+    :param buf: uint8 array ending with a newline
+    :return: (meas, headers, blanks, nlines) - measurements (RES_DTYPE),
+        headers as arrays (line, meas_pos, st_id, ser_id), blank lines as
+        arrays (line, meas_pos), and the number of lines in the block;
+        line numbers and positions are local to the block
+    '''
+    ws = _WS[buf]
+    eol = np.flatnonzero(buf == 10)
+    nlines = len(eol)
+
+    # Tokens are runs of non-whitespace bytes; buf always ends with
+    # whitespace, so token starts and ends come in pairs
+    edge = np.flatnonzero(ws[1:] != ws[:-1]) + 1
+    if not ws[0]:
+        edge = np.concatenate([[0], edge])
+    starts, ends = edge[::2], edge[1::2]
+    ntok = np.bincount(np.searchsorted(eol, starts), minlength=nlines)
+    first = np.cumsum(ntok) - ntok
+
+    # Measurement lines
+    data = np.flatnonzero(ntok == 5)
+    t = first[data]
+    s = [starts[t + k] for k in range(5)]
+    l = [ends[t + k] - starts[t + k] for k in range(5)]
+    meas = np.empty(len(data), RES_DTYPE)
+    meas['date'] = _parse_int(buf, s[0], l[0])
+    meas['time'] = _parse_sexagesimal(buf, s[1], l[1])
+    meas['RA'] = _parse_sexagesimal(buf, s[2], l[2])
+    two = np.full(len(data), 2)
+    deg = _parse_int(buf, s[3], np.full(len(data), 3)).astype(float)
+    frac = _parse_int(buf, s[3] + 3, two)/60.0 + \
+        (_parse_int(buf, s[3] + 5, np.clip(l[3] - 5, 0, 4))/100.0)/3600
+    meas['DEC'] = np.where(deg >= 0, deg + frac, deg - frac)
+    meas['m'] = _parse_int(buf, s[4], l[4])/100.0
+
+    # Series headers and terminators
+    hdr = np.flatnonzero(ntok == 3)
+    t = first[hdr]
+    headers = (hdr, np.searchsorted(data, hdr),
+               _parse_int(buf, starts[t + 1], ends[t + 1] - starts[t + 1]),
+               _parse_int(buf, starts[t + 2], ends[t + 2] - starts[t + 2]))
+    blank = np.flatnonzero(ntok == 0)
+    return meas, headers, (blank, np.searchsorted(data, blank)), nlines
+
+
+def read_res_arrays(source):
+    '''
+    Parse a whole .res file into columnar arrays
+    :param source: file name, open file or a buffer with the file contents
+    :return: (meas, series) - structured arrays of RES_DTYPE (one row per
+        measurement) and SERIES_DTYPE (one row per series; measurements of
+        the series are meas[start:stop])
+    '''
+    buf = _res_buffer(source)
+    if len(buf) and buf[-1] != 10:
+        buf = np.concatenate([buf, np.array([10], np.uint8)])
+
+    meas, headers, blanks = [], [], []
+    nmeas = nlines = pos = 0
+    while pos < len(buf):
+        end = min(pos + _RES_CHUNK, len(buf))
+        eol = np.flatnonzero(buf[pos:end] == 10)
+        if len(eol):
+            end = pos + eol[-1] + 1
+        else:
+            end += np.flatnonzero(buf[end:] == 10)[0] + 1
+        m, h, b, n = _scan_res_chunk(np.asarray(buf[pos:end]))
+        meas.append(m)
+        headers.append((h[0] + nlines, h[1] + nmeas, h[2], h[3]))
+        blanks.append((b[0] + nlines, b[1] + nmeas))
+        nmeas += len(m)
+        nlines += n
+        pos = end
+
+    if not meas:
+        return np.zeros(0, RES_DTYPE), np.zeros(0, SERIES_DTYPE)
+    meas = np.concatenate(meas)
+    hdr_line, hdr_meas, st_id, ser_id = \
+        [np.concatenate(col) for col in zip(*headers)]
+    blank_line, blank_meas = [np.concatenate(col) for col in zip(*blanks)]
+
+    # Each blank line closes the series opened by the last preceding header
+    owner = np.searchsorted(hdr_line, blank_line) - 1
+    closed = owner >= 0
+    owner = owner[closed]
+    series = np.empty(len(owner), SERIES_DTYPE)
+    series['st_id'] = st_id[owner]
+    series['ser_id'] = ser_id[owner]
+    series['start'] = hdr_meas[owner]
+    series['stop'] = blank_meas[closed]
+    return meas, series
+
+
+def iter_res(source):
+    '''
+    Per-line .res parser yielding one series at a time
+    :param source: file name or open file, possibly compressed
+    :return: generator of seriya class
+    '''
+    file = open_source(source)
+    try:
+        # ser = [punkt, id, coord]
+        for line in file:
+            l = line.split()
+            if len(l) == 3:
+                ser = seriya(int(l[1]), int(l[2]))
+            elif len(l) == 5:
+                date = int(l[0])
+                time = float(l[1][:2])+float(l[1][2:4])/60+(float(l[1][4:8])/100)/3600
+                RA = float(l[2][:2])+float(l[2][2:4])/60+(float(l[2][4:8])/100)/3600
+                DEC_i = float(l[3][:3])
+                DEC_f = float(l[3][3:5])/60+(float(l[3][5:9])/100)/3600
+                if DEC_i >= 0:
+                    DEC = DEC_i + DEC_f
+                else:
+                    DEC = DEC_i - DEC_f
+                m = float(l[4])/100
+                c = coord(date, time, RA, DEC, m)
+                ser.coord.append(c)
+            else:
+                if line != '' and len(l) == 0:
+                    yield ser
+    finally:
+        if file is not source:
+            file.close()
+
+
+# Array-backed series
+#
+# SeriesBlock keeps all measurements of a file in one contiguous float64
+# column per quantity; series and measurements are accessed through small
+# views that behave like seriya and coord objects, e.g. block[k].coord[i].RA.
+
+class _CoordView(object):
+    """Read-only coord-like view of one row of a SeriesBlock"""
+    __slots__ = ('_block', '_row')
+
+    def __init__(self, block, row):
+        self._block = block
+        self._row = row
+
+    date = property(lambda self: int(self._block.date[self._row]))
+    time = property(lambda self: float(self._block.time[self._row]))
+    RA = property(lambda self: float(self._block.RA[self._row]))
+    DEC = property(lambda self: float(self._block.DEC[self._row]))
+    m = property(lambda self: float(self._block.m[self._row]))
+
+
+class _CoordList(object):
+    """Sequence of the measurements of one series of a SeriesBlock"""
+    __slots__ = ('_block', '_start', '_stop')
+
+    def __init__(self, block, start, stop):
+        self._block = block
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in xrange(*i.indices(len(self)))]
+        n = self._stop - self._start
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('measurement index out of range')
+        return _CoordView(self._block, self._start + i)
+
+    def __iter__(self):
+        for row in xrange(self._start, self._stop):
+            yield _CoordView(self._block, row)
+
+
+class _SeriesView(object):
+    """Read-only seriya-like view of one series of a SeriesBlock"""
+    __slots__ = ('_block', '_k')
+
+    def __init__(self, block, k):
+        self._block = block
+        self._k = k
+
+    st_id = property(lambda self: int(self._block.st_id[self._k]))
+    ser_id = property(lambda self: int(self._block.ser_id[self._k]))
+
+    @property
+    def coord(self):
+        block = self._block
+        return _CoordList(block, int(block.start[self._k]),
+                          int(block.stop[self._k]))
+
+
+class SeriesBlock(object):
+    """All series of a .res file as contiguous columns"""
+    def __init__(self, meas, series):
+        '''
+        :param meas: RES_DTYPE array
+        :param series: SERIES_DTYPE array
+        '''
+        self.date = np.ascontiguousarray(meas['date'])
+        self.time = np.ascontiguousarray(meas['time'])
+        self.RA = np.ascontiguousarray(meas['RA'])
+        self.DEC = np.ascontiguousarray(meas['DEC'])
+        self.m = np.ascontiguousarray(meas['m'])
+        self.st_id = np.ascontiguousarray(series['st_id'])
+        self.ser_id = np.ascontiguousarray(series['ser_id'])
+        self.start = np.ascontiguousarray(series['start'])
+        self.stop = np.ascontiguousarray(series['stop'])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.date, self.time, self.RA, self.DEC,
+                                      self.m, self.st_id, self.ser_id,
+                                      self.start, self.stop))
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in xrange(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('series index out of range')
+        return _SeriesView(self, k)
+
+    def __iter__(self):
+        for k in xrange(len(self)):
+            yield _SeriesView(self, k)
 
 
 def read_res(filename):
     '''
     :param filename: file name
-    :return: a_ser - array of seriya class
-    '''
-    ser_a = []
-    file = open(filename, 'r')
-    serN = 0
-    # ser = [punkt, id, coord]
-    for line in file:
-        l = line.split()
-        if len(l) == 3:
-            ser = seriya()
-            ser.st_id = int(l[1])
-            ser.ser_id = int(l[2])
-        elif len(l) == 5:
-            date = int(l[0])
-            time = float(l[1][:2])+float(l[1][2:4])/60+(float(l[1][4:8])/100)/3600
-            RA = float(l[2][:2])+float(l[2][2:4])/60+(float(l[2][4:8])/100)/3600
-            DEC_i = float(l[3][:3])
-            DEC_f = float(l[3][3:5])/60+(float(l[3][5:9])/100)/3600
-            if DEC_i >= 0:
-                DEC = DEC_i + DEC_f
-            else:
-                DEC = DEC_i - DEC_f
-            m = float(l[4])/100
-            c = coord(date, time, RA, DEC, m)
-            ser.coord.append(c)
-        else:
-            if line != '' and len(l) == 0:
-                ser_a.append(ser)
-                serN += 1
-    print serN, ' series in file ', filename
-    file.close()
+    :return: a_ser - SeriesBlock, a sequence of seriya-like views
+    '''
+    ser_a = SeriesBlock(*read_res_arrays(filename))
+    print len(ser_a), ' series in file ', filename
     return ser_a
 
 
+# Columnar .check reader
+#
+# A .check file produced by orbit_dump.main() consists of target sections:
+#
+#   -- Target: (<st_id>, <sat_id>) -----...
+#   [WARNING. Measurements possibly contain multiple objects]
+# followed by one or more series, each one being
+#   residual table header (two lines, the first one contains "MJD - <mjd0>")
+#   one line per observation
+#   Median: and RMS: lines
+#   [WARNING. The object is uncorrelated]
+#   [Osculating elements ... and the a, e, i, W, w, M element lines, each
+#    one followed by one line per catalog match]
+#   [Longitude of sub-satellite point: <lon>]
+#
+# _scan_check() walks this structure in a single pass, one line at a time, and
+# read_check_arrays() collects the result into compact arrays.
+
+CHECK_SERIES_DTYPE = np.dtype([
+    ('st_id', 'S16'), ('sat_ID', 'S16'),   # target tag
+    ('start', 'i8'), ('stop', 'i8'),       # rows in the residual table
+    ('mjd0', 'i4'),                        # integer part of MJD
+    ('epoch', 'S26'),                      # osculating elements epoch, UTC
+    ('int_tan_median', 'f8'), ('int_norm_median', 'f8'),
+    ('ext_tan_median', 'f8'), ('ext_norm_median', 'f8'),
+    ('int_tan_rms', 'f8'), ('int_norm_rms', 'f8'),
+    ('ext_tan_rms', 'f8'), ('ext_norm_rms', 'f8'),
+    ('multiple', '?'), ('uncorrelated', '?')])
+RESIDUAL_DTYPE = np.dtype([
+    ('series', 'i4'),                      # row in the series table
+    ('mjd', 'f8'), ('RA', 'f8'), ('HA', 'f8'), ('DEC', 'f8'), ('mag', 'f8'),
+    ('int_tan', 'f8'), ('int_norm', 'f8'),  # arcsec
+    ('ext_tan', 'f8'), ('ext_norm', 'f8'),  # arcsec
+    ('int_tan_outlier', '?'), ('int_norm_outlier', '?'),
+    ('match', 'i4')])                      # index in match_ids, -1 if none
+ELEMENTS_DTYPE = np.dtype([
+    ('series', 'i4'),                      # row in the series table
+    ('sat_ID', 'S40'),                     # target (IOD) or catalog ID
+    ('a', 'f8'), ('e', 'f8'), ('i', 'f8'), ('W', 'f8'), ('w', 'f8'),
+    ('M', 'f8'), ('Lon', 'f8')])
+
+_ELEMENT_NAMES = ('a', 'e', 'i', 'W', 'w', 'M')
+
+# Number of rows collected in Python lists before converting them to arrays
+_CHECK_BLOCK = 1 << 16
+
+
+class CheckTables(object):
+    """Parsed .check file"""
+    def __init__(self, series, residuals, iod, matched, match_ids):
+        self.series = series          # CHECK_SERIES_DTYPE
+        self.residuals = residuals    # RESIDUAL_DTYPE
+        self.iod = iod                # ELEMENTS_DTYPE, one row per fit
+        self.matched = matched        # ELEMENTS_DTYPE, one row per match
+        self.match_ids = match_ids    # full match IDs referred to by residuals
+
+
+def _float_field(s):
+    s = s.strip()
+    return float(s) if s else np.nan
+
+
+def _parse_tag(line):
+    tag = line[line.index('(') + 1:line.index(')')]
+    items = [item.strip() for item in tag.split(',')]
+    return items[0] if len(items) > 1 else '', items[-1]
+
+
+def _parse_row(line, o, mjd0):
+    '''
+    One line of a residual table; o is the width of the frame name column
+    '''
+    fields = (line[o:o + 11], line[o + 13:o + 23], line[o + 25:o + 35],
+              line[o + 37:o + 47], line[o + 49:o + 54], line[o + 56:o + 65],
+              line[o + 68:o + 77], line[o + 80:o + 89], line[o + 91:o + 100])
+    try:
+        values = [float(s) for s in fields]
+    except ValueError:
+        # Blank magnitude or residuals
+        values = [_float_field(s) for s in fields]
+    values[0] += mjd0
+    return tuple(values) + (line[o + 65:o + 66] == '*',
+                            line[o + 77:o + 78] == '*',
+                            line[o + 102:].strip())
+
+
+def _scan_check(lines):
+    '''
+    Single-pass tokenizer of a .check file
+    :param lines: iterable of lines
+    :return: generator of (st_id, sat_ID, multiple, series) per target, where
+        series is a list of dicts with keys mjd0, rows, totals, uncorrelated,
+        epoch, iod, matches (list of (ID, elements)) and Lon
+    '''
+    target = ser = None
+    state = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if state == 'rows':
+            if not line.startswith('Median:'):
+                ser['rows'].append(_parse_row(line, ser['offset'],
+                                              ser['mjd0']))
+                continue
+            state = None
+        first = line[:1]
+        if not first:
+            continue
+        elif line.startswith('-- Target:'):
+            if target is not None:
+                yield target
+            target = _parse_tag(line) + (False, [])
+            ser = state = None
+        elif target is None:
+            continue
+        elif state != 'elements' and line.endswith('Match') and \
+                'MJD - ' in line:
+            o = line.index('MJD - ')
+            ser = {'offset': o, 'mjd0': int(line[o + 6:o + 11]), 'rows': [],
+                   'totals': {}, 'uncorrelated': False, 'epoch': '',
+                   'iod': None, 'matches': [], 'Lon': np.nan}
+            target[3].append(ser)
+            state = 'units'
+        elif first == ' ':
+            if state == 'elements' and line[1] == ' ':
+                words = line.split()
+                if line[2] in _ELEMENT_NAMES and line[3] == ':':
+                    # First line of the next element; the rest are matches
+                    elem, value, k = line[2], float(words[1]), 0
+                else:
+                    value = float(words[0])
+                tag = words[-1][1:-1] if words[-1][0] == '(' else 'IOD'
+                if tag == 'IOD':
+                    ser['iod'] = ser['iod'] or {}
+                    ser['iod'][elem] = value
+                else:
+                    if len(ser['matches']) <= k:
+                        ser['matches'].append((tag, {}))
+                    ser['matches'][k][1][elem] = value
+                    k += 1
+            elif state == 'units':
+                state = 'rows'
+        elif line.startswith('Median:') or line.startswith('RMS:'):
+            o = ser['offset']
+            ser['totals'][first] = [_float_field(line[o + k:o + k + 9])
+                                    for k in (56, 68, 80, 91)]
+        elif line.startswith('WARNING.'):
+            if 'multiple' in line:
+                target = target[:2] + (True, target[3])
+            elif ser is not None:
+                ser['uncorrelated'] = True
+        elif line.startswith('Osculating elements'):
+            if line.startswith('Osculating elements for epoch '):
+                ser['epoch'] = line[30:].rstrip(':')
+            state = 'elements'
+        elif line.startswith('Longitude of sub-satellite point:'):
+            ser['Lon'] = float(line.split(':')[1])
+            state = None
+    if target is not None:
+        yield target
+
+
+class _Columns(object):
+    """Rows collected in blocks of structured arrays"""
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.blocks = []
+        self.rows = []
+        self.count = 0
+
+    def append(self, row):
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) >= _CHECK_BLOCK:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.blocks.append(np.array(self.rows, self.dtype))
+            self.rows = []
+
+    def array(self):
+        self.flush()
+        if not self.blocks:
+            return np.zeros(0, self.dtype)
+        return np.concatenate(self.blocks)
+
+
+def _elements_row(sernum, sat_ID, elems, lon):
+    return (sernum, sat_ID) + \
+        tuple(elems.get(name, np.nan) for name in _ELEMENT_NAMES) + (lon,)
+
+
+def read_check_arrays(fname):
+    '''
+    Parse a .check file into columnar tables
+    :param fname: file name or open file, possibly compressed
+    :return: CheckTables instance
+    '''
+    series = _Columns(CHECK_SERIES_DTYPE)
+    residuals = _Columns(RESIDUAL_DTYPE)
+    iod = _Columns(ELEMENTS_DTYPE)
+    matched = _Columns(ELEMENTS_DTYPE)
+    match_ids = {}
+    file = open_source(fname)
+    try:
+        for st_id, sat_ID, multiple, target_series in _scan_check(file):
+            for ser in target_series:
+                sernum = series.count
+                start = residuals.count
+                for row in ser['rows']:
+                    match = match_ids.setdefault(row[-1], len(match_ids)) \
+                        if row[-1] else -1
+                    residuals.append((sernum,) + row[:-1] + (match,))
+                totals = ser['totals']
+                series.append(
+                    (st_id, sat_ID, start, residuals.count, ser['mjd0'],
+                     ser['epoch']) +
+                    tuple(totals.get('M', [np.nan]*4)) +
+                    tuple(totals.get('R', [np.nan]*4)) +
+                    (multiple, ser['uncorrelated']))
+                if ser['iod'] is not None:
+                    iod.append(_elements_row(sernum, sat_ID, ser['iod'],
+                                             ser['Lon']))
+                for match_id, elems in ser['matches']:
+                    matched.append(_elements_row(sernum, match_id, elems,
+                                                 ser['Lon']))
+    finally:
+        if file is not fname:
+            file.close()
+    ids = np.zeros(len(match_ids), 'S40')
+    for match_id, k in match_ids.iteritems():
+        ids[k] = match_id
+    return CheckTables(series.array(), residuals.array(), iod.array(),
+                       matched.array(), ids)
+
+
+def _elements_from_dict(sat_ID, elems, lon):
+    return elements(sat_ID, *[elems.get(name, np.nan)
+                              for name in _ELEMENT_NAMES] + [lon])
+
+
+def iter_check(source):
+    '''
+    Stream a .check file one fitted series at a time
+    :param source: file name or open file, possibly compressed
+    :return: generator of (elements, matched elements) pairs of the series
+        with both the IOD elements and the sub-satellite longitude; the
+        latter holds the first catalog match (empty elements if the object
+        is uncorrelated)
+    '''
+    file = open_source(source)
+    try:
+        for st_id, sat_ID, multiple, target_series in _scan_check(file):
+            for ser in target_series:
+                # As in the original read_check(), a fit counts only once
+                # its sub-satellite longitude line is read
+                if ser['iod'] is None or ser['Lon'] != ser['Lon']:
+                    continue
+                el = _elements_from_dict(sat_ID, ser['iod'], ser['Lon'])
+                if ser['matches']:
+                    match_id, elems = ser['matches'][0]
+                    el_match = _elements_from_dict(match_id, elems, ser['Lon'])
+                else:
+                    el_match = elements()
+                if ser['epoch']:
+                    el.epoch = el_match.epoch = utc_to_mjd(ser['epoch'])
+                yield el, el_match
+    finally:
+        if file is not source:
+            file.close()
+
+
+def check_elements(tables):
+    '''
+    :param tables: CheckTables instance
+    :return: check, check_match - array of elements class, as read_check()
+    '''
+    first_match = {}
+    for k, sernum in enumerate(tables.matched['series'].tolist()):
+        first_match.setdefault(sernum, k)
+    a_check = []
+    a_check_match = []
+    epochs = [utc_to_mjd(s) if s else None
+              for s in tables.series['epoch'].tolist()]
+    for row in tables.iod.tolist():
+        if row[-1] != row[-1]:
+            # No sub-satellite longitude line, skipped as by iter_check()
+            continue
+        epoch = epochs[row[0]]
+        a_check.append(elements(*row[1:] + (epoch,)))
+        if row[0] in first_match:
+            a_check_match.append(elements(
+                *tables.matched[first_match[row[0]]].tolist()[1:] + (epoch,)))
+        else:
+            a_check_match.append(elements())
+    return a_check, a_check_match
+
+
 def read_check(fname):
     '''
     :param fname: file name
@@ -79,70 +875,69 @@ def read_check(fname):
     '''
     a_check = []
     a_check_match = []
-    elem = elements()
-    elem_match = elements()
-    file = open(fname, 'r')
-    for line in file:
-        if line[0] == '-':
-            satID = line.split()[3].split(')')[0]
-            # print ''
-            # print satID
-            elem.sat_ID = satID
-        elif line[:3] == '  a':
-            a = line.split()[1]
-            nl = file.next()
-            a_match = nl.split()[0]
-            # print a, a_match
-            elem.a = float(a)
-            elem_match.a = float(a_match)
-            elem_match.sat_ID = nl.split()[-1][1:-1]
-            # print satID, ' match=', elem_match.sat_ID
-        elif line[:3] == '  e':
-            e = line.split()[1]
-            nl = file.next()
-            e_match = nl.split()[0]
-            # print e, e_match
-            elem.e = float(e)
-            elem_match.e = float(e_match)
-        elif line[:3] == '  i':
-            i = line.split()[1]
-            nl = file.next()
-            i_match = nl.split()[0]
-            # print i, i_match
-            elem.i = float(i)
-            elem_match.i = float(i_match)
-        elif line[:3] == '  W':
-            W = line.split()[1]
-            nl = file.next()
-            W_match = nl.split()[0]
-            # print W, W_match
-            elem.W = float(W)
-            elem_match.W = float(W_match)
-        elif line[:3] == '  w':
-            w = line.split()[1]
-            nl = file.next()
-            w_match = nl.split()[0]
-            # print w, w_match
-            elem.w = float(w)
-            elem_match.w = float(w_match)
-        elif line[:3] == '  M':
-            M = line.split()[1]
-            nl = file.next()
-            M_match = nl.split()[0]
-            # print M, M_match
-            elem.M = float(M)
-            elem_match.M = float(M_match)
-        elif line[:3] == 'Lon':
-            Lon = line.split()[4]
-            # print Lon
-            elem.Lon = float(Lon)
-            elem_match.Lon = float(Lon)
-            a_check.append(elem)
-            a_check_match.append(elem_match)
-            elem = elements()
-            elem_match = elements()
-    file.close()
+    for el, el_match in iter_check(fname):
+        a_check.append(el)
+        a_check_match.append(el_match)
     return a_check, a_check_match
 
 
-# ser_a = read_res(filename)
+class CatalogIndex(object):
+    """
+    Loaded series and elements with constant time lookup by satellite ID
+
+    Series and elements are kept in load order; the index maps sat_ID (as a
+    string, the way it is shown in the GUI) to row numbers in both lists.
+    """
+    def __init__(self):
+        self.series = []
+        self.check = []
+        self.check_match = []
+        self._series_rows = {}
+        self._element_rows = {}
+
+    def add_series(self, series):
+        '''
+        :param series: sequence of seriya (or SeriesBlock views)
+        '''
+        rows = self._series_rows
+        k = len(self.series)
+        for ser in series:
+            rows.setdefault(str(ser.ser_id), []).append(k)
+            k += 1
+        self.series.extend(series)
+
+    def add_elements(self, check, check_match):
+        '''
+        :param check, check_match: parallel arrays of elements class
+        '''
+        rows = self._element_rows
+        k = len(self.check)
+        for el in check:
+            rows.setdefault(el.sat_ID, []).append(k)
+            k += 1
+        self.check.extend(check)
+        self.check_match.extend(check_match)
+
+    def series_rows(self, sat_ID):
+        '''
+        :return: list of row numbers in self.series
+        '''
+        return self._series_rows.get(str(sat_ID), [])
+
+    def element_rows(self, sat_ID):
+        '''
+        :return: list of row numbers in self.check and self.check_match
+        '''
+        return self._element_rows.get(str(sat_ID), [])
+
+    def elements(self, sat_ID):
+        '''
+        :return: check, check_match - elements of the satellite only, to be
+            passed to catdb.add_series()
+        '''
+        rows = self.element_rows(sat_ID)
+        return ([self.check[k] for k in rows],
+                [self.check_match[k] for k in rows])
+
+    def __len__(self):
+        return len(self.series)
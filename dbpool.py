@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# Shared access to the catalog databases
+#
+# ConnectionPool gives every thread its own read-only connection, opened on
+# first use, and runs all writes in one writer thread, in the order they
+# were submitted. Both databases are in WAL mode, so readers see the last
+# committed state and neither wait for the writer nor block it.
+#
+# Read connections have the measurements database as "main" and the
+# elements database attached as "el". Unqualified table names resolve to
+# the database holding the table, so a read connection can be passed to
+# the catdb functions in place of either connection, and observations and
+# elements can be joined in one query:
+#
+#   SELECT ... FROM observations o JOIN el.elements e
+#       ON e.sat_id = o.sat_id AND e.series_id = o.series_id
+
+import Queue
+import sqlite3
+import threading
+import traceback
+
+import catdb
+
+
+class PendingWrite(object):
+    """Write job queued to the writer thread"""
+    def __init__(self, job, args, done):
+        self.job = job
+        self.args = args
+        self.done = done
+        self.result = None
+        self.error = None
+        self._finished = threading.Event()
+
+    def finished(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        :return: result of the job; raises the exception of a failed job
+        '''
+        if not self._finished.wait(timeout):
+            raise RuntimeError('Write job not finished in %s s' % timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class ConnectionPool(object):
+    """Per-thread read connections and a serialized writer"""
+    def __init__(self, res_name=catdb.res_db, el_name=catdb.el_db,
+                 synchronous='NORMAL', timeout=60.0):
+        '''
+        Create the schema and switch both databases to WAL mode, which
+        persists in the database files
+        :param synchronous: synchronous mode of the writer, see
+            catdb.connect()
+        :param timeout: seconds to wait for locks held by other processes
+        '''
+        self.res_name = res_name
+        self.el_name = el_name
+        self.synchronous = synchronous
+        self.timeout = timeout
+        for conn in catdb.connect(res_name, el_name, True, synchronous):
+            conn.close()
+        self._local = threading.local()
+        self._readers = []
+        self._lock = threading.Lock()
+        self._jobs = Queue.Queue()
+        self._writer = None
+
+    def reader(self):
+        '''
+        :return: read-only connection of the calling thread, with the elements
+            database attached as "el"
+        '''
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only used by this thread, but closed by close()
+            conn = sqlite3.connect(self.res_name, timeout=self.timeout,
+                                   check_same_thread=False)
+            conn.execute("""ATTACH DATABASE ? AS el""", (self.el_name,))
+            conn.execute("""PRAGMA query_only=ON""")
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def write(self, job, args=(), done=None):
+        '''
+        Queue job(res_conn, el_conn, *args) for the writer thread; the job
+        commits its changes, they are rolled back if it raises an exception
+        :param done: called with the PendingWrite by the writer thread when
+            the job is finished
+        :return: PendingWrite
+        '''
+        pending = PendingWrite(job, args, done)
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop,
+                                                name='catalog writer')
+                self._writer.daemon = True
+                self._writer.start()
+            self._jobs.put(pending)
+        return pending
+
+    def _write_loop(self):
+        res_conn, el_conn = catdb.connect(self.res_name, self.el_name, True,
+                                          self.synchronous)
+        for conn in (res_conn, el_conn):
+            conn.execute("""PRAGMA busy_timeout=%d""" % (self.timeout*1000))
+        try:
+            while True:
+                pending = self._jobs.get()
+                if pending is None:
+                    break
+                try:
+                    pending.result = pending.job(res_conn, el_conn,
+                                                 *pending.args)
+                except Exception as E:
+                    res_conn.rollback()
+                    el_conn.rollback()
+                    pending.error = E
+                pending._finished.set()
+                if pending.done is not None:
+                    try:
+                        pending.done(pending)
+                    except Exception:
+                        traceback.print_exc()
+        finally:
+            res_conn.close()
+            el_conn.close()
+
+    def close(self):
+        '''
+        Finish queued writes and close all connections
+        '''
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._jobs.put(None)
+            writer.join()
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
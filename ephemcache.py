@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Memoizing cache of catalog object ephemerides
+#
+# orbit_dump.main() needs the state of the same catalog object at the same
+# epoch for external residuals of several targets and series and for the
+# osculating element dumps; the cache computes each of them once. Its size
+# is bounded, least recently used entries are dropped first.
+#
+# The states of all matched objects are fetched ahead by prefetch(), with
+# one catalog query per catalog and epoch for all objects matched then
+# rather than one query per measurement.
+
+import collections
+
+
+class EphemerisCache(object):
+    """LRU cache of query(id, catid, epoch) results keyed by (catid, id, epoch)"""
+    def __init__(self, query, max_size=100000, query_many=None):
+        '''
+        :param query: function (id, catid, epoch) -> catalog object
+        :param max_size: maximum number of cached ephemerides
+        :param query_many: function (ids, catid, epoch) -> list of catalog
+            objects parallel to ids, None for objects not found; used by
+            prefetch()
+        '''
+        self.query = query
+        self.query_many = query_many
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+    def __call__(self, id, catid, epoch):
+        key = (catid, id, epoch)
+        cache = self._cache
+        try:
+            obj = cache.pop(key)
+            self.hits += 1
+        except KeyError:
+            obj = self.query(id, catid, epoch)
+            self.misses += 1
+        self._store(key, obj)
+        return obj
+
+    def _store(self, key, obj):
+        cache = self._cache
+        cache.pop(key, None)
+        while cache and len(cache) >= self.max_size:
+            cache.popitem(last=False)
+        if self.max_size > 0:
+            cache[key] = obj
+
+    def prefetch(self, requests):
+        '''
+        Compute the missing ephemerides with one query_many() call per
+        catalog and epoch
+        :param requests: iterable of (id, catid, epoch)
+        :return: number of ephemerides computed
+        '''
+        groups = collections.OrderedDict()
+        for id, catid, epoch in requests:
+            key = (catid, id, epoch)
+            if key not in self._cache:
+                ids = groups.setdefault((catid, epoch), [])
+                if id not in ids:
+                    ids.append(id)
+        count = 0
+        for (catid, epoch), ids in groups.iteritems():
+            for id, obj in zip(ids, self.query_many(ids, catid, epoch)):
+                # Objects not found are left to query(), which fails
+                if obj is not None:
+                    self._store((catid, id, epoch), obj)
+                    count += 1
+        self.misses += count
+        return count
+
+    def items(self):
+        '''
+        :return: list of ((catid, id, epoch), object), least recently used
+            first
+        '''
+        return self._cache.items()
+
+    def update(self, items):
+        '''
+        Add entries returned by items() of another cache
+        '''
+        for key, obj in items:
+            self._store(key, obj)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits)/total if total else 0.0
+
+    def stats(self):
+        return 'ephemeris cache: %d hit(s), %d miss(es), hit rate %.1f%%' % (
+            self.hits, self.misses, 100*self.hit_rate())
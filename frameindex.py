@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Persistent index of frame epochs
+#
+# orbit_dump.main() needs the epoch of every image in the working directory
+# to name the frames of measurements. Reading the headers of thousands of
+# frames on every run dominates its start-up time, so the epochs are kept
+# in an index file along with the size and modification time of each file,
+# and only new or changed files are read again, in a thread pool. Files
+# whose header cannot be read are remembered as well, with an empty epoch;
+# so are files whose epoch is not a datetime, which are reported. The index
+# is written to a temporary file renamed into place.
+#
+# fits_epoch() is a reader of the DATE-OBS/TIME-OBS keywords, which stops
+# reading the header as soon as both are found.
+
+import _strptime  # strptime() imports it lazily, which is not thread-safe
+import datetime
+import os
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+default_index = '.frame_epochs'
+
+_EPOCH_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _stat(name):
+    try:
+        st = os.stat(name)
+    except OSError:
+        return None
+    return '%d %r' % (st.st_size, st.st_mtime)
+
+
+def _load(index_name, tag):
+    '''
+    :return: {name: (stat, epoch or None)}
+    '''
+    entries = {}
+    try:
+        with open(index_name, 'rb') as f:
+            if f.readline().rstrip('\n') != tag:
+                # Epochs were obtained by another reader
+                return entries
+            for line in f:
+                stat, epoch, name = line.rstrip('\n').split('\t', 2)
+                entries[name] = stat, datetime.datetime.strptime(
+                    epoch, _EPOCH_FORMAT) if epoch else None
+    except (IOError, ValueError):
+        pass
+    return entries
+
+
+def _save(index_name, tag, entries):
+    dirname = os.path.dirname(os.path.abspath(index_name))
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(tag + '\n')
+            for name in sorted(entries):
+                stat, epoch = entries[name]
+                f.write('%s\t%s\t%s\n' % (
+                    stat, epoch.strftime(_EPOCH_FORMAT) if epoch else '', name))
+        if os.name == 'nt' and os.path.exists(index_name):
+            os.remove(index_name)
+        os.rename(tmp, index_name)
+    except (IOError, OSError) as E:
+        print 'Cannot save frame index:', E
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def frame_epochs(names, reader, index_name=default_index, tag='',
+                 threads=8):
+    '''
+    :param names: file names
+    :param reader: function (file name) -> datetime.datetime, raising an
+        exception if the file is not a frame
+    :param index_name: index file name
+    :param tag: identifies the reader; the index is rebuilt if it has been
+        made with a different one
+    :param threads: number of threads reading headers
+    :return: {file name: epoch} for all frames among names
+    '''
+    entries = _load(index_name, tag)
+    stats = dict((name, _stat(name)) for name in names)
+    stale = [name for name, stat in stats.iteritems()
+             if stat is not None and
+             (name not in entries or entries[name][0] != stat)]
+
+    def read(name):
+        try:
+            return reader(name)
+        except Exception:
+            return None
+
+    if stale:
+        if threads > 1 and len(stale) > 1:
+            pool = ThreadPool(min(threads, len(stale)))
+            try:
+                epochs = pool.map(read, stale, chunksize=16)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            epochs = [read(name) for name in stale]
+        invalid = []
+        for name, epoch in zip(stale, epochs):
+            if epoch is not None and \
+               not isinstance(epoch, datetime.datetime):
+                invalid.append(name)
+                epoch = None
+            entries[name] = stats[name], epoch
+        if invalid:
+            print 'Ignored %d frame(s) with an epoch that is not a ' \
+                'datetime, e.g. %s' % (len(invalid), sorted(invalid)[0])
+
+    # Forget files that are gone
+    dropped = [name for name in entries if name not in stats]
+    for name in dropped:
+        del entries[name]
+    if stale or dropped:
+        _save(index_name, tag, entries)
+    return dict((name, entries[name][1]) for name in names
+                if name in entries and entries[name][1] is not None)
+
+
+# FITS header reader
+
+_BLOCK = 2880
+_CARD = 80
+
+
+def _card_value(card):
+    value = card[10:]
+    if value.lstrip().startswith("'"):
+        # String; quotes are doubled inside
+        s = value.lstrip()[1:]
+        out = []
+        i = 0
+        while i < len(s):
+            if s[i] == "'":
+                if s[i + 1:i + 2] == "'":
+                    out.append("'")
+                    i += 2
+                    continue
+                break
+            out.append(s[i])
+            i += 1
+        return ''.join(out).rstrip()
+    value = value.split('/', 1)[0].strip()
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def fits_keywords(name, keywords):
+    '''
+    Read keywords from the primary header of a FITS file; reading stops at
+    END or as soon as all keywords are found
+    :param keywords: sequence of keyword names
+    :return: {keyword: value} of the keywords found
+    '''
+    wanted = set(keywords)
+    found = {}
+    with open(name, 'rb') as f:
+        first = True
+        while True:
+            block = f.read(_BLOCK)
+            if len(block) < _BLOCK:
+                raise ValueError('Truncated FITS header: %s' % name)
+            if first and not block.startswith('SIMPLE  ='):
+                raise ValueError('Not a FITS file: %s' % name)
+            first = False
+            for i in xrange(0, _BLOCK, _CARD):
+                card = block[i:i + _CARD]
+                key = card[:8].rstrip()
+                if key == 'END':
+                    return found
+                if key in wanted and card[8:10] == '= ':
+                    found[key] = _card_value(card)
+                    if len(found) == len(wanted):
+                        return found
+
+
+def _parse_datetime(s):
+    s = s.strip()
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid date: %s' % s)
+
+
+def fits_epoch(name):
+    '''
+    :return: exposure start from DATE-OBS (and TIME-OBS if DATE-OBS holds the
+        date only) as datetime.datetime
+    '''
+    values = fits_keywords(name, ('DATE-OBS', 'TIME-OBS'))
+    if 'DATE-OBS' not in values:
+        raise ValueError('No DATE-OBS in %s' % name)
+    date_obs = str(values['DATE-OBS'])
+    if 'T' not in date_obs and 'TIME-OBS' in values:
+        date_obs += 'T' + str(values['TIME-OBS'])
+    return _parse_datetime(date_obs)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Store of object identifications
+#
+# orbit_dump.main() used to read the whole ident.txt, merge the matches of
+# the current run into it and write it back. The identifications are now
+# kept in an SQLite database with one row per (date, tag) - UTC date of the
+# night and object tag - holding the formatted match lines, so that a run
+# only replaces the rows of the targets it has processed. The legacy
+# ident.txt layout is exported on demand, to a temporary file renamed into
+# place.
+#
+# Every update is a single "BEGIN IMMEDIATE" transaction, and connections
+# wait for locks held by other runs, so several stations may update the same
+# store concurrently. The default rollback journal is used rather than WAL,
+# which does not work on network file systems.
+#
+# Usage:
+#   python identdb.py import [--db ident.db] [ident.txt]
+#   python identdb.py export [--db ident.db] [ident.txt]
+
+import datetime
+import os
+import sqlite3
+import tempfile
+
+ident_db = 'ident.db'
+ident_txt = 'ident.txt'
+
+schema = """
+CREATE TABLE IF NOT EXISTS ident (
+    date TEXT NOT NULL,     -- yyyy-mm-dd
+    tag TEXT NOT NULL,
+    matches TEXT NOT NULL,  -- formatted match lines separated by newlines
+    PRIMARY KEY (date, tag)
+);
+"""
+
+header = """
+       Date     Measurements   Match ID/designation                     Num /Total Residual [deg]
+                                                                      matched      tan    norm
+    """
+
+# Seconds to wait for a lock held by another process
+timeout = 60.0
+
+
+def connect(name=ident_db):
+    '''
+    :return: connection in autocommit mode, with the schema created if needed
+    '''
+    conn = sqlite3.connect(name, timeout=timeout, isolation_level=None)
+    conn.text_factory = str
+    # Under the write lock, so that runs creating a new store at the same
+    # time do not fail with "database schema has changed"
+    conn.execute("""BEGIN IMMEDIATE""")
+    try:
+        conn.execute(schema)
+    except:
+        conn.execute("""ROLLBACK""")
+        raise
+    conn.execute("""COMMIT""")
+    return conn
+
+
+def update(conn, entries):
+    '''
+    Insert or replace identifications
+    :param entries: sequence of (date, tag, matches), where date is
+        datetime.date and matches is a list of formatted match lines
+    :return: number of entries written
+    '''
+    rows = [(str(d), tag, '\n'.join(matches)) for d, tag, matches in entries]
+    conn.execute("""BEGIN IMMEDIATE""")
+    try:
+        conn.executemany(
+            """INSERT OR REPLACE INTO ident (date, tag, matches)
+               VALUES (?, ?, ?)""", rows)
+    except:
+        conn.execute("""ROLLBACK""")
+        raise
+    conn.execute("""COMMIT""")
+    return len(rows)
+
+
+def is_empty(conn):
+    return conn.execute("""SELECT 1 FROM ident LIMIT 1""").fetchone() is None
+
+
+def parse_text(lines):
+    '''
+    Parse the legacy ident.txt layout
+    :param lines: iterable of lines
+    :return: dict {(date, tag): [match line, ...]}
+    '''
+    ident = {}
+    prev_date = prev_tagstr = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        tagstr = line[10:26].strip()
+        try:
+            curr_date = datetime.date(*[int(s) for s in line[:10].split('-')])
+            prev_date, prev_tagstr = curr_date, tagstr
+        except:
+            curr_date = None
+        match_str = line[26:].strip()
+        if curr_date is None:
+            # More matches for the current target
+            if prev_date is not None:
+                ident[prev_date, prev_tagstr].append(match_str)
+        else:
+            # New target
+            ident[curr_date, tagstr] = [match_str]
+    return ident
+
+
+def import_text(conn, filename=ident_txt):
+    '''
+    Merge identifications from a legacy ident.txt
+    :return: number of entries imported
+    '''
+    with open(filename, 'rU') as f:
+        ident = parse_text(f)
+    return update(conn, [(d, tag, matches)
+                         for (d, tag), matches in ident.iteritems()])
+
+
+def export_text(conn, filename=ident_txt):
+    '''
+    Write all identifications in the legacy ident.txt layout; the file is
+    written under a temporary name in the same directory and renamed, so
+    that readers and concurrent exports never see a partial file
+    :return: number of entries written
+    '''
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(filename) + '.',
+                               dir=dirname)
+    n = 0
+    try:
+        with os.fdopen(fd, 'wt') as f:
+            print >> f, header
+            for d, tag, matches in conn.execute(
+                    """SELECT date, tag, matches FROM ident
+                       ORDER BY date, tag"""):
+                matches = matches.split('\n')
+                print >> f, '%10s %-15s %s' % (d, tag, matches[0])
+                for matchstr in matches[1:]:
+                    print >> f, '%26s %s' % ('', matchstr)
+                n += 1
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return n
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Import or export the legacy ident.txt')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('filename', nargs='?', default=ident_txt)
+    parser.add_argument('--db', default=ident_db,
+                        help='identification database (default: %s)' %
+                        ident_db)
+    args = parser.parse_args()
+    conn = connect(args.db)
+    if args.command == 'import':
+        print '%d identification(s) imported' % import_text(conn,
+                                                             args.filename)
+    else:
+        print '%d identification(s) exported' % export_text(conn,
+                                                             args.filename)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Bulk ingest of .res files and their .check companions into the catalog
+databases.
+
+Files are parsed in a pool of worker processes and written by the main
+process in input order, committing once per batch of files. A file that
+fails to parse or store is reported and skipped; the rest of the run goes on.
+
+Usage:
+  python ingest.py [options] <directory or glob> [...]
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+from multiprocessing import Pool
+
+import catdb
+import coord
+
+res_patterns = ('*.res', '*.RES', '*.res.gz', '*.res.bz2', '*.res.xz')
+
+
+def find_files(args):
+    '''
+    :param args: directories, file names or glob patterns
+    :return: sorted list of .res file names
+    '''
+    found = set()
+    for arg in args:
+        if os.path.isdir(arg):
+            for dirpath, dirnames, filenames in os.walk(arg):
+                for pattern in res_patterns:
+                    found.update(glob.glob(os.path.join(dirpath, pattern)))
+        else:
+            found.update(fn for fn in glob.glob(arg) if os.path.isfile(fn))
+    return sorted(found)
+
+
+def parse_file(path):
+    '''
+    Parse a .res file and its .check (worker process)
+    :return: (path, meas, series, check, check_match, error) - arrays as
+        returned by coord.read_res_arrays(), element lists as returned by
+        coord.read_check(), and the error description if parsing failed
+    '''
+    try:
+        meas, series = coord.read_res_arrays(path)
+        check_fn = coord.check_name(path)
+        if os.path.exists(check_fn):
+            check, check_match = coord.check_elements(
+                coord.read_check_arrays(check_fn))
+        else:
+            check = check_match = []
+        return path, meas, series, check, check_match, None
+    except Exception:
+        return path, None, None, None, None, traceback.format_exc()
+
+
+def ingest(paths, workers=1, batch=20, res_db=catdb.res_db, el_db=catdb.el_db,
+           verbose=True, synchronous='NORMAL'):
+    '''
+    :return: list of (path, error) for files that were not ingested
+    '''
+    res_conn, el_conn = catdb.connect(res_db, el_db, synchronous=synchronous)
+    writer = catdb.BulkWriter(res_conn, el_conn, batch_size=0)
+    pool = Pool(workers) if workers > 1 else None
+    results = pool.imap(parse_file, paths) if pool else \
+        (parse_file(path) for path in paths)
+    failed = []
+    pending = []
+    t0 = time.time()
+    try:
+        for n, (path, meas, series, check, check_match, error) in \
+                enumerate(results):
+            if error is None:
+                try:
+                    writer.add_arrays(meas, series, check, check_match)
+                    pending.append(path)
+                except Exception:
+                    error = traceback.format_exc()
+            if error is not None:
+                failed.append((path, error))
+                print >> sys.stderr, 'Error ingesting %s:\n%s' % (path, error)
+            if len(pending) >= batch or n + 1 == len(paths):
+                try:
+                    writer.flush()
+                except Exception:
+                    error = traceback.format_exc()
+                    print >> sys.stderr, 'Error writing batch:\n%s' % error
+                    failed.extend((path, error) for path in pending)
+                pending = []
+            if verbose:
+                print '[%d/%d] %s (%d measurements total, %.1f files/s)' % (
+                    n + 1, len(paths), path, writer.count,
+                    (n + 1)/max(time.time() - t0, 1e-6))
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        res_conn.close()
+        el_conn.close()
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Ingest .res/.check files into the catalog databases')
+    parser.add_argument('paths', nargs='+',
+                        help='directories, .res files or glob patterns')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of parser processes (default: 1)')
+    parser.add_argument('--batch', type=int, default=20,
+                        help='files per database commit (default: 20)')
+    parser.add_argument('--res-db', default=catdb.res_db,
+                        help='measurements database (default: %(default)s)')
+    parser.add_argument('--el-db', default=catdb.el_db,
+                        help='elements database (default: %(default)s)')
+    parser.add_argument('--synchronous', default='NORMAL',
+                        choices=('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+                        help='SQLite synchronous mode (default: NORMAL)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report progress')
+    args = parser.parse_args(argv)
+
+    paths = find_files(args.paths)
+    if not paths:
+        print >> sys.stderr, 'No .res files found'
+        return 1
+    failed = ingest(paths, max(args.workers, 1), max(args.batch, 1),
+                    args.res_db, args.el_db, not args.quiet,
+                    args.synchronous)
+    print '%d of %d file(s) ingested' % (len(paths) - len(failed), len(paths))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
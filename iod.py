@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+# Angles-only initial orbit determination without Apex
+#
+# Fits a two-body orbit to each short arc of measurements, many arcs at a
+# time. The fitted parameters are the TOD position and velocity at the
+# middle of the arc (the IOD epoch of orbit_dump). The starting orbit is the
+# best fitting one of circular orbits through the first and the last
+# measurement with radii from LEO to beyond GEO; it is refined by
+# Levenberg-Marquardt iterations on the tangential and normal residuals,
+# with the analytic Jacobian of two-body motion. Points more than clip sigma
+# off are then rejected, separately in both coordinates, and the arc is
+# fitted again. Light time is accounted for; see astrodyn for other
+# limitations.
+#
+# Arcs of a few minutes hardly constrain the range and the radial velocity,
+# so the elements, especially a and e, depend on the noise and on the
+# starting orbit much more than the residuals do. Fits of such arcs may
+# wander off to orbits crossing the Earth or escaping it; these are not
+# reported as converged.
+
+import numpy as np
+
+import astrodyn
+from coord import res_mjd
+from residuals import directions, krad
+
+IOD_DTYPE = np.dtype([
+    ('epoch', 'f8'),                       # MJD (UTC) of the elements
+    ('a', 'f8'), ('e', 'f8'), ('i', 'f8'), ('W', 'f8'), ('w', 'f8'),
+    ('M', 'f8'),                           # TOD osculating elements
+    ('Lon', 'f8'),                         # sub-satellite longitude, deg
+    ('r', 'f8', 3), ('v', 'f8', 3),        # TOD state at epoch, km, km/s
+    ('tan_rms', 'f8'), ('norm_rms', 'f8'),  # arcsec, outliers excluded
+    ('used', 'i4'),                        # points without outliers
+    ('iterations', 'i4'),
+    ('converged', '?')])
+
+FIT_RESIDUAL_DTYPE = np.dtype([
+    ('tan', 'f8'), ('norm', 'f8'),         # observed - computed, arcsec
+    ('tan_outlier', '?'), ('norm_outlier', '?')])
+
+# Radii of the circular starting orbits tried, km
+_RADII = np.geomspace(6700.0, 1e5, 30)
+
+# Arcs are fitted in groups with lengths up to this many times the shortest
+_GROUP_RATIO = 1.5
+
+# Largest apogee of a bound orbit, km: about the radius of the Hill sphere
+# of the Earth
+_APOGEE_MAX = 1.5e6
+
+
+def _range_to_radius(site, u, r0):
+    # Distance along u from the site to the sphere of radius r0
+    b = (site*u).sum(-1)
+    return -b + np.sqrt(np.maximum(b*b - (site*site).sum(-1) + r0*r0, 0))
+
+
+class _Arcs(object):
+    """Padded measurements of a set of arcs"""
+    def __init__(self, mjd, ra, dec, start, stop, site):
+        lengths = stop - start
+        n = max(int(lengths.max()), 1)
+        offsets = np.arange(n)
+        self.mask = offsets < lengths[:, None]
+        rows = np.minimum(start[:, None] + offsets, stop[:, None] - 1)
+        self.rows = rows
+        self.lengths = lengths
+        t = mjd[rows]
+        self.epoch = (mjd[start] + mjd[stop - 1])/2
+        self.dt = (t - self.epoch[:, None])*astrodyn.day
+        self.u = astrodyn.j2000_to_tod(directions(ra[rows].ravel(),
+                                                  dec[rows].ravel()),
+                                       t.ravel()).reshape(rows.shape + (3,))
+        self.site = astrodyn.site_state(site[0], site[1], site[2], t)[0]
+
+        # Tangential axis along the observed track, normal one to the left
+        # of it (see residuals.ext_residuals())
+        prev = np.maximum(offsets - 1, 0)
+        next = np.minimum(offsets + 1, lengths[:, None] - 1)
+        k = np.arange(len(start))[:, None]
+        track = self.u[k, next] - self.u[k, prev]
+        track -= (track*self.u).sum(-1)[..., None]*self.u
+        norm = np.sqrt((track*track).sum(-1))
+        self.e_tan = track/np.where(norm > 0, norm, 1)[..., None]
+        self.e_norm = np.cross(self.u, self.e_tan)
+
+    def subset(self, k):
+        arcs = object.__new__(_Arcs)
+        for name in ('mask', 'rows', 'lengths', 'epoch', 'dt', 'u', 'site',
+                     'e_tan', 'e_norm'):
+            setattr(arcs, name, getattr(self, name)[k])
+        return arcs
+
+    def circular_states(self, r0):
+        '''
+        :param r0: (...) radii, broadcast against the arcs
+        :return: (..., S, 6) states of circular orbits of radius r0 through
+            the first and the last measurement
+        '''
+        r0 = np.asarray(r0, float)
+        k = np.arange(len(self.lengths))
+        last = self.lengths - 1
+        p1 = self.site[k, 0] + _range_to_radius(
+            self.site[k, 0], self.u[k, 0], r0)[..., None]*self.u[k, 0]
+        p2 = self.site[k, last] + _range_to_radius(
+            self.site[k, last], self.u[k, last], r0)[..., None]*self.u[k, last]
+        span = self.dt[k, last] - self.dt[k, 0]
+        chord = (p2 - p1)/np.where(span > 0, span, 1)[:, None]
+        r = (p1 + p2)/2
+        r = r*(r0/np.sqrt((r*r).sum(-1)))[..., None]
+        radial = r/r0[..., None]
+        v = chord - (chord*radial).sum(-1)[..., None]*radial
+        speed = np.sqrt((v*v).sum(-1))
+        v *= (np.sqrt(astrodyn.mu/r0)/np.where(speed > 0, speed, 1))[
+            ..., None]
+        return np.concatenate([r, v], -1)
+
+    def initial_states(self, weights, radii=_RADII):
+        '''
+        :return: (S, 6) best fitting circular_states() of the given radii;
+            light time is neglected in the choice
+        '''
+        x = self.circular_states(radii[:, None])
+        cost = _cost(self.residuals(x, np.zeros_like(self.dt)), weights)
+        return x[cost.argmin(0), np.arange(len(self.lengths))]
+
+    def light_time(self, x):
+        r = astrodyn.propagate_state(x[:, None, :3], x[:, None, 3:],
+                                     self.dt)[0]
+        rho = r - self.site
+        return np.sqrt((rho*rho).sum(-1))/astrodyn.c_light
+
+    def residuals(self, x, lt, partials=False):
+        '''
+        :param x: (..., S, 6) states at epoch
+        :param lt: (S, N) light time, s
+        :param partials: also return the derivatives of the residuals
+        :return: (..., S, N, 2) tangential and normal residuals, arcsec,
+            and with partials, (..., S, N, 2, 6) their derivatives with
+            respect to x (light time held fixed)
+        '''
+        if partials:
+            r, jac = astrodyn.propagate_partials(
+                x[..., None, :3], x[..., None, 3:], self.dt - lt)
+        else:
+            r = astrodyn.propagate_state(x[..., None, :3], x[..., None, 3:],
+                                         self.dt - lt)[0]
+        rho = r - self.site
+        dist = np.sqrt((rho*rho).sum(-1))[..., None]
+        u = rho/dist
+        d = self.u - u
+        res = np.stack([(d*self.e_tan).sum(-1), (d*self.e_norm).sum(-1)],
+                       -1)*krad
+        if not partials:
+            return res
+        # The residual along an axis e changes by -e.(I - u u)/|rho| dr
+        axes = np.stack([self.e_tan, self.e_norm], -2)
+        axes = axes - (axes*u[..., None, :]).sum(-1)[..., None]*u[
+            ..., None, :]
+        return res, np.matmul(axes, jac)*(-krad/dist[..., None])
+
+
+def _cost(res, weights):
+    cost = (weights*res*res).sum(-1).sum(-1)
+    return np.where(np.isfinite(cost), cost, np.inf)
+
+
+def _levenberg_marquardt(arcs, x, weights, max_iter, tol):
+    '''
+    :return: x, iterations, converged
+    '''
+    nstates = len(x)
+    iterations = np.zeros(nstates, int)
+    converged = np.zeros(nstates, bool)
+    lam = np.full(nstates, 1e-3)
+    lt = arcs.light_time(x)
+    cost = _cost(arcs.residuals(x, lt), weights)
+    active = np.flatnonzero(np.isfinite(cost))
+    for _ in xrange(max_iter):
+        if not len(active):
+            break
+        sub = arcs.subset(active)
+        xa, wa, lta = x[active], weights[active], lt[active]
+        res, jac = sub.residuals(xa, lta, True)
+        # (S, M, 6) Jacobian and (S, M) residuals, M = 2N
+        jac = jac.reshape(len(active), -1, 6)
+        res = res.reshape(len(active), -1)
+        wflat = wa.reshape(len(active), -1)
+        A = np.matmul(jac.transpose(0, 2, 1), wflat[..., None]*jac)
+        g = np.matmul(jac.transpose(0, 2, 1), (wflat*res)[..., None])[..., 0]
+        # Position and velocity columns differ in scale by orders of
+        # magnitude; the normal equations are solved for scaled variables
+        scale = np.sqrt(np.diagonal(A, axis1=1, axis2=2)) + 1e-150
+        A /= scale[:, :, None]*scale[:, None, :]
+        A[:, np.arange(6), np.arange(6)] += lam[active][:, None] + 1e-12
+        step = -np.linalg.solve(A, (g/scale)[..., None])[..., 0]/scale
+        xn = xa + step
+        cost_new = _cost(sub.residuals(xn, lta), wa)
+        better = cost_new < cost[active]
+        iterations[active] += 1
+        done = better & (cost[active] - cost_new <= tol*cost[active] + 1e-12)
+        done |= ~better & (lam[active] > 1e10)
+        k = active[better]
+        x[k] = xn[better]
+        cost[k] = cost_new[better]
+        lam[k] = np.maximum(lam[k]/10, 1e-12)
+        lam[active[~better]] *= 10
+        converged[active[done]] = True
+        # Light time follows the accepted states
+        lt[k] = arcs.subset(k).light_time(x[k])
+        active = active[~done]
+    return x, iterations, converged
+
+
+def _fit(arcs, r0, max_iter, tol, clip, clip_iter):
+    '''
+    Fit orbits to arcs with outlier rejection; see fit_arcs()
+    :return: x, weights, iterations, converged
+    '''
+    weights = np.repeat(arcs.mask[..., None], 2, -1).astype(float)
+    if r0 is None:
+        x = arcs.initial_states(weights)
+    else:
+        x = arcs.circular_states(r0)
+    iterations = np.zeros(len(x), int)
+    converged = np.zeros(len(x), bool)
+    todo = np.arange(len(x))
+    for npass in xrange(clip_iter + 1):
+        sub = arcs.subset(todo)
+        x[todo], n, converged[todo] = _levenberg_marquardt(
+            sub, x[todo], weights[todo], max_iter, tol)
+        iterations[todo] += n
+        if not clip or npass == clip_iter:
+            break
+        # Reject outliers of arcs that keep at least 3 points per coordinate
+        res = sub.residuals(x[todo], sub.light_time(x[todo]))
+        w = weights[todo]
+        used = np.maximum(w.sum(1), 1)
+        sigma = np.sqrt((w*res*res).sum(1)/used)
+        reject = (np.abs(res) > clip*sigma[:, None]) & (w > 0)
+        reject &= (w.sum(1) - reject.sum(1) >= 3)[:, None, :]
+        changed = reject.any(-1).any(-1)
+        if not changed.any():
+            break
+        w[reject] = 0
+        weights[todo] = w
+        todo = todo[changed]
+    return x, weights, iterations, converged
+
+
+def fit_arcs(mjd, ra, dec, start, stop, site, r0=None, max_iter=200,
+             tol=1e-10, clip=3.0, clip_iter=3):
+    '''
+    Fit orbits to arcs of measurements
+    :param mjd: epochs of all measurements, MJD (UTC)
+    :param ra, dec: J2000 right ascension, hours, and declination, degrees
+    :param start, stop: arrays of row ranges of the arcs, each one sorted by
+        time
+    :param site: station (latitude, longitude, altitude), degrees and km
+    :param r0: geocentric distance of the starting orbit, km; by default,
+        the best fitting one of circular orbits from LEO to beyond GEO
+    :param max_iter: maximum number of Levenberg-Marquardt iterations
+    :param tol: relative decrease of the sum of squares that stops them
+    :param clip: outlier rejection threshold, sigma; 0 to keep all points
+    :param clip_iter: maximum number of rejection passes
+    :return: elements, residuals - IOD_DTYPE array, one row per arc (NaN for
+        arcs of less than 3 points or if the fit failed; fits ending on an
+        orbit crossing the Earth or leaving it are not converged), and
+        FIT_RESIDUAL_DTYPE array parallel to the measurements
+    '''
+    mjd, ra, dec = [np.asarray(x, float) for x in (mjd, ra, dec)]
+    start = np.asarray(start, int).reshape(-1)
+    stop = np.asarray(stop, int).reshape(-1)
+    elements = np.zeros(len(start), IOD_DTYPE)
+    for name in ('epoch', 'a', 'e', 'i', 'W', 'w', 'M', 'Lon', 'r', 'v',
+                 'tan_rms', 'norm_rms'):
+        elements[name] = np.nan
+    residuals = np.zeros(len(mjd), FIT_RESIDUAL_DTYPE)
+    residuals['tan'] = residuals['norm'] = np.nan
+    # Arcs of similar lengths are fitted together, which limits padding
+    # and the number of groups
+    lengths = stop - start
+    bounds = []
+    for length in np.unique(lengths[lengths >= 3]):
+        if not bounds or length > _GROUP_RATIO*bounds[-1][0]:
+            bounds.append([length, length])
+        bounds[-1][1] = length
+    for shortest, longest in bounds:
+        group = np.flatnonzero((lengths >= shortest) & (lengths <= longest))
+        arcs = _Arcs(mjd, ra, dec, start[group], stop[group], site)
+        x, weights, iterations, converged = _fit(
+            arcs, r0, max_iter, tol, clip, clip_iter)
+
+        res = arcs.residuals(x, arcs.light_time(x))
+        mask = arcs.mask
+        rows = arcs.rows[mask]
+        residuals['tan'][rows] = res[..., 0][mask]
+        residuals['norm'][rows] = res[..., 1][mask]
+        residuals['tan_outlier'][rows] = (weights[..., 0] == 0)[mask]
+        residuals['norm_outlier'][rows] = (weights[..., 1] == 0)[mask]
+        used = np.maximum(weights.sum(1), 1)
+        rms = np.sqrt((weights*res*res).sum(1)/used)
+
+        out = elements[group]
+        out['epoch'] = arcs.epoch
+        out['r'], out['v'] = x[:, :3], x[:, 3:]
+        out['a'], out['e'], out['i'], out['W'], out['w'], out['M'] = \
+            astrodyn.state_to_elements(x[:, :3], x[:, 3:])
+        out['Lon'] = astrodyn.sublon(x[:, :3], arcs.epoch)
+        out['tan_rms'], out['norm_rms'] = rms[:, 0], rms[:, 1]
+        out['used'] = weights[..., 0].sum(1)
+        out['iterations'] = iterations
+        with np.errstate(invalid='ignore'):
+            out['converged'] = converged & \
+                (out['a']*(1 - out['e']) > astrodyn.r_earth) & \
+                (out['a']*(1 + out['e']) < _APOGEE_MAX)
+        elements[group] = out
+    return elements, residuals
+
+
+def fit_res(meas, series, site, **kwargs):
+    '''
+    Fit orbits to all series of a .res file
+    :param meas, series: arrays as returned by coord.read_res_arrays()
+    :param site: station (latitude, longitude, altitude), degrees and km
+    :param kwargs: see fit_arcs()
+    :return: see fit_arcs()
+    '''
+    return fit_arcs(res_mjd(meas['date'], meas['time']), meas['RA'],
+                    meas['DEC'], series['start'], series['stop'], site,
+                    **kwargs)
@@ -35,13 +35,39 @@ name.
 Script-specific options:
   dump_orbit = 0 | 1
     dump orbital elements to .check file in a human-readable form; default: 0
+  ephem_cache_size = <non-negative integer>
+    maximum number of catalog object ephemerides kept in memory; default:
+    100000
+  export_ident = 0 | 1
+    rewrite ident.txt from the identification database after the run; 0 -
+    keep identifications in the database only (export them with "python
+    identdb.py export" when needed); default: 0
+  frame_reader = apex | fits
+    reader of frame epochs; apex - Apex image header reader (default), fits
+    - DATE-OBS/TIME-OBS keywords of FITS files; epochs are kept in the
+    .frame_epochs file and only new or modified files are read
+  frame_threads = <positive integer>
+    number of threads reading frame headers; default: 8
+  ident_db = <file name>
+    identification database; ident.txt is rewritten from it if
+    export_ident = 1; default: ident.db
   max_track_len = <positive float>
     maximum allowed duration of a single track, minutes; default: 300
+  profile = 0 | 1
+    profile the main process with cProfile and write the statistics to a
+    file with ".prof" suffix appended to the .check file name; default: 0
   save_orbit = none | uncorrelated | all
     save orbital elements to files; none - don't save (default), uncorrelated -
     only for uncorrelated objects, all - for all objects
   split_by_match = 0 | 1
     split series in .check file according to catalog match; default: 0
+  timing = none | csv | json
+    write wall time of processing stages per target to a file with
+    ".timing.csv" or ".timing.json" suffix appended to the .check file name;
+    none - don't time stages (default)
+  workers = <non-negative integer>
+    number of processes for processing targets in parallel; 0 - one per CPU;
+    default: 1
 """
 
 import sys
@@ -58,7 +84,6 @@ import apex.conf
 import apex.sitedef
 from apex.timescale import cal_to_mjd, utc_to_lst
 from apex.astrometry.precession import prenut
-from apex.math.functions import sind, cosd, sinhr, coshr
 from apex.io import imheader
 from apex.catalog import suitable_catalogs, catalogs, match_objects, query_id
 from apex.extra.GEO.report import geo_report_formats
@@ -69,26 +94,179 @@ from apex.extra.GEO.astrodynamics import ecc_from_mean, mu
 from apex.extra.GEO.propagation import (compute_ephemeris, ephem_helper,
     orbit_propagators)
 
+import multiprocessing
 import os.path
 from glob import glob
-from datetime import date, time, timedelta
-from numpy import (arctan, array, asarray, clip, concatenate, cos, cross,
-    deg2rad, dot, log10, median, pi, rad2deg, sin, sqrt, tan, transpose, where)
+from StringIO import StringIO
+from datetime import time, timedelta
+from numpy import (arctan, array, asarray, clip, concatenate, cos, deg2rad,
+    log10, median, pi, rad2deg, sin, sqrt, tan, transpose, where)
+
+import checkreport
+import identdb
+from frameindex import fits_epoch, frame_epochs
+from ephemcache import EphemerisCache
+from residuals import ext_residuals
+from timing import profiled, timed, timings
+from tracks import split_tracks
 
 
 # Script-specific options
 dump_orbit = True
+ephem_cache_size = apex.conf.Option('ephem_cache_size', 100000,
+    'Maximum number of catalog object ephemerides kept in memory',
+    constraint = 'ephem_cache_size >= 0')
+export_ident = apex.conf.Option('export_ident', False,
+    'Rewrite ident.txt from the identification database')
+frame_reader = apex.conf.Option('frame_reader', 'apex',
+    'Reader of frame epochs', enum = ('apex', 'fits'))
+frame_threads = apex.conf.Option('frame_threads', 8,
+    'Number of threads reading frame headers',
+    constraint = 'frame_threads > 0')
+ident_db = apex.conf.Option('ident_db', identdb.ident_db,
+    'Identification database')
 max_track_len = apex.conf.Option('max_track_len', 300.0,
     'Maximum allowed duration of a single track, minutes',
     constraint = 'max_track_len > 0')
+profile = apex.conf.Option('profile', False,
+    'Profile the main process with cProfile')
 save_orbit = apex.conf.Option('save_orbit', 'none',
     'Save orbital elements to files', enum = ('none', 'uncorrelated', 'all'))
 split_by_match = apex.conf.Option('split_by_match', False,
     'Split series in .check file according to catalog match')
+timing_format = apex.conf.Option('timing', 'none',
+    'Write wall time of processing stages per target',
+    enum = ('none', 'csv', 'json'))
+workers = apex.conf.Option('workers', 1,
+    'Number of processes for processing targets in parallel; 0 - one per CPU',
+    constraint = 'workers >= 0')
+
+
+# Conversion to the true equator and equinox of date
+
+# Whether prenut() handles arrays; checked against scalar calls on first use
+_vector_prenut = None
+
+
+@timed('tod')
+def to_tod(ra, dec, mjd):
+    global _vector_prenut
+    if _vector_prenut is not False and len(mjd) > 1:
+        try:
+            ra_tod, dec_tod = [asarray(x, float)
+                               for x in prenut(ra, dec, 2000.0, mjd, True)]
+            if _vector_prenut is None:
+                # Compare with scalar calls for the first and the last point
+                _vector_prenut = ra_tod.shape == dec_tod.shape == mjd.shape
+                for i in (0, -1):
+                    alpha, delta = prenut(ra[i], dec[i], 2000.0, mjd[i], True)
+                    if abs(ra_tod[i] - alpha) > 1e-12 or \
+                       abs(dec_tod[i] - delta) > 1e-12:
+                        _vector_prenut = False
+            if _vector_prenut:
+                return ra_tod, dec_tod
+        except Exception:
+            _vector_prenut = False
+    return asarray(zip(*[prenut(alpha, delta, 2000.0, t, True)
+                         for alpha, delta, t in zip(ra, dec, mjd)]))
+
+
+# Topocentric states of catalog objects
+
+# Whether obs_eci() and apply_topo() handle arrays; checked against scalar
+# calls on first use
+_vector_topo = None
+
+
+def _topo_point(pv, lst, latitude, altitude):
+    pv0 = concatenate(apex.sitedef.obs_eci(latitude, altitude, lst)[:2])*\
+        (1e-3/apex.sitedef.km_per_AU)
+    pv = array(pv)
+    apex.sitedef.apply_topo(pv, pv0)
+    return pv
+
+
+@timed('topo')
+def to_topo(pv, lst, latitude, altitude):
+    '''
+    :param pv: (n, 6) geocentric positions and velocities, AU and AU/s
+    :param lst: mean local sidereal times of the station, hours
+    :param latitude, altitude: station latitude (degrees) and altitude (km)
+    :return: (n, 6) topocentric positions and velocities
+    '''
+    global _vector_topo
+    pv, lst = asarray(pv, float), asarray(lst, float)
+    if _vector_topo is not False and len(lst) > 1:
+        try:
+            pv0 = concatenate([asarray(x, float) for x in
+                apex.sitedef.obs_eci(latitude, altitude, lst)[:2]])
+            if pv0.shape != pv.shape[::-1]:
+                raise ValueError('obs_eci() returned %s' % (pv0.shape,))
+            pv_topo = pv.copy()
+            apex.sitedef.apply_topo(pv_topo,
+                pv0.T*(1e-3/apex.sitedef.km_per_AU))
+            if _vector_topo is None:
+                # Compare with scalar calls for the first and the last point
+                _vector_topo = True
+                for i in (0, -1):
+                    ref = _topo_point(pv[i], lst[i], latitude, altitude)
+                    for part in (slice(0, 3), slice(3, 6)):
+                        if abs(pv_topo[i, part] - ref[part]).max() > \
+                           1e-12*abs(ref[part]).max():
+                            _vector_topo = False
+            if _vector_topo:
+                return pv_topo
+        except Exception:
+            _vector_topo = False
+    return asarray([_topo_point(x, t, latitude, altitude)
+                    for x, t in zip(pv, lst)]).reshape(pv.shape)
+
+
+# Catalog object ephemerides
+
+@timed('ephemeris')
+def _query_ephemeris(id, catid, epoch):
+    return query_id(id, catid, epoch, silent = True)[0]
+
+
+@timed('ephemeris')
+def _query_ephemerides(ids, catid, epoch):
+    found = dict((obj.id, obj)
+                 for obj in query_id(ids, catid, epoch, silent = True))
+    return [found.get(id) for id in ids]
+
+
+# Shared by all targets processed by the current process; created by
+# postprocess() and by each worker process
+ephemeris = None
+
+
+def new_ephemeris_cache(items = ()):
+    '''
+    :param items: entries of another cache to start with, see
+        EphemerisCache.items()
+    '''
+    global ephemeris
+    ephemeris = EphemerisCache(_query_ephemeris, ephem_cache_size.value,
+                               _query_ephemerides)
+    ephemeris.update(items)
+
+
+def prefetch_ephemerides(matches):
+    '''
+    Compute states of all matching objects at their measurement epochs, with
+    one catalog query per catalog and epoch
+    :param matches: dictionary of catalog matches by (tag, epoch)
+    '''
+    ephemeris.prefetch(sorted(
+        (match.id, match.catid, epoch)
+        for (tag, epoch), match in matches.iteritems()
+        if hasattr(match, 'id') and hasattr(match, 'catid')))
 
 
 # Initial orbit determination with outlier rejection
 
+@timed('iod')
 def find_orbit(ra, dec, mjds, site):
     N = len(mjds)
     orbit, tan_residuals, norm_residuals, tan_sigma, norm_sigma, \
@@ -101,57 +279,324 @@ def find_orbit(ra, dec, mjds, site):
         norm_flags)
 
 
-def print_element(output, orbit, match_orbits, elem):
-    attr = {'a': 'a', 'e': 'ecc', 'i': 'incl', 'W': 'raan', 'w': 'argp',
-            'M': 'anmean'}[elem]
-    if elem == 'a':
-        unit = 'km'
-    elif elem == 'e':
-        unit = None
-    else:
-        unit = 'deg'
+def elements(orbit):
+    '''
+    :param orbit: fitted orbit or osculating elements of a catalog object
+    :return: {element name: value} for checkreport.elements_block()
+    '''
+    return {'a': orbit.p if abs(orbit.ecc - 1) < 1e-8 else orbit.a,
+            'e': orbit.ecc, 'i': orbit.incl, 'W': orbit.raan,
+            'w': orbit.argp, 'M': orbit.anmean}
+
+
+# Processing of a single target
+
+def process_target(tag, measurements, matches, frames, site):
+    '''
+    :param tag: target tag
+    :param measurements: dictionary of measurements of the target by epoch
+    :param matches: dictionary of catalog matches by (tag, epoch)
+    :param frames: dictionary of image file names by epoch
+    :param site: station (latitude, longitude, altitude)
+    :return: None if there are no measurements, otherwise (text, ident) -
+        section of the .check file for the target and its entry for
+        ident.txt
+    '''
+    print '\n\n\nProcessing target: %s' % (tag,)
+    if not measurements:
+        return None
+    latitude, longitude, altitude = site
+    f = StringIO()
+
+    # Retrieve epochs, coordinates, and magnitudes
+    epochs = list(sorted(measurements))
+    mjd = asarray([cal_to_mjd(ep) for ep in epochs])
+    mjd0 = int(mjd[0])
+    ra, dec, mag = transpose([
+        (obj.ra, obj.dec, obj.mag if hasattr(obj, 'mag') else 0)
+        for obj in [measurements[ep] for ep in epochs]])
+
+    # Convert RA to HA
+    ha = ([utc_to_lst(ep) for ep in epochs] - ra) % 24
+
+    # Retrieve image file names
+    frame_names = [frames.get(t) for t in epochs]
+
+    # Split the full data for the current object into series by match
+    # name (if split_by_match is set), each series being not longer
+    # than max_track_len minutes
+    series = []
+    labels = [str(matches[tag, epoch].id)
+              if (tag, epoch) in matches and hasattr(matches[tag, epoch], 'id')
+              else '?' for epoch in epochs]
+    print '\nMatches:', ', '.join(set(labels))
+    if not split_by_match.value:
+        labels = None
+    for indices in split_tracks(mjd, max_track_len.value/(60.0*24), labels):
+        series.append(([frame_names[i] for i in indices],
+                       [epochs[i] for i in indices],
+                       mjd[indices], ra[indices], ha[indices],
+                       dec[indices], mag[indices]))
+        print '\nObservation series %d: %d measurement(s)' % \
+            (len(series), len(indices))
+
+    # List of tuples (id, num, totnum, dtan, dnorm) for the current
+    # target
+    matches_for_target = []
+
+    # Process all series for the current target
+    f.write(checkreport.target_header(tag, len(series) > 1))
+    for sernum, (frame_names, epochs, mjd, ra, ha, dec, mag) in \
+          enumerate(series):
+        print '\n\nProcessing series #%d' % (sernum + 1)
+
+        # Transform coordinates to TOD
+        ra_tod, dec_tod = to_tod(ra, dec, mjd)
+
+        # Fit an orbit to the current series and compute residuals with
+        # respect to this orbit
+        print '\nPerforming initial orbit determination'
+        try:
+            orbit, tan_residuals, tan_mean, tan_rms, norm_residuals, \
+                norm_mean, norm_rms, tan_flags, norm_flags = \
+                find_orbit(ra_tod, dec_tod, mjd, site)
+        except Exception as E:
+            print '\nOrbit determination failed:', E
+            orbit = tan_mean = norm_mean = tan_rms = norm_rms = None
+            tan_residuals = norm_residuals = [None]*len(mjd)
+            tan_flags = norm_flags = [' ']*len(mjd)
+
+        # Format matches and obtain geocentric states of matching
+        # objects; their topocentric states and external residuals are
+        # then computed for all measurements that have matches at once
+        str_match = []
+        pv_geo = []
+        matched = []
+        sublons = []
+        match_ids = set()
+        for i, epoch in enumerate(epochs):
+            try:
+                match = matches[tag, epoch]
 
-    if orbit is not None:
-        if elem in ('a', 'p'):
-            if abs(orbit.ecc - 1) < 1e-8:
-                attr = 'p'
-            else:
-                attr = 'a'
-        print >> output, '  %s%s' % (orbit._format_elem(elem, attr, unit),
-                                     ' (IOD)' if match_orbits else '')
-    for i, (obj_id, match_orbit) in enumerate(match_orbits):
-        if elem in ('a', 'p'):
-            if abs(match_orbit.ecc - 1) < 1e-8:
-                attr = 'p'
+                # Construct the full matching object ID
+                try:
+                    full_match_id = str(match.id)
+                except:
+                    full_match_id = '?'
+                try:
+                    full_match_id += '/%s' % match.intl_id
+                except AttributeError:
+                    pass
+                try:
+                    full_match_id += ' (%s)' % match.name
+                except AttributeError:
+                    pass
+
+                # Compute ephemeris for the same epoch
+                catobj = ephemeris(match.id, match.catid, epoch)
+                match_ids.add((match.id, match.catid))
+                sublons.append(catobj.sublon)
+
+                # Geocentric position and velocity
+                pv_geo.append(concatenate([catobj.p, catobj.v])/
+                    apex.sitedef.km_per_AU)
+
+                str_match.append(full_match_id)
+                matched.append(i)
+            except:
+                str_match.append('')
+
+        # Compute tangential/normal residuals
+        ext_tan_residuals = [None]*len(epochs)
+        ext_norm_residuals = [None]*len(epochs)
+        if matched:
+            pv_topo = to_topo(pv_geo,
+                [utc_to_lst(epochs[i], longitude/15, apparent = False)
+                 for i in matched], latitude, altitude)
+            with timings.stage('residuals'):
+                dtan, dnorm = ext_residuals(ra_tod[matched],
+                    dec_tod[matched], pv_topo)
+            for i, d1, d2 in zip(matched, dtan, dnorm):
+                ext_tan_residuals[i] = d1
+                ext_norm_residuals[i] = d2
+                matches_for_target.append((str_match[i][:40], d1, d2))
+
+        # Sub-point longitude
+        if sublons:
+            sublons = asarray(sublons)
+            if where(sublons < 90)[0].any() and \
+               where(sublons > 270)[0].any():
+                sublons[sublons > 180] -= 360
+            sublon = median(sublons) % 360
+        else:
+            sublon = None
+
+        # Deal with external residuals
+        d = array([d for d in ext_tan_residuals if d is not None])
+        if len(d):
+            ext_tan_mean = median(d)
+            ext_tan_rms = sqrt(((d - ext_tan_mean)**2).mean())
+        else:
+            ext_tan_mean = ext_tan_rms = None
+
+        d = array([d for d in ext_norm_residuals if d is not None])
+        if len(d):
+            ext_norm_mean = median(d)
+            ext_norm_rms = sqrt(((d - ext_norm_mean)**2).mean())
+        else:
+            ext_norm_mean = ext_norm_rms = None
+
+        with timings.stage('report'):
+            f.write(checkreport.residual_table(
+                mjd0, mjd, ra, ha, dec, mag, tan_residuals, norm_residuals,
+                ext_tan_residuals, ext_norm_residuals, str_match, tan_flags,
+                norm_flags,
+                (tan_mean, norm_mean, ext_tan_mean, ext_norm_mean),
+                (tan_rms, norm_rms, ext_tan_rms, ext_norm_rms), frame_names))
+
+        # Mark uncorrelated object
+        if str_match.count('') == len(str_match):
+            f.write(checkreport.uncorrelated)
+
+        if orbit is not None and (save_orbit.value == 'all' or
+           save_orbit.value == 'uncorrelated' and
+           str_match.count('') == len(str_match)):
+            # Save orbits of uncorrelated objects to separate files
+            from apex.extra.GEO.geo_catalog import ephem_propagator
+            propagate = orbit_propagators.plugins[
+                ephem_propagator.value].propagate
+            m0 = array(
+                [m - 5*log10(obj.r*apex.sitedef.km_per_AU/1000) +
+                 2.5*log10(sin(deg2rad(obj.phase)) +
+                 deg2rad(180 - obj.phase)*cos(deg2rad(obj.phase))) -
+                 2.5*log10(pi/1600)
+                 for m, obj in [(m, compute_ephemeris(
+                    FitSatellite(orbit), propagate, 'TEME',
+                    *ephem_helper(t, *site)))
+                    for m, t in zip(mag, mjd) if m is not None]])
+            t = orbit.epoch.replace(microsecond = 0) + timedelta(
+                microseconds = round(orbit.epoch.microsecond/ \
+                                     1000.0)*1000,
+                hours = -apex.timescale.eqeqx(orbit.epoch_mjd))
+            T = 2*pi*sqrt(orbit.p**3/mu)/60
+            with open('{}_{}.orbit'.format(*tag), 'wt') as fo:
+                print >> fo, \
+                    '|{:6d}| 0 |999|{:02d}{:02d}{:04d}|{:02d}{:02d}' \
+                    '{:02d}.{:03d}|{:+6.1f}|{:+5.1f}|{:10.3f}|' \
+                    '{:9.4f}|{:8.4f}|{:8.4f}|{:9.7f}|{:8.4f}|{:8.4f}' \
+                    '|  +0.00001|  +0.00001|    1 |+0.0000000|' \
+                    '{:5.1f}|{:3.1f}|{:6d}| 0.1|  1(0.1)|'.format(
+                    int(tag[1]) % 1000000, t.day, t.month, t.year,
+                    t.hour, t.minute, t.second, t.microsecond//1000,
+                    sublon if sublon is not None else 0,
+                    clip(-0.25*(T - 1436.2), -99, 99), orbit.a, T,
+                    orbit.incl, orbit.raan, orbit.ecc, orbit.argp,
+                    orbit.argp + 2*rad2deg(arctan(
+                        sqrt((1 + orbit.ecc)/(1 - orbit.ecc))*tan(
+                        deg2rad(ecc_from_mean(orbit.ecc,
+                            orbit.anmean))/2))),
+                    clip(m0.mean(), -99.9, 99.9) if len(m0) else 0,
+                    clip(m0.std(), 0, 9.9) if len(m0) > 1 else 0,
+                    int(tag[1]) % 1000000,)
+
+        # Orbit
+        if dump_orbit:
+            # Obtain osculating elements of matching catalog objects
+            # for the same epoch
+            match_orbits = []
+            if orbit is None:
+                epoch = epochs[0] + (epochs[-1] - epochs[0])/2
             else:
-                attr = 'a'
-        name_needed = orbit is None and not i
-        print >> output, '  %s%s (%s)' % ('' if name_needed else '   ',
-            match_orbit._format_elem(elem if name_needed else '', attr, unit),
-            obj_id)
+                epoch = orbit.epoch
+            for obj_id, obj_catid in sorted(match_ids):
+                catobj = ephemeris(obj_id, obj_catid, epoch)
+                match_orbits.append((obj_id, state_to_elem(catobj.p,
+                                                           catobj.v)))
+
+            with timings.stage('elements'):
+                f.write(checkreport.elements_block(
+                    None if orbit is None else orbit.epoch,
+                    None if orbit is None else elements(orbit),
+                    [(obj_id, elements(match_orbit))
+                     for obj_id, match_orbit in match_orbits], sublon))
+
+    # Target finished
+    f.write(checkreport.target_end)
+
+    # Deal with object identification
+    # Each element in the match list is a tuple ([date, tag,
+    # [(id,num,totnum,dtan,dnorm), (id,num,totnum,dtan,dnorm),...]),
+    # where "date" is UTC date (starting at 12AM) of the first
+    # observation, "tag" is object tag (e.g. a pair (station,target))
+    # in string representation, and the third element contains a list
+    # of catalog matches (id), along with number of observations
+    # matching this id, total number of observations, and tangential
+    # and normal residuals; id=None means no matches found
+    if hasattr(tag, '__getitem__'):
+        tagstr = ' '.join(['%06d' % item if isinstance(item, int) \
+                           else '%-6s' % item for item in tag])
+    else:
+        tagstr = str(tag)
+    totnum = len(measurements)
+    m = [
+        (match_id,
+         len([m for m in matches_for_target if m[0] == match_id]),
+         totnum,
+         median([m[1] for m in matches_for_target
+                 if m[0] == match_id])/3600.0,
+         median([m[2] for m in matches_for_target
+                 if m[0] == match_id])/3600.0)
+        for match_id in {m[0] for m in matches_for_target}]
+    if not m:
+        m = [(None, totnum, totnum, None, None)]
+    return f.getvalue(), (
+        [epoch.date() - timedelta(days = 1) if epoch.time() < time(12)
+         else epoch.date()
+         for epoch in list(sorted(measurements))][0], tagstr[:16], m)
+
+
+# Target processing in worker processes
+
+def _timed_target(tag, measurements, matches, frames, site):
+    timings.target = tag
+    try:
+        with timings.stage('target'):
+            return process_target(tag, measurements, matches, frames, site)
+    finally:
+        timings.target = ''
 
-    # if len(match_orbits) + int(orbit is not None) > 1:
-        # print >> output
 
+def _init_worker(blocks, matches, frames, site, timed, ephemerides):
+    global _worker_state
+    _worker_state = blocks, matches, frames, site
+    new_ephemeris_cache(ephemerides)
+    timings.enabled = timed
 
-def main():
+
+def _process_target_job(tag):
+    blocks, matches, frames, site = _worker_state
+    return _timed_target(tag, blocks[tag], matches, frames, site), \
+        os.getpid(), ephemeris.hits, ephemeris.misses, timings.take()
+
+
+def postprocess(filename):
     # Read and parse the input file; cannot do this with load_measurements(),
     # as we'll need to know the actual report format to do correct rounding of
     # epochs of measurements
-    filename = sys.argv[1]
     print '\nPostprocessing observations from file %s' % filename
     blocks = None
-    for report_fmt in geo_report_formats.plugins.itervalues():
-        try:
-            blocks = report_fmt.load_measurements(filename)
-            if blocks:
-                print 'Loaded %d measurement(s) from "%s" (%s)' % (
-                    sum([len(measurements)
-                         for measurements in blocks.itervalues()]),
-                    filename, report_fmt.descr)
-                break
-        except:
-            pass
+    with timings.stage('load'):
+        for report_fmt in geo_report_formats.plugins.itervalues():
+            try:
+                blocks = report_fmt.load_measurements(filename)
+                if blocks:
+                    print 'Loaded %d measurement(s) from "%s" (%s)' % (
+                        sum([len(measurements)
+                             for measurements in blocks.itervalues()]),
+                        filename, report_fmt.descr)
+                    break
+            except:
+                pass
     if not blocks:
         print 'Unable to recognize measurement file format or no ' \
            'measurements in file "%s"' % filename
@@ -160,13 +605,22 @@ def main():
     # Obtain image file names
     print 'Retrieving measurement epochs'
     frames = {}
-    for fn in glob('*'):
-        if os.path.splitext(fn)[1].lower() not in ('.proclog', '.apex',
-                                                   '.metadata'):
+    names = [fn for fn in glob('*')
+             if os.path.splitext(fn)[1].lower() not in ('.proclog', '.apex',
+                                                        '.metadata')]
+    if frame_reader.value == 'fits':
+        reader = fits_epoch
+    else:
+        reader = lambda fn: imheader(fn)[0].obstime
+    with timings.stage('frames'):
+        obstimes = frame_epochs(names, reader, tag = frame_reader.value,
+                                threads = frame_threads.value)
+    for fn in names:
+        if fn in obstimes:
             try:
                 # Round epoch to precision used by report format
                 frames[report_fmt.parse_epoch(report_fmt.format_epoch(
-                    imheader(fn)[0].obstime))] = fn
+                    obstimes[fn]))] = fn
             except:
                 pass
 
@@ -177,471 +631,131 @@ def main():
     match_catalogs = [id for id in suitable_catalogs('ident')
                       if isinstance(catalogs.plugins[id], GEO_Catalog)]
     matches = {}
-    if match_catalogs:
-        # For greater efficiency, we obtain the list of observation epochs and
-        # perform identification for all measurements referring to the same
-        # epoch at once - this allows to compute all catalog satellite
-        # ephemerides only once per epoch
-        print '\nPerforming identification with', match_catalogs
-        epochs = list(set(builtin_sum([blocks[tag].keys() for tag in blocks],
-                                      [])))
-        epochs.sort()
-
-        for epoch_num, epoch in enumerate(epochs):
-            print '\nMatching observations for epoch %s (%d of %d)' % \
-                (epoch, epoch_num + 1, len(epochs))
-
-            # Retrieve measurements for the given epoch
-            tags, objs = zip(*[(tag, blocks[tag][epoch]) for tag in blocks
-                               if epoch in blocks[tag]])
-
-            # Match all objects for the current epoch
-            obj_matches = match_objects(objs, match_catalogs, epoch)
-
-            # Save all objects for which a match has been found
-            for tag, match in zip(tags, obj_matches):
-                if match is not None:
-                    matches[tag, epoch] = match
-
-            print '%d of %d measurement(s) identified' % \
-                (len(obj_matches) - obj_matches.count(None), len(obj_matches))
+    with timings.stage('identify'):
+        if match_catalogs:
+            # For greater efficiency, we obtain the list of observation
+            # epochs and perform identification for all measurements
+            # referring to the same epoch at once - this allows to compute
+            # all catalog satellite ephemerides only once per epoch
+            print '\nPerforming identification with', match_catalogs
+            epochs = list(set(builtin_sum([blocks[tag].keys()
+                                           for tag in blocks], [])))
+            epochs.sort()
+
+            for epoch_num, epoch in enumerate(epochs):
+                print '\nMatching observations for epoch %s (%d of %d)' % \
+                    (epoch, epoch_num + 1, len(epochs))
+
+                # Retrieve measurements for the given epoch
+                tags, objs = zip(*[(tag, blocks[tag][epoch])
+                                   for tag in blocks if epoch in blocks[tag]])
+
+                # Match all objects for the current epoch
+                obj_matches = match_objects(objs, match_catalogs, epoch)
+
+                # Save all objects for which a match has been found
+                for tag, match in zip(tags, obj_matches):
+                    if match is not None:
+                        matches[tag, epoch] = match
+
+                print '%d of %d measurement(s) identified' % \
+                    (len(obj_matches) - obj_matches.count(None),
+                     len(obj_matches))
 
     # Obtain station coordinates
     latitude = apex.sitedef.latitude.value
     longitude = apex.sitedef.longitude.value
     altitude = apex.sitedef.altitude.value
 
+    # States of the matching objects, fetched for all targets at once
+    new_ephemeris_cache()
+    if matches:
+        print '\nComputing ephemerides of matching objects'
+        prefetch_ephemerides(matches)
+
     # List of matches for ident.txt
     match_list = []
 
-    # Output report
+    # Output report; targets are processed in parallel if requested, and
+    # their sections are written in the sorted order of tags in any case
+    site = (latitude, longitude, altitude)
+    tags = sorted(blocks)
+    pool = None
+    # Ephemeris cache statistics by process ID, including the prefetch
+    ephem_stats = {os.getpid(): (ephemeris.hits, ephemeris.misses)}
+    if workers.value != 1 and len(tags) > 1:
+        pool = multiprocessing.Pool(workers.value or None, _init_worker,
+                                    (blocks, matches, frames, site,
+                                     timings.enabled, ephemeris.items()))
+        results = pool.imap(_process_target_job, tags)
+    else:
+        results = ((_timed_target(tag, blocks[tag], matches, frames, site),
+                    os.getpid(), ephemeris.hits, ephemeris.misses, [])
+                   for tag in tags)
     filename += '.check'
-    with open(filename, 'wt') as f:
-        # Process each target sequentially
-        for tag in sorted(blocks):
-            print '\n\n\nProcessing target: %s' % (tag,)
-            measurements = blocks[tag]
-            if not measurements:
-                continue
-
-            # Retrieve epochs, coordinates, and magnitudes
-            epochs = list(sorted(measurements))
-            mjd = asarray([cal_to_mjd(ep) for ep in epochs])
-            mjd0 = int(mjd[0])
-            ra, dec, mag = transpose([
-                (obj.ra, obj.dec, obj.mag if hasattr(obj, 'mag') else 0)
-                for obj in [measurements[ep] for ep in epochs]])
-
-            # Convert RA to HA
-            ha = ([utc_to_lst(ep) for ep in epochs] - ra) % 24
-
-            # Retrieve image file names
-            frame_names = [frames.get(t) for t in epochs]
-
-            # Split the full data for the current object into series by match
-            # name (if split_by_match is set), each series being not longer
-            # than max_track_len minutes
-            series = []
-            matches_for_target = {str(matches[tag, epoch].id)
-                 if (tag, epoch) in matches and hasattr(matches[tag, epoch],
-                                                        'id')
-                 else '?' for epoch in epochs}
-            print '\nMatches:', ', '.join(matches_for_target)
-            if not split_by_match.value:
-                matches_for_target = ['']
-            for match_id in matches_for_target:
-                if split_by_match.value:
-                    # Extract only measurements for the current match_id
-                    indices = []
-                    for i, epoch in enumerate(epochs):
-                        has_match = (tag, epoch) in matches and \
-                                    hasattr(matches[tag, epoch], 'id')
-                        if has_match and \
-                           matches[tag, epoch].id == match_id or \
-                           not has_match and match_id == '?':
-                            indices.append(i)
-                else:
-                    # Use all measurements
-                    indices = range(len(epochs))
-
-                frame_names_for_match = [frame_names[i] for i in indices]
-                epochs_for_match = [epochs[i] for i in indices]
-                mjd_for_match = mjd[indices]
-                ra_for_match = ra[indices]
-                ha_for_match = ha[indices]
-                dec_for_match = dec[indices]
-                mag_for_match = mag[indices]
-
-                # Split by duration of series
-                istart = 0
-                for i, t in enumerate(mjd_for_match):
-                    if i == len(mjd_for_match) - 1:
-                        # Last record; force end of series
-                        iend = i + 1
-                    elif (t - mjd_for_match[istart]) > \
-                         max_track_len.value/(60.0*24):
-                        # New series starts; finish the previous one
-                        iend = i
-                    else:
-                        # Current series continues
-                        continue
-                    # Append the finished series
-                    series.append((frame_names_for_match[istart:iend],
-                                   epochs_for_match[istart:iend],
-                                   mjd_for_match[istart:iend],
-                                   ra_for_match[istart:iend],
-                                   ha_for_match[istart:iend],
-                                   dec_for_match[istart:iend],
-                                   mag_for_match[istart:iend]))
-                    print '\nObservation series %d: %d measurement(s)' % \
-                        (len(series), iend - istart)
-                    istart = iend
-
-            # List of tuples (id, num, totnum, dtan, dnorm) for the current
-            # target
-            matches_for_target = []
-
-            # Process all series for the current target
-            print >> f, ('-- Target: %s ' % (tag,)).ljust(150, '-')
-            if len(series) > 1:
-                print >> f, '\nWARNING. Measurements possibly contain ' \
-                    'multiple objects'
-            for sernum, (frame_names, epochs, mjd, ra, ha, dec, mag) in \
-                  enumerate(series):
-                print '\n\nProcessing series #%d' % (sernum + 1)
-
-                # Transform coordinates to TOD
-                ra_tod, dec_tod = asarray(zip(*
-                    [prenut(alpha, delta, 2000.0, t, True)
-                     for alpha, delta, t in zip(ra, dec, mjd)]))
-
-                # Format magnitudes and internal residuals for output
-                str_mag = ['%5.2f' % m if m else '' for m in mag]
-
-                # Fit an orbit to the current series and compute residuals with
-                # respect to this orbit
-                print '\nPerforming initial orbit determination'
-                site = (latitude, longitude, altitude)
-                try:
-                    orbit, tan_residuals, tan_mean, tan_rms, norm_residuals, \
-                        norm_mean, norm_rms, tan_flags, norm_flags = \
-                        find_orbit(ra_tod, dec_tod, mjd, site)
-
-                    # Format internal residuals for output
-                    str_int_tan_residuals = \
-                        ['%+09.2f' % d if d is not None else ''
-                         for d in tan_residuals]
-                    str_int_norm_residuals = \
-                        ['%+09.2f' % d if d is not None else ''
-                         for d in norm_residuals]
-                except Exception as E:
-                    print '\nOrbit determination failed:', E
-                    orbit = tan_mean = norm_mean = tan_rms = norm_rms = None
-                    str_int_tan_residuals = str_int_norm_residuals = \
-                        ['']*len(mjd)
-                    tan_flags = norm_flags = [' ']*len(mjd)
-
-                # Format matches and compute external residuals for
-                # measurements that have matches
-                ext_tan_residuals, ext_norm_residuals, str_match = [], [], []
-                sublons = []
-                match_ids = set()
-                for i, epoch in enumerate(epochs):
-                    try:
-                        match = matches[tag, epoch]
-
-                        # Construct the full matching object ID
-                        try:
-                            full_match_id = str(match.id)
-                        except:
-                            full_match_id = '?'
-                        try:
-                            full_match_id += '/%s' % match.intl_id
-                        except AttributeError:
-                            pass
-                        try:
-                            full_match_id += ' (%s)' % match.name
-                        except AttributeError:
-                            pass
-
-                        # Compute ephemeris for the same epoch
-                        catobj = query_id(match.id, match.catid, epoch,
-                                          silent = True)[0]
-                        match_ids.add((match.id, match.catid))
-                        sublons.append(catobj.sublon)
-
-                        # Compute tangential/normal residuals
-                        pv0 = concatenate(apex.sitedef.obs_eci(latitude,
-                            altitude, utc_to_lst(epoch, longitude/15,
-                                apparent = False))[:2])*\
-                            (1e-3/apex.sitedef.km_per_AU)
-                        pv = concatenate([catobj.p, catobj.v])/ \
-                            apex.sitedef.km_per_AU
-                        apex.sitedef.apply_topo(pv, pv0)
-                        e1 = pv[:3]
-                        e1 /= sqrt((e1**2).sum())
-                        e2 = pv[3:] - dot(pv[3:], e1)*e1
-                        e2 /= sqrt((e2**2).sum())
-                        e3 = cross(e1, e2)
-                        I = [cosd(dec_tod[i])*coshr(ra_tod[i]),
-                             cosd(dec_tod[i])*sinhr(ra_tod[i]),
-                             sind(dec_tod[i])]
-                        krad = 180/pi*3600
-                        dtan = dot(I, e2)*krad
-                        dnorm = dot(I, e3)*krad
-
-                        str_match.append(full_match_id)
-                        ext_tan_residuals.append(dtan)
-                        ext_norm_residuals.append(dnorm)
-                        matches_for_target.append((full_match_id[:40], dtan,
-                                                   dnorm))
-                    except:
-                        str_match.append('')
-                        ext_tan_residuals.append(None)
-                        ext_norm_residuals.append(None)
-
-                # Sub-point longitude
-                if sublons:
-                    sublons = asarray(sublons)
-                    if where(sublons < 90)[0].any() and \
-                       where(sublons > 270)[0].any():
-                        sublons[sublons > 180] -= 360
-                    sublon = median(sublons) % 360
-                else:
-                    sublon = None
-
-                # Deal with external residuals
-                d = array([d for d in ext_tan_residuals if d is not None])
-                if len(d):
-                    ext_tan_mean = median(d)
-                    ext_tan_rms = sqrt(((d - ext_tan_mean)**2).mean())
-                else:
-                    ext_tan_mean = ext_tan_rms = None
-                str_ext_tan_residuals = ['%+09.2f' % d if d is not None else ''
-                                         for d in ext_tan_residuals]
-
-                d = array([d for d in ext_norm_residuals if d is not None])
-                if len(d):
-                    ext_norm_mean = median(d)
-                    ext_norm_rms = sqrt(((d - ext_norm_mean)**2).mean())
-                else:
-                    ext_norm_mean = ext_norm_rms = None
-                str_ext_norm_residuals = ['{:+09.2f}'.format(d)
-                                          if d is not None else ''
-                                          for d in ext_norm_residuals]
-
-                # Compute the maximum frame name width
-                fnwidth = max([len(fn) if fn else 0 for fn in frame_names])
-                if fnwidth:
-                    fnwidth += 2
-
-                # Header
-                h = '\n\n%-*s%11s  %10s  %10s  %10s  %5s  %22s  %42s  Match' \
-                    '\n%-*s%11s  %-10s  %-10s  %-10s  %5s  %10s  %10s  %9s  ' \
-                        '%9s' % \
-                    (fnwidth, 'Frame'.center(fnwidth - 2) if fnwidth else '',
-                     'MJD - %5d' % mjd0, 'RA'.center(10), 'HA'.center(10),
-                     'Dec'.center(10), 'mag'.center(5),
-                     'Int. residuals ["]'.center(22),
-                     'Ext. residuals ["]'.center(18),
-
-                     fnwidth, '', '', '  h', '  h', '   d', '',
-                     'Tangent'.center(10), 'Normal'.center(10),
-                     'Tangent.'.center(9), 'Normal'.center(9),
-                    )
-                print >> f, h
-
-                for res in zip(frame_names, mjd - mjd0, ra, ha, dec, str_mag,
-                               str_int_tan_residuals, tan_flags,
-                               str_int_norm_residuals, norm_flags,
-                               str_ext_tan_residuals, str_ext_norm_residuals,
-                               str_match):
-                    if fnwidth:
-                        s = '%-*s' % (fnwidth, res[0])
-                    else:
-                        s = ''
-                    print >> f, s + '%11.8f  %010.7f  %010.7f  %+010.6f  ' \
-                        '%5s  %9s%c  %9s%c  %9s  %9s  %s' % res[1:]
-
-                # Totals
-                print >> f, 'Median:' + ' '*(49 + fnwidth) + \
-                            '%9s   %9s   %9s  %9s' % \
-                    ('%+9.2f' % tan_mean if tan_mean is not None else '',
-                     '%+9.2f' % norm_mean if norm_mean is not None else '',
-                     '%+9.2f' % ext_tan_mean if ext_tan_mean is not None \
-                                else '',
-                     '%+9.2f' % ext_norm_mean if ext_norm_mean is not None \
-                                else '')
-                if tan_rms is not None or norm_rms is not None or \
-                   ext_tan_rms is not None or ext_norm_rms is not None:
-                    print >> f, 'RMS:' + ' '*(52 + fnwidth) + \
-                                '%9s   %9s   %9s  %9s' % \
-                        ('%9.2f' % tan_rms if tan_rms is not None else '',
-                         '%9.2f' % norm_rms if norm_rms is not None else '',
-                         '%9.2f' % ext_tan_rms if ext_tan_rms is not None \
-                                   else '',
-                         '%9.2f' % ext_norm_rms if ext_norm_rms is not None \
-                                   else '')
-
-                # Mark uncorrelated object
-                if str_match.count('') == len(str_match):
-                    print >> f, '\nWARNING. The object is uncorrelated'
-
-                if orbit is not None and (save_orbit.value == 'all' or
-                   save_orbit.value == 'uncorrelated' and
-                   str_match.count('') == len(str_match)):
-                    # Save orbits of uncorrelated objects to separate files
-                    from apex.extra.GEO.geo_catalog import ephem_propagator
-                    propagate = orbit_propagators.plugins[
-                        ephem_propagator.value].propagate
-                    m0 = array(
-                        [m - 5*log10(obj.r*apex.sitedef.km_per_AU/1000) +
-                         2.5*log10(sin(deg2rad(obj.phase)) +
-                         deg2rad(180 - obj.phase)*cos(deg2rad(obj.phase))) -
-                         2.5*log10(pi/1600)
-                         for m, obj in [(m, compute_ephemeris(
-                            FitSatellite(orbit), propagate, 'TEME',
-                            *ephem_helper(t, *site)))
-                            for m, t in zip(mag, mjd) if m is not None]])
-                    t = orbit.epoch.replace(microsecond = 0) + timedelta(
-                        microseconds = round(orbit.epoch.microsecond/ \
-                                             1000.0)*1000,
-                        hours = -apex.timescale.eqeqx(orbit.epoch_mjd))
-                    T = 2*pi*sqrt(orbit.p**3/mu)/60
-                    with open('{}_{}.orbit'.format(*tag), 'wt') as fo:
-                        print >> fo, \
-                            '|{:6d}| 0 |999|{:02d}{:02d}{:04d}|{:02d}{:02d}' \
-                            '{:02d}.{:03d}|{:+6.1f}|{:+5.1f}|{:10.3f}|' \
-                            '{:9.4f}|{:8.4f}|{:8.4f}|{:9.7f}|{:8.4f}|{:8.4f}' \
-                            '|  +0.00001|  +0.00001|    1 |+0.0000000|' \
-                            '{:5.1f}|{:3.1f}|{:6d}| 0.1|  1(0.1)|'.format(
-                            int(tag[1]) % 1000000, t.day, t.month, t.year,
-                            t.hour, t.minute, t.second, t.microsecond//1000,
-                            sublon if sublon is not None else 0,
-                            clip(-0.25*(T - 1436.2), -99, 99), orbit.a, T,
-                            orbit.incl, orbit.raan, orbit.ecc, orbit.argp,
-                            orbit.argp + 2*rad2deg(arctan(
-                                sqrt((1 + orbit.ecc)/(1 - orbit.ecc))*tan(
-                                deg2rad(ecc_from_mean(orbit.ecc,
-                                    orbit.anmean))/2))),
-                            clip(m0.mean(), -99.9, 99.9) if len(m0) else 0,
-                            clip(m0.std(), 0, 9.9) if len(m0) > 1 else 0,
-                            int(tag[1]) % 1000000,)
-
-                # Orbit
-                if dump_orbit:
-                    # Obtain osculating elements of matching catalog objects
-                    # for the same epoch
-                    match_orbits = []
-                    if orbit is None:
-                        epoch = epochs[0] + (epochs[-1] - epochs[0])/2
-                    else:
-                        epoch = orbit.epoch
-                    for obj_id, obj_catid in sorted(match_ids):
-                        catobj = query_id(obj_id, obj_catid, epoch,
-                                          silent = True)[0]
-                        match_orbits.append((obj_id, state_to_elem(catobj.p,
-                                                                   catobj.v)))
-
-                    if orbit is None:
-                        if match_orbits:
-                            print >> f, 'Osculating elements of catalog ' \
-                                'object(s)'
-                    else:
-                        print >> f, 'Osculating elements for epoch %s:' % \
-                            orbit.epoch
-                    print_element(f, orbit, match_orbits, 'a')
-                    print_element(f, orbit, match_orbits, 'e')
-                    print_element(f, orbit, match_orbits, 'i')
-                    print_element(f, orbit, match_orbits, 'W')
-                    print_element(f, orbit, match_orbits, 'w')
-                    print_element(f, orbit, match_orbits, 'M')
-
-                    if sublon is not None:
-                        print >> f, 'Longitude of sub-satellite point: ' \
-                            '%.1f' % sublon
-
-            # Target finished
-            print >> f, '\n'
-
-            # Deal with object identification
-            # Each element in the match list is a tuple ([date, tag,
-            # [(id,num,totnum,dtan,dnorm), (id,num,totnum,dtan,dnorm),...]),
-            # where "date" is UTC date (starting at 12AM) of the first
-            # observation, "tag" is object tag (e.g. a pair (station,target))
-            # in string representation, and the third element contains a list
-            # of catalog matches (id), along with number of observations
-            # matching this id, total number of observations, and tangential
-            # and normal residuals; id=None means no matches found
-            if hasattr(tag, '__getitem__'):
-                tagstr = ' '.join(['%06d' % item if isinstance(item, int) \
-                                   else '%-6s' % item for item in tag])
-            else:
-                tagstr = str(tag)
-            totnum = len(measurements)
-            m = [
-                (match_id,
-                 len([m for m in matches_for_target if m[0] == match_id]),
-                 totnum,
-                 median([m[1] for m in matches_for_target
-                         if m[0] == match_id])/3600.0,
-                 median([m[2] for m in matches_for_target
-                         if m[0] == match_id])/3600.0)
-                for match_id in {m[0] for m in matches_for_target}]
-            if not m:
-                m = [(None, totnum, totnum, None, None)]
-            match_list.append(
-                ([epoch.date() - timedelta(days = 1) if epoch.time() < time(12)
-                  else epoch.date()
-                  for epoch in list(sorted(measurements))][0], tagstr[:16], m))
-
-    # Update the ident.txt file
-    ident = {}
-    prev_date = prev_tagstr = None
     try:
-        lines = open('ident.txt', 'rU').read().splitlines()
-
-        for line in lines:
-            tagstr = line[10:26].strip()
-            try:
-                curr_date = date(*[int(s) for s in line[:10].split('-')])
-                prev_date, prev_tagstr = curr_date, tagstr
-            except:
-                curr_date = None
-            match_str = line[26:].strip()
-            if curr_date is None:
-                # More matches for the current target
-                if prev_date is not None:
-                    ident[prev_date, prev_tagstr].append(match_str)
-            else:
-                # New target
-                ident[curr_date, tagstr] = [match_str]
-    except:
-        pass
+        with open(filename, 'wt') as f:
+            for result, pid, hits, misses, target_timings in results:
+                ephem_stats[pid] = hits, misses
+                timings.merge(target_timings)
+                if result is not None:
+                    text, ident_entry = result
+                    with timings.stage('write'):
+                        f.write(text)
+                    match_list.append(ident_entry)
+    finally:
+        # All results are in, or a target failed and the rest is not needed
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    hits, misses = [builtin_sum(n) for n in zip(*ephem_stats.values())] \
+        if ephem_stats else (0, 0)
+    print '\nEphemeris cache: %d hit(s), %d miss(es), hit rate %.1f%%' % (
+        hits, misses, 100.0*hits/(hits + misses) if hits + misses else 0)
 
     # Sort matches by the number of measurements per match
-    for d, tagstr, matches in match_list:
-        ident[d, tagstr] = ['%-40s  %3d/%-3d  %6.3f  %6.3f' % \
-                           m if m[0] is not None \
-                           else '%-40s  %3d' % ('???', m[1])
-                           for m in sorted(matches, key = lambda m: m[1],
-                                           reverse = True)]
-
+    ident = [(d, tagstr, ['%-40s  %3d/%-3d  %6.3f  %6.3f' % \
+                          m if m[0] is not None \
+                          else '%-40s  %3d' % ('???', m[1])
+                          for m in sorted(matches, key = lambda m: m[1],
+                                          reverse = True)])
+             for d, tagstr, matches in match_list]
+
+    # Store identifications of the processed targets; the first run imports
+    # the existing ident.txt
     try:
-        with open('ident.txt', 'wt') as f:
-            print >> f, """
-       Date     Measurements   Match ID/designation                     Num /Total Residual [deg]
-                                                                      matched      tan    norm
-    """
-            for d, tagstr in sorted(ident):
-                matches = ident[d, tagstr]
-                print >> f, '%10s %-15s %s' % (d, tagstr, matches[0])
-                for matchstr in matches[1:]:
-                    print >> f, '%26s %s' % ('', matchstr)
+        with timings.stage('ident'):
+            conn = identdb.connect(ident_db.value)
+            try:
+                if identdb.is_empty(conn) and os.path.exists('ident.txt'):
+                    print '\nImported %d identification(s) from ident.txt' % \
+                        identdb.import_text(conn, 'ident.txt')
+                identdb.update(conn, ident)
+                if export_ident.value:
+                    identdb.export_text(conn, 'ident.txt')
+            finally:
+                conn.close()
     except Exception as E:
-        print '\n\nWARNING. Error updating ident.txt:', E
+        print '\n\nWARNING. Error updating identifications:', E
 
     print '\n\nPostprocessing complete; results written to %s' % filename
 
+
+def main():
+    filename = sys.argv[1]
+    timings.enabled = timing_format.value != 'none'
+    with profiled(filename + '.check.prof' if profile.value else None):
+        postprocess(filename)
+    if profile.value:
+        print 'Profile written to %s.check.prof' % filename
+    if timings.enabled:
+        timings_name = '%s.check.timing.%s' % (filename, timing_format.value)
+        try:
+            timings.write(timings_name)
+            print '\nStage timings (written to %s):\n%s' % (
+                timings_name, timings.summary())
+        except IOError as E:
+            print '\n\nWARNING. Error writing stage timings:', E
+
 if __name__ == '__main__':
     main()
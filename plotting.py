@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Element time series plots for the catalog GUI
+#
+# Years of elements of a satellite are many more points than the axes have
+# pixel columns, so only the minimum and the maximum value of every column
+# are drawn, which looks the same as drawing all of them. The visible range
+# is decimated again whenever the view is zoomed or panned. The points are
+# an animated artist blitted onto the axes after each figure draw, and the
+# whole rendered figure is kept for every recently shown satellite/element,
+# so switching back to one of them does not redraw the figure.
+
+import collections
+
+import numpy as np
+
+
+def minmax_decimate(x, y, x0, x1, bins):
+    '''
+    :param x: sorted array
+    :param y: array of the same length
+    :param x0, x1: visible range of x
+    :param bins: number of bins, normally the axes width in pixels
+    :return: x, y of the points to draw - all points within [x0, x1] if they
+        are few, otherwise the minimum and the maximum of each non-empty bin
+        at the bin center
+    '''
+    lo = np.searchsorted(x, x0, 'left')
+    hi = np.searchsorted(x, x1, 'right')
+    x, y = x[lo:hi], y[lo:hi]
+    if len(x) <= 2*bins:
+        return x, y
+    edges = np.linspace(x0, x1, bins + 1)
+    starts = np.searchsorted(x, edges[:-1])
+    nonempty = np.diff(np.append(starts, len(x))) > 0
+    starts = starts[nonempty]
+    centers = (0.5*(edges[:-1] + edges[1:]))[nonempty]
+    return (np.repeat(centers, 2),
+            np.column_stack((np.minimum.reduceat(y, starts),
+                             np.maximum.reduceat(y, starts))).ravel())
+
+
+class _Entry(object):
+    __slots__ = ('x', 'y', 'limits', 'images')
+
+    def __init__(self, x, y):
+        order = np.argsort(x, kind='mergesort')
+        self.x = np.ascontiguousarray(x[order])
+        self.y = np.ascontiguousarray(y[order])
+        self.limits = _limits(self.x, self.y)
+        self.images = {}  # rendered figure by canvas size
+
+
+def _limits(x, y):
+    if not len(x):
+        return (0.0, 1.0), (0.0, 1.0)
+    limits = []
+    for v in (x, y):
+        v0, v1 = float(v.min()), float(v.max())
+        margin = 0.05*(v1 - v0) or 0.5*abs(v0) or 1.0
+        limits.append((v0 - margin, v1 + margin))
+    return tuple(limits)
+
+
+class ElementPlot(object):
+    """Element versus epoch plot on a matplotlib Axes"""
+    def __init__(self, axes, max_cached=32):
+        '''
+        :param axes: matplotlib Axes, used by this plot only
+        :param max_cached: number of satellite/element series to keep
+        '''
+        self.axes = axes
+        self.figure = axes.figure
+        self.canvas = axes.figure.canvas
+        self.max_cached = max_cached
+        self.cache = collections.OrderedDict()
+        self.entry = None
+        self.points, = axes.plot([], [], '.', markersize=3, animated=True)
+        axes.set_xlabel('MJD')
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        axes.callbacks.connect('xlim_changed', self._on_xlim)
+
+    def cached(self, key):
+        return key in self.cache
+
+    def forget(self, sat_id):
+        '''
+        Drop cached series of the satellite, e.g. after adding elements
+        '''
+        for key in [key for key in self.cache if key[0] == sat_id]:
+            del self.cache[key]
+
+    def show(self, key, data=None):
+        '''
+        :param key: (sat_id, element name)
+        :param data: (epoch, value) arrays, None to take them from the cache
+        '''
+        if data is None:
+            entry = self.cache.pop(key)
+        else:
+            entry = _Entry(*data)
+            self.cache.pop(key, None)
+        self.cache[key] = entry
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+
+        self.entry = None  # no decimation until the limits are set
+        self.axes.set_title('%s: %s' % key)
+        self.axes.set_ylim(entry.limits[1])
+        self.axes.set_xlim(entry.limits[0])
+        self.entry = entry
+        self._decimate()
+        image = entry.images.get(self.canvas.get_width_height())
+        if image is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(image)
+            self.canvas.blit(self.figure.bbox)
+
+    def _decimate(self):
+        entry = self.entry
+        x0, x1 = self.axes.get_xlim()
+        self.points.set_data(*minmax_decimate(
+            entry.x, entry.y, x0, x1, max(1, int(self.axes.bbox.width))))
+
+    def _on_xlim(self, axes):
+        if self.entry is not None:
+            self._decimate()
+
+    def _on_draw(self, event):
+        self.axes.draw_artist(self.points)
+        self.canvas.blit(self.axes.bbox)
+        entry = self.entry
+        if entry is not None and (self.axes.get_xlim(), self.axes.get_ylim()
+                                  ) == entry.limits:
+            entry.images[self.canvas.get_width_height()] = \
+                self.canvas.copy_from_bbox(self.figure.bbox)
+
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Two-body ephemerides of many objects at many epochs
+#
+# Elements are rows of (a, e, i, W, w, M), the columns of the elements
+# database, with their epochs; the mean anomaly advances at the Keplerian
+# mean motion and Kepler's equation is solved for all objects and epochs at
+# once. Positions are in the frame of the elements (TOD for orbit_dump and
+# iod); directions from a station are corrected for light time. See
+# astrodyn for the limitations of the model.
+
+import numpy as np
+
+import astrodyn
+
+EPHEMERIS_DTYPE = np.dtype([
+    ('r', 'f8', 3),                        # position, km
+    ('RA', 'f8'),                          # hours
+    ('DEC', 'f8'),                         # degrees
+    ('range', 'f8'),                       # km; from the geocenter if no site
+    ('Lon', 'f8')])                        # sub-satellite longitude, deg
+
+# Element columns of the elements database, in the order used here
+ELEMENT_COLUMNS = ('a', 'e', 'i', 'W', 'we', 'M')
+
+
+def _orbit_axes(i, W, w):
+    # Unit vectors to the perigee and 90 deg ahead of it in the orbit plane
+    i, W, w = np.deg2rad(i), np.deg2rad(W), np.deg2rad(w)
+    cW, sW, cw, sw, ci, si = (np.cos(W), np.sin(W), np.cos(w), np.sin(w),
+                              np.cos(i), np.sin(i))
+    P = np.stack([cW*cw - sW*sw*ci, sW*cw + cW*sw*ci, sw*si], -1)
+    Q = np.stack([-cW*sw - sW*cw*ci, -sW*sw + cW*cw*ci, cw*si], -1)
+    return P, Q
+
+
+def states(elements, epoch, mjd):
+    '''
+    :param elements: (N,6) array of a (km), e, i, W, w, M (degrees)
+    :param epoch: (N) MJD of the elements
+    :param mjd: (M) or (N,M) epochs of the ephemeris
+    :return: r, v - (N,M,3) positions and velocities, km and km/s
+    '''
+    elements = np.atleast_2d(np.asarray(elements, float))
+    a, e, i, W, w, M0 = elements.T
+    mjd = np.asarray(mjd, float)
+    dt = (mjd - np.asarray(epoch, float)[:, None])*astrodyn.day
+    n = np.sqrt(astrodyn.mu/a**3)
+    M = np.deg2rad(M0)[:, None] + n[:, None]*dt
+    e = e[:, None]
+    E = astrodyn.kepler(M, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    P, Q = _orbit_axes(i, W, w)
+    P, Q = P[:, None], Q[:, None]
+    b = (a*np.sqrt(1 - elements[:, 1]**2))[:, None]
+    a = a[:, None]
+    x, y = a*(cos_E - e), b*sin_E
+    # dE/dt = n a/r
+    k = (n[:, None]*a)/(1 - e*cos_E)
+    vx, vy = -k*sin_E, k*(b/a)*cos_E
+    return (x[..., None]*P + y[..., None]*Q,
+            vx[..., None]*P + vy[..., None]*Q)
+
+
+def ephemeris(elements, epoch, mjd, site=None):
+    '''
+    Positions, directions and sub-satellite longitudes of objects
+    :param elements: (N,6) array of a (km), e, i, W, w, M (degrees), e.g.
+        the ELEMENT_COLUMNS of the elements database
+    :param epoch: (N) MJD of the elements
+    :param mjd: (M) epochs of the ephemeris
+    :param site: station (latitude, longitude, altitude), degrees and km;
+        None for geocentric directions
+    :return: (N,M) array of EPHEMERIS_DTYPE; positions are geometric, at
+        the epochs themselves
+    '''
+    elements = np.atleast_2d(np.asarray(elements, float))
+    mjd = np.atleast_1d(np.asarray(mjd, float))
+    r, v = states(elements, epoch, mjd)
+    out = np.empty(r.shape[:2], EPHEMERIS_DTYPE)
+    out['r'] = r
+    out['Lon'] = astrodyn.sublon(r, mjd)
+    if site is None:
+        rho = r
+    else:
+        obs = astrodyn.site_state(site[0], site[1], site[2], mjd)[0]
+        rho = r - obs
+        # Position at the time the light left the object, to first order
+        # in the light time (1e-6 km for GEO)
+        tau = np.sqrt(np.einsum('...i,...i', rho, rho))/astrodyn.c_light
+        rho -= v*tau[..., None]
+    dist = np.sqrt(np.einsum('...i,...i', rho, rho))
+    out['range'] = dist
+    out['RA'] = np.rad2deg(np.arctan2(rho[..., 1], rho[..., 0])) % 360/15
+    out['DEC'] = np.rad2deg(np.arcsin(rho[..., 2]/dist))
+    return out
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Range queries over the catalog databases
+#
+# The functions read rows with fetchmany() in chunks straight into NumPy
+# structured arrays, without building a list of all rows first. Their
+# connection argument may be a catdb.connect() connection to the database
+# holding the table or a dbpool read connection, which has both.
+#
+# Time ranges use the (sat_id, epoch) and (epoch) indexes of catdb, so a
+# query reads the rows it returns rather than the whole table. Longitude
+# bands are selected from the latest elements of every object, found with
+# the epoch index, and propagated to the requested epoch.
+
+import numpy as np
+
+import catdb
+import propagate
+
+# Rows read by one fetchmany() call
+chunk_rows = 10000
+
+OBSERVATION_DTYPE = np.dtype([
+    ('epoch', 'f8'),                       # MJD (UTC)
+    ('station', 'i4'),
+    ('series_id', 'i8'),
+    ('RA', 'f8'),                          # hours
+    ('DEC', 'f8'),                         # degrees
+    ('m', 'f8')])                          # magnitude; NaN if unknown
+
+BAND_DTYPE = np.dtype([
+    ('sat_id', 'i8'),
+    ('station', 'i4'),
+    ('series_id', 'i8'),
+    ('epoch', 'f8'),                       # MJD of the elements
+    ('a', 'f8'), ('e', 'f8'), ('i', 'f8'), ('W', 'f8'), ('w', 'f8'),
+    ('M', 'f8'),
+    ('Lon', 'f8')])                        # at the requested epoch
+
+# Largest age of the elements used by objects_in_longitude_band(), days
+max_age = 30.0
+
+
+def fetch_array(cursor, dtype, size=None):
+    '''
+    :param cursor: executed cursor with one column per field of dtype;
+        NULL values become NaN in float fields
+    :param size: rows per fetchmany() call, chunk_rows by default
+    :return: array of dtype with all remaining rows
+    '''
+    size = size or chunk_rows
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype))
+    if not chunks:
+        return np.empty(0, dtype)
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+def _time_range(t0, t1):
+    # SQL condition and parameters of t0 <= epoch <= t1; None is unbounded
+    conditions, args = [], []
+    if t0 is not None:
+        conditions.append('epoch >= ?')
+        args.append(t0)
+    if t1 is not None:
+        conditions.append('epoch <= ?')
+        args.append(t1)
+    return ''.join(' AND ' + c for c in conditions), args
+
+
+def observations(conn, sat_id, t0=None, t1=None):
+    '''
+    :param conn: connection to the measurements database
+    :param sat_id: satellite ID
+    :param t0, t1: MJD range, inclusive; None for no limit
+    :return: array of OBSERVATION_DTYPE sorted by epoch
+    '''
+    where, args = _time_range(t0, t1)
+    return fetch_array(conn.execute(
+        """SELECT epoch, station, series_id, RA, DEC, m FROM observations
+           WHERE sat_id = ?%s ORDER BY epoch""" % where, [sat_id] + args),
+        OBSERVATION_DTYPE)
+
+
+def elements_history(conn, sat_id, fields=('a', 'e', 'i', 'W', 'w', 'M',
+                                           'Lon'), t0=None, t1=None):
+    '''
+    :param conn: connection to the elements database
+    :param sat_id: satellite ID
+    :param fields: element names, see catdb.element_columns
+    :param t0, t1: MJD range of the elements epochs, inclusive; None for
+        no limit
+    :return: array with float fields "epoch" and the elements, sorted by
+        epoch; NULL elements are NaN
+    '''
+    columns = [catdb.element_columns[name] for name in fields]
+    where, args = _time_range(t0, t1)
+    return fetch_array(conn.execute(
+        """SELECT epoch, %s FROM elements WHERE sat_id = ?%s
+           ORDER BY epoch""" % (', '.join(columns), where), [sat_id] + args),
+        np.dtype([('epoch', 'f8')] + [(name, 'f8') for name in fields]))
+
+
+def latest_elements(conn, epoch, age=None):
+    '''
+    :param conn: connection to the elements database
+    :param epoch: MJD
+    :param age: largest age of the elements, days; max_age by default
+    :return: array of BAND_DTYPE with the last elements of every satellite
+        within age before epoch, sorted by sat_id; Lon is the stored one
+    '''
+    age = max_age if age is None else age
+    # The latest row of every satellite is looked up with the (sat_id,
+    # epoch) index; of rows with the same epoch the first stored one is taken
+    t0, t1 = epoch - age, epoch
+    return fetch_array(conn.execute(
+        """SELECT sat_id, station, series_id, epoch, a, e, i, W, we, M, Lon
+           FROM elements AS latest
+           WHERE epoch BETWEEN ? AND ? AND a IS NOT NULL AND rowid = (
+               SELECT rowid FROM elements
+               WHERE sat_id = latest.sat_id AND epoch BETWEEN ? AND ?
+                   AND a IS NOT NULL
+               ORDER BY epoch DESC, rowid LIMIT 1)
+           ORDER BY sat_id""", (t0, t1, t0, t1)), BAND_DTYPE)
+
+
+def objects_in_longitude_band(conn, lon0, lon1, epoch, age=None):
+    '''
+    Objects with the sub-satellite point in a longitude band
+    :param conn: connection to the elements database
+    :param lon0, lon1: east longitudes of the western and the eastern edge
+        of the band, degrees; the band crosses 0 if lon0 > lon1 (mod 360)
+    :param epoch: MJD
+    :param age: largest age of the elements, days; max_age by default
+    :return: array of BAND_DTYPE sorted by sat_id, with the longitude
+        propagated from the latest elements to epoch
+    '''
+    rows = latest_elements(conn, epoch, age)
+    elements = np.column_stack([rows[name] for name in
+                                ('a', 'e', 'i', 'W', 'w', 'M')])
+    lon = propagate.ephemeris(elements, rows['epoch'], [epoch])['Lon'][:, 0]
+    rows['Lon'] = lon
+    if lon1 - lon0 >= 360:
+        return rows
+    return rows[(lon - lon0) % 360 <= (lon1 - lon0) % 360]
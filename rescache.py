@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Persistent cache of parsed .res and .check files
+#
+# Parsed columnar arrays are saved as .npy files, one subdirectory of the
+# cache directory per entry, and memory-mapped on load. An entry is keyed by
+# the absolute path, size and modification time of its source, so it becomes
+# stale as soon as the source changes. The directory is kept under a size
+# limit by evicting least recently used entries; every hit refreshes the
+# entry's modification time.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import coord
+
+# Bump whenever the layout of the cached arrays changes
+_VERSION = 1
+
+default_dir = os.environ.get(
+    'UZH_CATALOG_CACHE',
+    os.path.join(os.path.expanduser('~'), '.uzh_catalog', 'cache'))
+default_max_bytes = 1 << 30
+
+
+def _remove(entry):
+    '''
+    Remove a cache entry directory
+    :return: True if it is gone
+    '''
+    shutil.rmtree(entry, True)
+    if os.path.exists(entry):
+        print 'Cannot remove parse cache entry (still in use?):', entry
+        return False
+    return True
+
+
+class ParseCache(object):
+    """On-disk cache of read_res_arrays/read_check_arrays results"""
+    def __init__(self, dirname=None, max_bytes=default_max_bytes):
+        self.dirname = dirname or default_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, kind):
+        '''
+        :return: cache entry name for the current state of the file
+        '''
+        st = os.stat(path)
+        h = hashlib.sha1('%d\0%s\0%s\0%d\0%r' % (
+            _VERSION, kind, os.path.abspath(path), st.st_size, st.st_mtime))
+        return h.hexdigest()
+
+    def _get(self, path, kind, parse, names):
+        entry = os.path.join(self.dirname, self.key(path, kind))
+        try:
+            arrays = dict((name, np.load(os.path.join(entry, name + '.npy'),
+                                         mmap_mode='r'))
+                          for name in names)
+            os.utime(entry, None)
+            self.hits += 1
+            return arrays
+        except (IOError, OSError, ValueError):
+            pass
+
+        self.misses += 1
+        arrays = parse(path)
+        try:
+            if not os.path.isdir(self.dirname):
+                os.makedirs(self.dirname)
+            # Write to a temporary directory first so that concurrent readers
+            # never see a partial entry
+            tmp = tempfile.mkdtemp(suffix='.tmp', dir=self.dirname)
+            for name in names:
+                np.save(os.path.join(tmp, name + '.npy'), arrays[name])
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # Another process has just stored the same entry
+                _remove(tmp)
+            self.evict()
+        except (IOError, OSError) as E:
+            print 'Cannot write parse cache entry:', E
+        return arrays
+
+    def load_res(self, path):
+        '''
+        :param path: .res file name
+        :return: (meas, series) - see coord.read_res_arrays()
+        '''
+        arrays = self._get(path, 'res', lambda path: dict(zip(
+            ('meas', 'series'), coord.read_res_arrays(path))),
+            ('meas', 'series'))
+        return arrays['meas'], arrays['series']
+
+    def load_check(self, path):
+        '''
+        :param path: .check file name
+        :return: coord.CheckTables instance
+        '''
+        arrays = self._get(path, 'check',
+                           lambda path: coord.read_check_arrays(path).__dict__,
+                           ('series', 'residuals', 'iod', 'matched',
+                            'match_ids'))
+        return coord.CheckTables(**arrays)
+
+    def size(self):
+        '''
+        :return: total size of cache entries, bytes
+        '''
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        '''
+        :return: list of (last use time, size, directory) of all entries
+        '''
+        try:
+            names = os.listdir(self.dirname)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            entry = os.path.join(self.dirname, name)
+            if name.endswith('.tmp') or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((os.stat(entry).st_mtime, sum(
+                    os.path.getsize(os.path.join(entry, fn))
+                    for fn in os.listdir(entry)), entry))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the cache fits max_bytes
+        '''
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            # Entries still in use cannot be removed on Windows; the next
+            # ones are evicted instead
+            if _remove(entry):
+                total -= size
+
+    def clear(self):
+        for _, _, entry in self._entries():
+            _remove(entry)
+
+    def stats(self):
+        return 'parse cache: %d hit(s), %d miss(es)' % (self.hits, self.misses)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# External residuals of GEO measurements
+#
+# Tangential and normal residuals of measured directions with respect to the
+# topocentric state of the matching catalog object, as printed to .check
+# files by orbit_dump.main(). The tangential axis is along the projection of
+# the object velocity onto the plane perpendicular to the line of sight, the
+# normal axis completes the right-handed frame. ext_residuals() handles a
+# whole series at once; ext_residual() is the per-point reference.
+
+import numpy as np
+
+# Arcseconds per radian
+krad = 180/np.pi*3600
+
+
+def directions(ra, dec):
+    '''
+    :param ra: right ascension, hours
+    :param dec: declination, degrees
+    :return: (N,3) array of unit vectors
+    '''
+    ra = np.deg2rad(np.asarray(ra, float)*15)
+    dec = np.deg2rad(np.asarray(dec, float))
+    return np.column_stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra),
+                            np.sin(dec)))
+
+
+def ext_residuals(ra, dec, pv):
+    '''
+    :param ra: measured right ascensions, hours
+    :param dec: measured declinations, degrees
+    :param pv: (N,6) array of topocentric positions and velocities of the
+        matching objects, in the same frame as ra and dec
+    :return: dtan, dnorm - arrays of tangential and normal residuals, arcsec
+    '''
+    pv = np.asarray(pv, float).reshape(-1, 6)
+    e1 = pv[:, :3]/np.sqrt((pv[:, :3]**2).sum(1))[:, None]
+    v = pv[:, 3:]
+    e2 = v - (v*e1).sum(1)[:, None]*e1
+    e2 /= np.sqrt((e2**2).sum(1))[:, None]
+    e3 = np.cross(e1, e2)
+    I = directions(ra, dec)
+    return (I*e2).sum(1)*krad, (I*e3).sum(1)*krad
+
+
+def ext_residual(ra, dec, pv):
+    '''
+    Reference implementation of ext_residuals() for a single measurement,
+    following the original per-point code of orbit_dump.main()
+    :return: dtan, dnorm
+    '''
+    pv = np.array(pv, float)
+    e1 = pv[:3]
+    e1 /= np.sqrt((e1**2).sum())
+    e2 = pv[3:] - np.dot(pv[3:], e1)*e1
+    e2 /= np.sqrt((e2**2).sum())
+    e3 = np.cross(e1, e2)
+    ra, dec = np.deg2rad(ra*15.0), np.deg2rad(dec)
+    I = [np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)]
+    return np.dot(I, e2)*krad, np.dot(I, e3)*krad
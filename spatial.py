@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Spatial index for matching measurements by RA and Dec
+#
+# Positions are indexed as unit vectors, so that an angular radius becomes a
+# Euclidean (chord) distance and there are no problems at RA = 0h/24h or at
+# the poles. scipy.spatial.cKDTree is used if scipy is installed; otherwise
+# the vectors are hashed into a 3D grid with the cell size of twice the
+# query radius, so that every query needs to look into 8 cells only: its
+# own one and those across the nearest faces.
+#
+# match_observations() uses the index to identify measurements with those
+# stored in the catalog database, so that identification can be done
+# offline. orbit_dump keeps identifying with Apex's match_objects(): the
+# catalog objects it returns carry the catalog and the propagator used for
+# their ephemerides, which the later residuals and elements rely on, and
+# Apex gives no positions of all catalog objects to index here.
+
+import numpy as np
+
+from residuals import directions
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+def chord(radius):
+    '''
+    :param radius: angular distance, arcsec
+    :return: distance between the unit vectors
+    '''
+    return 2*np.sin(np.deg2rad(radius/3600.0)/2)
+
+
+def separation(d):
+    '''
+    :param d: distance between unit vectors
+    :return: angular distance, arcsec
+    '''
+    return np.rad2deg(2*np.arcsin(np.clip(d/2, 0, 1)))*3600
+
+
+class _Grid(object):
+    """Unit vectors hashed into cubic cells for queries within radius r"""
+    def __init__(self, xyz, r):
+        # Cell indices are then within +-2**19, see keys()
+        self.size = max(2*r, 2.0**-18)
+        keys = self.keys(np.floor(xyz/self.size).astype(np.int64))
+        self.order = np.argsort(keys, kind='mergesort')
+        self.keys_sorted = keys[self.order]
+
+    @staticmethod
+    def keys(cells):
+        # 21 bits per coordinate
+        cells = cells + (1 << 20)
+        return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+    def pairs(self, xyz, xyz_index, r):
+        '''
+        :return: (query, index) row numbers of all pairs closer than r
+        '''
+        # Sorting queries by cell makes the lookups below cache friendly
+        pos = xyz/self.size
+        cells = np.floor(pos).astype(np.int64)
+        by_cell = np.argsort(self.keys(cells), kind='mergesort')
+        xyz, pos, cells = xyz[by_cell], pos[by_cell], cells[by_cell]
+        step = np.where(pos - cells < 0.5, -1, 1)
+        queries, rows = [], []
+        for offset in np.ndindex(2, 2, 2):
+            keys = self.keys(cells + step*np.array(offset))
+            lo = np.searchsorted(self.keys_sorted, keys, 'left')
+            hi = np.searchsorted(self.keys_sorted, keys, 'right')
+            counts = hi - lo
+            if not counts.any():
+                continue
+            q = np.repeat(np.arange(len(xyz)), counts)
+            # Position of every pair within its query's [lo, hi) range
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            k = self.order[np.repeat(lo, counts) + np.arange(len(q)) - first]
+            close = ((xyz[q] - xyz_index[k])**2).sum(1) <= r*r
+            queries.append(q[close])
+            rows.append(k[close])
+        if not queries:
+            return np.zeros(0, int), np.zeros(0, int)
+        q, k = by_cell[np.concatenate(queries)], np.concatenate(rows)
+        order = np.lexsort((k, q))
+        return q[order], k[order]
+
+
+class SkyIndex(object):
+    """Radius and nearest neighbour queries on a set of sky positions"""
+    def __init__(self, ra, dec, use_scipy=True):
+        '''
+        :param ra: right ascensions, hours
+        :param dec: declinations, degrees
+        :param use_scipy: use cKDTree if scipy is available
+        '''
+        self.xyz = directions(ra, dec)
+        # cKDTree cannot be built on no points
+        self.tree = cKDTree(self.xyz) \
+            if use_scipy and cKDTree is not None and len(self.xyz) else None
+        self._grids = {}
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def _grid(self, r):
+        try:
+            return self._grids[r]
+        except KeyError:
+            grid = self._grids[r] = _Grid(self.xyz, r)
+            return grid
+
+    def query_radius(self, ra, dec, radius):
+        '''
+        :param ra, dec: query positions, hours and degrees
+        :param radius: search radius, arcsec
+        :return: query, index - arrays of row numbers of all pairs of a query
+            position and an indexed position within the radius, sorted by
+            query
+        '''
+        xyz = directions(ra, dec)
+        r = chord(radius)
+        if not len(xyz) or not len(self.xyz):
+            return np.zeros(0, int), np.zeros(0, int)
+        if self.tree is None:
+            return self._grid(r).pairs(xyz, self.xyz, r)
+        found = self.tree.query_ball_point(xyz, r)
+        counts = np.array([len(rows) for rows in found], int)
+        k = np.array([row for rows in found for row in sorted(rows)], int)
+        return np.repeat(np.arange(len(xyz)), counts), k
+
+    def nearest(self, ra, dec, radius):
+        '''
+        :param ra, dec: query positions, hours and degrees
+        :param radius: search radius, arcsec
+        :return: index, sep - row number of the nearest indexed position for
+            each query (-1 if there is none within the radius) and the
+            separation, arcsec (NaN if there is no match)
+        '''
+        xyz = directions(ra, dec)
+        r = chord(radius)
+        index = np.full(len(xyz), -1, int)
+        sep = np.full(len(xyz), np.nan)
+        if not len(xyz) or not len(self.xyz):
+            return index, sep
+        if self.tree is not None:
+            d, k = self.tree.query(xyz, 1, distance_upper_bound=r)
+            found = k < len(self.xyz)
+            index[found] = k[found]
+            sep[found] = separation(d[found])
+            return index, sep
+        q, k = self._grid(r).pairs(xyz, self.xyz, r)
+        d = np.sqrt(((xyz[q] - self.xyz[k])**2).sum(1))
+        # The first pair of each query after sorting by distance
+        order = np.lexsort((d, q))
+        q, k, d = q[order], k[order], d[order]
+        first = np.ones(len(q), bool)
+        first[1:] = q[1:] != q[:-1]
+        index[q[first]] = k[first]
+        sep[q[first]] = separation(d[first])
+        return index, sep
+
+
+def match_observations(res_conn, ra, dec, epoch, radius=60.0,
+                       tolerance=1.0/86400):
+    '''
+    Identify measurements with those stored in the catalog database
+    :param res_conn: connection to the measurements database (catdb)
+    :param ra, dec: measured positions, hours and degrees
+    :param epoch: MJD (UTC) of the measurements
+    :param radius: match radius, arcsec
+    :param tolerance: maximum difference of epochs, days
+    :return: sat_id, sep - lists of the satellite ID of the nearest stored
+        observation within the radius and tolerance (None if there is no
+        match) and the separation, arcsec (NaN if there is no match)
+    '''
+    ra, dec, epoch = [np.atleast_1d(np.asarray(x, float))
+                      for x in (ra, dec, epoch)]
+    sat_id = [None]*len(epoch)
+    sep = np.full(len(epoch), np.nan)
+    if not len(epoch):
+        return sat_id, sep
+    rows = res_conn.execute(
+        """SELECT sat_id, epoch, RA, DEC FROM observations
+           WHERE epoch BETWEEN ? AND ? ORDER BY epoch""",
+        (float(epoch.min()) - tolerance,
+         float(epoch.max()) + tolerance)).fetchall()
+    if not rows:
+        return sat_id, sep
+    stored_id, stored = zip(*[(row[0], row[1:]) for row in rows])
+    stored = np.array(stored, float)
+
+    # One index per distinct epoch of the measurements
+    epochs, inverse = np.unique(epoch, return_inverse=True)
+    by_epoch = np.argsort(inverse, kind='mergesort')
+    bounds = np.searchsorted(inverse[by_epoch], np.arange(len(epochs) + 1))
+    lo = np.searchsorted(stored[:, 0], epochs - tolerance, 'left')
+    hi = np.searchsorted(stored[:, 0], epochs + tolerance, 'right')
+    for n in xrange(len(epochs)):
+        if lo[n] == hi[n]:
+            continue
+        queries = by_epoch[bounds[n]:bounds[n + 1]]
+        index = SkyIndex(stored[lo[n]:hi[n], 1], stored[lo[n]:hi[n], 2])
+        k, d = index.nearest(ra[queries], dec[queries], radius)
+        for i, row, s in zip(queries, k, d):
+            if row >= 0:
+                sat_id[i] = stored_id[lo[n] + row]
+                sep[i] = s
+    return sat_id, sep
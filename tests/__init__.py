@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+# Unit tests of the Uzhgorod geo catalog modules
+#
+# Usage, from the repository root:
+#   python -m unittest discover
+#
+# Tests needing Apex, wx or scipy replace them with stubs or are skipped.
+
+import os
+
+data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sample_res = os.path.join(data_dir, '20140512_10092.res')
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Stub of the Apex modules imported by orbit_dump
+#
+# install() puts minimal apex.* modules into sys.modules, so that orbit_dump
+# can be imported and run without Apex. The "catalog" holds circular
+# equatorial GEO orbits of objects by ID, stationary at their sub-satellite
+# longitudes; the station rotates with a simple sidereal time, and TOD
+# coordinates are the J2000 ones.
+
+import sys
+import types
+from datetime import datetime, timedelta
+
+import numpy as np
+
+km_per_AU = 149597870.7
+mu = 398600.4418
+r_geo = 42164.17
+# Earth rotation rate, rad/s
+omega = 7.2921159e-5
+
+# Sub-satellite longitudes of catalog objects by ID, degrees
+objects = {}
+
+
+class Option(object):
+    def __init__(self, name, default, *args, **kwargs):
+        self.name, self.value = name, default
+
+
+class Orbit(object):
+    # Elements of a fitted or a catalog orbit
+    def __init__(self, epoch, a, ecc=1e-4, incl=0.05, raan=80.0, argp=10.0,
+                 anmean=20.0):
+        self.epoch, self.epoch_mjd = epoch, cal_to_mjd(epoch)
+        self.a, self.ecc, self.incl, self.raan, self.argp, self.anmean = \
+            a, ecc, incl, raan, argp, anmean
+        self.p = a*(1 - ecc**2)
+
+
+class CatalogObject(object):
+    def __init__(self, id, epoch):
+        self.id = id
+        self.sublon = objects[id]
+        angle = np.deg2rad(utc_to_lst(epoch)*15 + self.sublon)
+        self.p = r_geo*np.array([np.cos(angle), np.sin(angle), 0.0])
+        self.v = r_geo*omega*np.array([-np.sin(angle), np.cos(angle), 0.0])
+
+
+class Match(object):
+    def __init__(self, id, catid='stub'):
+        self.id, self.catid = id, catid
+
+
+class Measurement(object):
+    def __init__(self, ra, dec, mag):
+        self.ra, self.dec, self.mag = ra, dec, mag
+
+
+def cal_to_mjd(t):
+    return (t - datetime(1858, 11, 17)).total_seconds()/86400
+
+
+def utc_to_lst(t, lon=0.0, apparent=True):
+    if isinstance(t, datetime):
+        t = cal_to_mjd(t)
+    return (18.697374558 + 24.06570982441908*(t - 51544.5) + lon) % 24
+
+
+def eqeqx(mjd):
+    return 0.0
+
+
+def prenut(ra, dec, equinox, mjd, *args):
+    return ra, dec
+
+
+def obs_eci(lat, alt, lst):
+    # Station position and velocity, m and m/s; (3,) or (3, n) for n sidereal
+    # times
+    lat, theta = np.deg2rad(lat), np.deg2rad(np.asarray(lst)*15)
+    p = (6378137.0 + alt*1000)*np.array(np.broadcast_arrays(
+        np.cos(lat)*np.cos(theta), np.cos(lat)*np.sin(theta), np.sin(lat)))
+    return p, omega*np.array([-p[1], p[0], np.zeros_like(p[2])])
+
+
+def apply_topo(pv, pv0):
+    pv -= pv0
+
+
+def observe(id, epoch, site, dra=0.0, ddec=0.0, mag=12.0):
+    '''
+    Measurement of a catalog object
+    :param dra, ddec: offsets from the true direction, arcsec
+    '''
+    obj = CatalogObject(id, epoch)
+    p0 = obs_eci(site[0], site[2], utc_to_lst(epoch, site[1]/15))[0]*1e-3
+    d = obj.p - p0
+    ra = np.rad2deg(np.arctan2(d[1], d[0])) % 360/15
+    dec = np.rad2deg(np.arcsin(d[2]/np.sqrt((d**2).sum())))
+    return Measurement(ra + dra/54000.0, dec + ddec/3600.0, mag)
+
+
+def query_id(ids, catid, epoch, silent=False):
+    if not isinstance(ids, (list, tuple)):
+        ids = [ids]
+    return [CatalogObject(id, epoch) for id in ids if id in objects]
+
+
+def fit_orbit(ra, dec, mjds, site):
+    n = len(mjds)
+    epoch = datetime(1858, 11, 17) + timedelta(days=float(np.mean(mjds)))
+    return (Orbit(epoch, r_geo), [0.1]*n, [-0.1]*n, 0.2, 0.3, [], [])
+
+
+def state_to_elem(p, v):
+    r, v2 = np.sqrt((p**2).sum()), (v**2).sum()
+    return Orbit(datetime(2000, 1, 1), 1/(2/r - v2/mu))
+
+
+class GEO_Catalog(object):
+    pass
+
+
+class _Plugins(object):
+    def __init__(self):
+        self.plugins = {}
+
+
+def _stub(*args, **kwargs):
+    raise NotImplementedError('not available in the Apex stub')
+
+
+def install():
+    '''
+    Register the stub modules in place of Apex, installed or not
+    :return: the apex stub module
+    '''
+    contents = {
+        'apex': {},
+        'apex.conf': {'Option': Option},
+        'apex.sitedef': {
+            'km_per_AU': km_per_AU, 'obs_eci': obs_eci,
+            'apply_topo': apply_topo, 'latitude': Option('latitude', 48.6),
+            'longitude': Option('longitude', 22.3),
+            'altitude': Option('altitude', 0.2)},
+        'apex.timescale': {'cal_to_mjd': cal_to_mjd,
+                           'utc_to_lst': utc_to_lst, 'eqeqx': eqeqx},
+        'apex.astrometry': {},
+        'apex.astrometry.precession': {'prenut': prenut},
+        'apex.io': {'imheader': _stub},
+        'apex.catalog': {
+            'catalogs': _Plugins(), 'query_id': query_id,
+            'suitable_catalogs': lambda purpose: ['stub'],
+            'match_objects': lambda objs, cats, epoch: [
+                getattr(obj, 'match', None) for obj in objs]},
+        'apex.extra': {},
+        'apex.extra.GEO': {},
+        'apex.extra.GEO.report': {'geo_report_formats': _Plugins()},
+        'apex.extra.GEO.geo_catalog': {
+            'GEO_Catalog': GEO_Catalog,
+            'ephem_propagator': Option('ephem_propagator', 'stub')},
+        'apex.extra.GEO.satellite_orbit': {
+            'state_to_elem': state_to_elem, 'fit_orbit': fit_orbit,
+            'FitSatellite': _stub},
+        'apex.extra.GEO.astrodynamics': {'ecc_from_mean': lambda e, M: M,
+                                         'mu': mu},
+        'apex.extra.GEO.propagation': {
+            'compute_ephemeris': _stub, 'ephem_helper': _stub,
+            'orbit_propagators': _Plugins()},
+    }
+    for name in sorted(contents):
+        module = types.ModuleType(name)
+        module.__dict__.update(contents[name])
+        sys.modules[name] = module
+        if '.' in name:
+            parent, child = name.rsplit('.', 1)
+            setattr(sys.modules[parent], child, module)
+    sys.modules['apex.catalog'].catalogs.plugins['stub'] = GEO_Catalog()
+    return sys.modules['apex']
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import catdb
+import coord
+from tests import data_dir, sample_res
+
+
+def legacy_db(res_name, el_name, meas, series):
+    # Per-satellite tables as the GUI wrote them before catdb
+    res_c, el_c = sqlite3.connect(res_name), sqlite3.connect(el_name)
+    for st_id, ser_id, start, stop in series.tolist():
+        res_c.execute("""CREATE TABLE if not exists '%s' (satid INTEGER, date INTEGER, time FLOAT UNIQUE, RA FLOAT, DEC FLOAT, m FLOAT)""" % ser_id)
+        el_c.execute("""CREATE TABLE if not exists '%s' (satid INTEGER, date INTEGER, time1 FLOAT UNIQUE, time2 FLOAT, a FLOAT, e FLOAT, i FLOAT, W FLOAT, we FLOAT, M FLOAT, Lon FLOAT)""" % ser_id)
+        coo = meas[start:stop].tolist()
+        for date, time, RA, DEC, m in coo:
+            res_c.execute("""insert or ignore into '%s' values (%s,%i,%f,%f,%f,%f)"""
+                          % (ser_id, ser_id, date, time, RA, DEC, m))
+        el_c.execute("""insert or ignore into '%s' values (%s,%i,%f,%f,%f,%f,%f,%f,%f,%f,%f)"""
+                     % (ser_id, ser_id, coo[0][0], coo[0][1], coo[-1][1],
+                        42164.0, 0, 0, 0, 0, 0, 0))
+    res_c.commit()
+    el_c.commit()
+    return res_c, el_c
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.res_name = os.path.join(self.dirname, 'res.db')
+        self.el_name = os.path.join(self.dirname, 'el.db')
+        self.meas, self.series = coord.read_res_arrays(sample_res)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def count(self, conn):
+        return conn.execute(
+            """SELECT COUNT(*) FROM observations""").fetchone()[0]
+
+    def test_reingest_after_migration(self):
+        check, check_match = coord.check_elements(
+            coord.read_check_arrays(sample_res + '.check'))
+        for station in (0, 10092):
+            res_c, el_c = legacy_db(self.res_name, self.el_name, self.meas,
+                                    self.series)
+            # The station may differ from that of the file, and elements are
+            # keyed by another epoch than the osculating one
+            nsat, nobs, nel = catdb.migrate(res_c, el_c, station, drop=True)
+            self.assertEqual(nobs, len(self.meas))
+            self.assertEqual(nel, len(self.series))
+            with catdb.BulkWriter(res_c, el_c) as writer:
+                writer.add_arrays(self.meas, self.series, check, check_match)
+            self.assertEqual(self.count(res_c), len(self.meas))
+            self.assertEqual(el_c.execute(
+                """SELECT COUNT(*) FROM elements""").fetchone()[0], nel)
+            res_c.close()
+            el_c.close()
+            os.remove(self.res_name)
+            os.remove(self.el_name)
+        res_c, el_c = legacy_db(self.res_name, self.el_name, self.meas,
+                                self.series)
+        catdb.migrate(res_c, el_c, station=0, drop=True)
+
+        # Migrated values are those of the .res file
+        stored = res_c.execute(
+            """SELECT sat_id, epoch, date, time, RA, DEC, m FROM observations
+               ORDER BY sat_id, epoch""").fetchall()
+        rows = np.repeat(np.arange(len(self.series)),
+                         self.series['stop'] - self.series['start'])
+        epochs = coord.res_mjd(self.meas['date'], self.meas['time'])
+        expected = sorted(zip(self.series['ser_id'][rows].tolist(),
+                              epochs.tolist(), *[self.meas[name].tolist()
+                                                 for name in coord.RES_DTYPE.names]))
+        self.assertEqual(stored, expected)
+
+    def test_round_res(self):
+        rng = np.random.RandomState(0)
+        n = 10000
+        hh, mm, ss = (rng.randint(0, 24, n), rng.randint(0, 60, n),
+                      rng.randint(0, 6000, n))
+        dd = rng.randint(-89, 90, n)
+        time = hh.astype(float) + mm/60.0 + (ss/100.0)/3600
+        frac = mm/60.0 + (ss/100.0)/3600
+        dec = np.where(dd >= 0, dd + frac, dd - frac)
+        m = rng.randint(0, 2000, n)/100.0
+        printed = [np.array([float('%f' % v) for v in x])
+                   for x in (time, time, dec, m)]
+        for value, ref in zip(coord.round_res(*printed),
+                              (time, time, dec, m)):
+            self.assertTrue((value == ref).all())
+
+    def test_command_line(self):
+        res_c, el_c = legacy_db(self.res_name, self.el_name, self.meas,
+                                self.series)
+        res_c.close()
+        el_c.close()
+        out = subprocess.check_output(
+            [sys.executable, os.path.join(data_dir, 'catdb.py'), 'migrate',
+             '--station', '10092', '--drop', '--res-db', self.res_name,
+             '--el-db', self.el_name], cwd=self.dirname)
+        self.assertIn('%d observation(s)' % len(self.meas), out)
+        conn = sqlite3.connect(self.res_name)
+        self.assertEqual(self.count(conn), len(self.meas))
+        self.assertEqual(catdb._legacy_tables(conn), [])
+
+
+class _FailingConnection(object):
+    # Connection whose executemany() fails, e.g. on a full disk
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, *args):
+        raise sqlite3.OperationalError('database or disk is full')
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def expected_elements(meas, series, check, check_match):
+    # Element rows of the series: elements of the same satellite with the
+    # epoch within the series
+    epochs = coord.res_mjd(meas['date'], meas['time'])
+    rows = []
+    for st_id, ser_id, start, stop in series.tolist():
+        t_start, t_stop = epochs[start], epochs[stop - 1]
+        for el, match in zip(check, check_match):
+            if el.sat_ID == str(ser_id) and \
+                    t_start - 1/1440.0 <= el.epoch <= t_stop + 1/1440.0:
+                rows.append((ser_id, st_id, catdb.series_id(t_start),
+                             el.epoch, t_start, t_stop, el.a, el.e, el.i,
+                             el.W, el.w, el.M, el.Lon, match.sat_ID))
+    return sorted(rows)
+
+
+class BulkWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.check, self.check_match = coord.check_elements(
+            coord.read_check_arrays(sample_res + '.check'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def connect(self):
+        return catdb.connect(os.path.join(self.dirname, 'res.db'),
+                             os.path.join(self.dirname, 'el.db'))
+
+    def elements(self, el_conn):
+        return el_conn.execute(
+            """SELECT * FROM elements ORDER BY sat_id, epoch""").fetchall()
+
+    def test_elements(self):
+        meas, series = coord.read_res_arrays(sample_res)
+        res_conn, el_conn = self.connect()
+        with catdb.BulkWriter(res_conn, el_conn, batch_size=100) as writer:
+            writer.add_arrays(meas, series, self.check, self.check_match)
+        expected = expected_elements(meas, series, self.check,
+                                     self.check_match)
+        self.assertEqual(len(expected), 42)
+        self.assertEqual(self.elements(el_conn), expected)
+        # Adding the file again changes nothing
+        with catdb.BulkWriter(res_conn, el_conn) as writer:
+            writer.add_arrays(meas, series, self.check, self.check_match)
+        self.assertEqual(self.elements(el_conn), expected)
+        self.assertEqual(res_conn.execute(
+            """SELECT COUNT(*) FROM pending_elements""").fetchone()[0], 0)
+
+    def test_interrupted_flush(self):
+        # Observations committed before the elements database fails keep
+        # their elements, which the next flush writes
+        meas, series = coord.read_res_arrays(sample_res)
+        res_conn, el_conn = self.connect()
+        writer = catdb.BulkWriter(res_conn, _FailingConnection(el_conn))
+        writer.add_arrays(meas, series, self.check, self.check_match)
+        self.assertRaises(sqlite3.OperationalError, writer.flush)
+        self.assertEqual(res_conn.execute(
+            """SELECT COUNT(*) FROM observations""").fetchone()[0],
+            len(meas))
+        self.assertEqual(self.elements(el_conn), [])
+        res_conn.close()
+        el_conn.close()
+
+        res_conn, el_conn = self.connect()
+        with catdb.BulkWriter(res_conn, el_conn) as writer:
+            writer.add_arrays(meas, series, self.check, self.check_match)
+        self.assertEqual(self.elements(el_conn), expected_elements(
+            meas, series, self.check, self.check_match))
+        self.assertEqual(res_conn.execute(
+            """SELECT COUNT(*) FROM pending_elements""").fetchone()[0], 0)
+
+    def test_round_trip(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            meas, series = coord.read_res_arrays(sample_res)
+            meas['RA'] += np.random.RandomState(0).uniform(0, 1e-9, len(meas))
+            res_conn, el_conn = catdb.connect(
+                os.path.join(dirname, 'res.db'),
+                os.path.join(dirname, 'el.db'))
+            with catdb.BulkWriter(res_conn, el_conn, batch_size=100) as w:
+                w.add_arrays(meas, series)
+            stored = res_conn.execute(
+                """SELECT date, time, RA, DEC, m FROM observations
+                   ORDER BY sat_id, epoch""").fetchall()
+            order = np.argsort(np.repeat(series['ser_id'],
+                                         series['stop'] - series['start']),
+                               kind='mergesort')
+            # Full float64 precision
+            self.assertEqual(stored, meas[order].tolist())
+            # Adding the file again changes nothing
+            with catdb.BulkWriter(res_conn, el_conn) as w:
+                w.add_arrays(meas, series)
+            self.assertEqual(res_conn.execute(
+                """SELECT COUNT(*) FROM observations""").fetchone()[0],
+                len(meas))
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_add_series(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            meas, series = coord.read_res_arrays(sample_res)
+            tables = []
+            for name, add in (
+                    ('arrays', lambda w: w.add_arrays(meas, series)),
+                    ('series', lambda w: [w.add_series(ser) for ser in
+                                          coord.SeriesBlock(meas, series)])):
+                res_conn, el_conn = catdb.connect(
+                    os.path.join(dirname, name + '_res.db'),
+                    os.path.join(dirname, name + '_el.db'))
+                with catdb.BulkWriter(res_conn, el_conn) as writer:
+                    add(writer)
+                tables.append(res_conn.execute(
+                    """SELECT * FROM observations
+                       ORDER BY sat_id, epoch""").fetchall())
+            self.assertEqual(len(tables[0]), len(meas))
+            self.assertEqual(tables[0], tables[1])
+        finally:
+            shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+import checkreport
+import coord
+from tests import sample_res
+
+
+def reference_rows(mjd0, mjd, ra, ha, dec, mag, int_tan, int_norm, ext_tan,
+                   ext_norm, match, tan_flags, norm_flags, frame_names):
+    # Residual rows as orbit_dump.main() printed them before checkreport
+    fnwidth = max([len(fn) if fn else 0 for fn in frame_names] or [0])
+    if fnwidth:
+        fnwidth += 2
+    fmt = lambda d: '%+09.2f' % d if d is not None else ''
+    lines = []
+    for fn, res in zip(frame_names, zip(
+            mjd - mjd0, ra, ha, dec, ['%5.2f' % m if m else '' for m in mag],
+            map(fmt, int_tan), tan_flags, map(fmt, int_norm), norm_flags,
+            map(fmt, ext_tan), map(fmt, ext_norm), match)):
+        lines.append(('%-*s' % (fnwidth, fn) if fnwidth else '') +
+                     '%11.8f  %010.7f  %010.7f  %+010.6f  %5s  %9s%c  %9s%c  '
+                     '%9s  %9s  %s\n' % res)
+    return ''.join(lines)
+
+
+class ResidualTableTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n = self.n = 2000
+        self.mjd0 = 56789
+        blank = lambda x, p: [None if b else v for v, b in
+                              zip(x.tolist(), rng.rand(n) < p)]
+        residual = lambda: blank(np.round(rng.normal(0, 3, n), 3), 0.1)
+        self.columns = [
+            self.mjd0 + rng.uniform(0, 1.2, n), rng.uniform(0, 24, n),
+            rng.uniform(0, 24, n), rng.uniform(-90, 90, n),
+            blank(np.round(rng.uniform(9, 16, n), 3), 0.2),
+            residual(), residual(), residual(), residual(),
+            ['%d/2014-%03dA' % (k, k) if k % 3 else ''
+             for k in rng.randint(0, 30000, n)],
+            rng.choice([' ', '*'], n).tolist(),
+            rng.choice([' ', '*'], n).tolist()]
+        # Rounding ties, negative zero, values too wide for their fields
+        # and magnitudes of 0
+        edge = [(3, 0.125), (4, 0.375), (5, 12.345), (5, 0.0),
+                (6, -0.001), (6, -0.0), (7, 1e6), (8, -123456.789),
+                (3, -12.5), (4, 99.999999995), (5, 123.456)]
+        for i, (k, v) in enumerate(edge):
+            self.columns[k][10*i] = v
+        self.columns[0][5] = self.mjd0 + 10.999999999
+
+    def table(self, frame_names=None):
+        return checkreport.residual_table(
+            self.mjd0, *(self.columns + [(None,)*4, (None,)*4, frame_names]))
+
+    def rows(self, text):
+        # The rows between the header and the totals
+        return ''.join(text.splitlines(True)[4:-1])
+
+    def test_rows(self):
+        self.assertEqual(self.rows(self.table()), reference_rows(
+            self.mjd0, *(self.columns + [[None]*self.n])))
+
+    def test_frame_names(self):
+        names = ['frame%04d.fts' % i if i % 7 else None
+                 for i in xrange(self.n)]
+        self.assertEqual(self.rows(self.table(names)), reference_rows(
+            self.mjd0, *(self.columns + [names])))
+
+    def test_arrays(self):
+        # NaN for blank values gives the same table as None
+        arrays = [checkreport._column(c) for c in self.columns[4:9]]
+        text = checkreport.residual_table(
+            self.mjd0, *(self.columns[:4] + arrays + self.columns[9:] +
+                         [(None,)*4, (None,)*4]))
+        self.assertEqual(text, self.table())
+
+    def test_empty(self):
+        text = checkreport.residual_table(
+            self.mjd0, *([[]]*12 + [(None,)*4, (None,)*4]))
+        self.assertEqual(len(text.splitlines()), 5)
+        self.assertTrue(text.splitlines()[-1].startswith('Median:'))
+
+
+class WriteTablesTest(unittest.TestCase):
+    def test_golden(self):
+        # Rewriting a parsed report gives back the same file
+        check = sample_res + '.check'
+        out = StringIO()
+        checkreport.write_tables(out, coord.read_check_arrays(check))
+        with open(check, 'rb') as f:
+            self.assertEqual(out.getvalue(), f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
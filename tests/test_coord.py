@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+import coord
+from tests import sample_res
+
+_ELEMENT_FIELDS = ('sat_ID', 'a', 'e', 'i', 'W', 'w', 'M', 'Lon')
+
+
+def reference_check(lines):
+    # Elements as the original coord.read_check() parsed them
+    a_check, a_check_match = [], []
+    elem, elem_match = coord.elements(), coord.elements()
+    lines = iter(lines)
+    for line in lines:
+        if line[0] == '-':
+            elem.sat_ID = line.split()[3].split(')')[0]
+        elif line[:3] in ('  a', '  e', '  i', '  W', '  w', '  M'):
+            name = line[2]
+            nl = next(lines)
+            setattr(elem, name, float(line.split()[1]))
+            setattr(elem_match, name, float(nl.split()[0]))
+            if name == 'a':
+                elem_match.sat_ID = nl.split()[-1][1:-1]
+        elif line[:3] == 'Lon':
+            elem.Lon = elem_match.Lon = float(line.split()[4])
+            a_check.append(elem)
+            a_check_match.append(elem_match)
+            elem, elem_match = coord.elements(), coord.elements()
+    return a_check, a_check_match
+
+
+def fields(elements):
+    return [tuple(getattr(el, name) for name in _ELEMENT_FIELDS)
+            for el in elements]
+
+
+class ReadResArraysTest(unittest.TestCase):
+    def test_same_as_per_line_reader(self):
+        meas, series = coord.read_res_arrays(sample_res)
+        ref = list(coord.iter_res(sample_res))
+        self.assertEqual(
+            [(s['st_id'], s['ser_id'], s['stop'] - s['start'])
+             for s in series],
+            [(s.st_id, s.ser_id, len(s.coord)) for s in ref])
+        # Bit-identical values
+        self.assertEqual(meas.tolist(),
+                         [(c.date, c.time, c.RA, c.DEC, c.m)
+                          for s in ref for c in s.coord])
+
+    def test_buffer_source(self):
+        meas, series = coord.read_res_arrays(open(sample_res, 'rb').read())
+        ref, ref_series = coord.read_res_arrays(sample_res)
+        self.assertEqual(meas.tolist(), ref.tolist())
+        self.assertEqual(series.tolist(), ref_series.tolist())
+
+    def test_missing_file(self):
+        missing = os.path.join(os.path.dirname(sample_res), 'missing.res')
+        self.assertRaises(EnvironmentError, coord.read_res_arrays, missing)
+        self.assertEqual(len(coord.read_res_arrays('')[0]), 0)
+
+
+class SeriesBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.block = coord.SeriesBlock(*coord.read_res_arrays(sample_res))
+        self.ref = list(coord.iter_res(sample_res))
+
+    def test_same_as_lists(self):
+        self.assertEqual(len(self.block), len(self.ref))
+        for ser, ref in zip(self.block, self.ref):
+            self.assertEqual((ser.st_id, ser.ser_id, len(ser.coord)),
+                             (ref.st_id, ref.ser_id, len(ref.coord)))
+            self.assertEqual(
+                [(c.date, c.time, c.RA, c.DEC, c.m) for c in ser.coord],
+                [(c.date, c.time, c.RA, c.DEC, c.m) for c in ref.coord])
+        # Indexing and slicing as lists
+        last, ref = self.block[-1], self.ref[-1]
+        self.assertEqual(last.ser_id, ref.ser_id)
+        self.assertEqual(last.coord[-1].RA, ref.coord[-1].RA)
+        self.assertEqual([c.time for c in last.coord[1:4]],
+                         [c.time for c in ref.coord[1:4]])
+        self.assertEqual([s.ser_id for s in self.block[2:5]],
+                         [s.ser_id for s in self.ref[2:5]])
+        self.assertRaises(IndexError, lambda: self.block[len(self.ref)])
+        self.assertRaises(IndexError, lambda: last.coord[len(ref.coord)])
+
+    def test_read_only(self):
+        ser = self.block[0]
+        c = ser.coord[0]
+        for obj, name in ((c, 'RA'), (c, 'm'), (ser, 'ser_id'),
+                          (ser, 'coord')):
+            self.assertRaises(AttributeError, setattr, obj, name, 0)
+        self.assertRaises(AttributeError, setattr, c, 'extra', 0)
+        self.assertEqual(ser.coord[0].RA, self.ref[0].coord[0].RA)
+
+
+class ReadCheckTest(unittest.TestCase):
+    def setUp(self):
+        with open(sample_res + '.check', 'rb') as f:
+            self.text = f.read()
+
+    def check(self, text):
+        ref = map(fields, reference_check(text.splitlines(True)))
+        streamed = zip(*coord.iter_check(StringIO(text)))
+        self.assertEqual(map(fields, streamed), ref)
+        tables = coord.read_check_arrays(StringIO(text))
+        self.assertEqual(map(fields, coord.check_elements(tables)), ref)
+        return tables
+
+    def test_same_as_original(self):
+        tables = self.check(self.text)
+        self.assertEqual(len(tables.series), 42)
+        self.assertEqual(len(tables.iod), 42)
+        # Epochs of the elements are those of the fits
+        el = next(coord.iter_check(StringIO(self.text)))[0]
+        self.assertEqual(el.epoch,
+                         coord.utc_to_mjd(tables.series['epoch'][0]))
+
+    def test_residual_rows(self):
+        tables = coord.read_check_arrays(StringIO(self.text))
+        rows = tables.residuals
+        self.assertTrue((rows['series'][1:] >= rows['series'][:-1]).all())
+        np.testing.assert_array_equal(
+            np.bincount(rows['series'], minlength=len(tables.series)),
+            tables.series['stop'] - tables.series['start'])
+        self.assertTrue((rows['match'] < len(tables.match_ids)).all())
+        first = tables.series[0]
+        self.assertEqual(int(rows['mjd'][0]), first['mjd0'])
+
+    def test_no_longitude(self):
+        # A fit without its sub-satellite longitude line is not emitted
+        lon = self.text.index('Longitude of sub-satellite point')
+        text = self.text[:lon] + self.text[self.text.index('\n', lon) + 1:]
+        tables = self.check(text)
+        self.assertEqual(len(tables.iod), 42)
+        self.assertTrue(np.isnan(tables.iod['Lon'][0]))
+        self.assertEqual(len(list(coord.iter_check(StringIO(text)))), 41)
+
+
+class CatalogIndexTest(unittest.TestCase):
+    def setUp(self):
+        block = coord.SeriesBlock(*coord.read_res_arrays(sample_res))
+        check, check_match = coord.read_check(sample_res + '.check')
+        # Two loads of the sample: each ID has rows in both halves
+        self.nseries = len(block)
+        self.index = coord.CatalogIndex()
+        for series in (block, list(coord.iter_res(sample_res))):
+            self.index.add_series(series)
+            self.index.add_elements(check, check_match)
+
+    def scan(self, rows, sat_ID):
+        return [k for k, ID in enumerate(rows) if str(ID) == str(sat_ID)]
+
+    def test_same_as_scan(self):
+        index = self.index
+        ids = set(str(ser.ser_id) for ser in index.series)
+        ids.update(el.sat_ID for el in index.check)
+        self.assertEqual(len(index), 2*self.nseries)
+        for sat_ID in ids:
+            rows = index.series_rows(sat_ID)
+            self.assertEqual(rows, self.scan(
+                [ser.ser_id for ser in index.series], sat_ID))
+            self.assertTrue(rows)
+            el_rows = index.element_rows(sat_ID)
+            self.assertEqual(el_rows, self.scan(
+                [el.sat_ID for el in index.check], sat_ID))
+            check, check_match = index.elements(sat_ID)
+            self.assertEqual(check, [el for el in index.check
+                                     if el.sat_ID == sat_ID])
+            self.assertEqual(check_match, [index.check_match[k]
+                                           for k in el_rows])
+        # Integer IDs are looked up as the strings shown in the GUI
+        ser_id = index.series[0].ser_id
+        self.assertEqual(index.series_rows(int(ser_id)),
+                         index.series_rows(str(ser_id)))
+
+    def test_unknown_id(self):
+        self.assertEqual(self.index.series_rows('0'), [])
+        self.assertEqual(self.index.element_rows('0'), [])
+        self.assertEqual(self.index.elements('0'), ([], []))
+
+
+def compressors():
+    # Writers of compressed files by kind, xz only if lzma is available
+    kinds = {'gz': lambda name: gzip.open(name, 'wb'),
+             'bz2': lambda name: bz2.BZ2File(name, 'w')}
+    try:
+        lzma = coord._lzma()
+        kinds['xz'] = lambda name: lzma.open(name, 'wb')
+    except IOError:
+        pass
+    return kinds
+
+
+class CompressedTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.block = coord._READ_BLOCK
+        self.plain_res = coord.read_res_arrays(sample_res)
+        self.plain_check = coord.read_check_arrays(sample_res + '.check')
+
+    def tearDown(self):
+        coord._READ_BLOCK = self.block
+        shutil.rmtree(self.dir)
+
+    def compress(self, kind, writer, source):
+        name = os.path.join(self.dir, os.path.basename(source) + '.' + kind)
+        f = writer(name)
+        with open(source, 'rb') as src:
+            f.write(src.read())
+        f.close()
+        return name
+
+    def check_sources(self, res, check):
+        for source in (lambda name: name, lambda name: open(name, 'rb')):
+            meas, series = coord.read_res_arrays(source(res))
+            self.assertEqual(meas.tostring(), self.plain_res[0].tostring())
+            self.assertEqual(series.tostring(), self.plain_res[1].tostring())
+            self.assertEqual(
+                [(s.st_id, s.ser_id, len(s.coord))
+                 for s in coord.iter_res(source(res))],
+                [(s['st_id'], s['ser_id'], s['stop'] - s['start'])
+                 for s in series])
+            tables = coord.read_check_arrays(source(check))
+            for name in ('series', 'residuals', 'iod', 'matched',
+                         'match_ids'):
+                self.assertEqual(getattr(tables, name).tostring(),
+                                 getattr(self.plain_check, name).tostring())
+            self.assertEqual(
+                map(fields, zip(*coord.iter_check(source(check)))),
+                map(fields, coord.check_elements(self.plain_check)))
+
+    def test_compressed(self):
+        for kind, writer in sorted(compressors().iteritems()):
+            self.check_sources(self.compress(kind, writer, sample_res),
+                               self.compress(kind, writer,
+                                             sample_res + '.check'))
+
+    def test_small_blocks(self):
+        # Lines split between decompressed blocks
+        coord._READ_BLOCK = 97
+        kinds = compressors()
+        del kinds['gz']
+        for kind, writer in sorted(kinds.iteritems()):
+            self.check_sources(self.compress(kind, writer, sample_res),
+                               self.compress(kind, writer,
+                                             sample_res + '.check'))
+
+    def test_check_name(self):
+        res = self.compress('bz2', compressors()['bz2'], sample_res)
+        self.assertEqual(coord.check_name(res), res[:-4] + '.check')
+        check = self.compress('bz2', compressors()['bz2'],
+                              sample_res + '.check')
+        self.assertEqual(coord.check_name(res), check)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+import catdb
+import coord
+import dbpool
+from tests import sample_res
+
+
+def count(conn, table):
+    return conn.execute("""SELECT COUNT(*) FROM %s""" % table).fetchone()[0]
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # Readers fail soon instead of waiting for the writer
+        self.pool = dbpool.ConnectionPool(
+            os.path.join(self.dir, 'res.db'), os.path.join(self.dir, 'el.db'),
+            timeout=1.0)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    def insert(self, res_conn, el_conn, started=None, release=None,
+               fail=False):
+        # An observation and an element set, committed once released; the
+        # exclusive locks would keep readers out without WAL
+        for conn in (res_conn, el_conn):
+            conn.execute("""BEGIN EXCLUSIVE""")
+        res_conn.execute(
+            """INSERT INTO observations (sat_id, station, series_id, epoch)
+               VALUES (1, 10092, 1, 56789.5)""")
+        el_conn.execute(
+            """INSERT INTO elements (sat_id, station, series_id, epoch)
+               VALUES (1, 10092, 1, 56789.5)""")
+        if started is not None:
+            started.set()
+            release.wait()
+        if fail:
+            raise ValueError('write failed')
+        res_conn.commit()
+        el_conn.commit()
+        return 1
+
+    def test_read_during_write(self):
+        started, release = threading.Event(), threading.Event()
+        pending = self.pool.write(self.insert, (started, release))
+        self.assertTrue(started.wait(10))
+        try:
+            # The writer holds its transaction: readers see the last
+            # committed state at once
+            reader = self.pool.reader()
+            t0 = time.time()
+            self.assertEqual(count(reader, 'observations'), 0)
+            self.assertEqual(catdb.satellites(reader), [])
+            self.assertLess(time.time() - t0, 0.5)
+            self.assertFalse(pending.finished())
+        finally:
+            release.set()
+        self.assertEqual(pending.wait(10), 1)
+        self.assertEqual(count(reader, 'observations'), 1)
+        self.assertEqual(catdb.satellites(reader), [1])
+
+    def test_failed_write(self):
+        pending = self.pool.write(self.insert, (None, None, True))
+        self.assertRaises(ValueError, pending.wait, 10)
+        reader = self.pool.reader()
+        self.assertEqual(count(reader, 'observations'), 0)
+        self.assertEqual(count(reader, 'elements'), 0)
+        # The writer goes on with the next job
+        self.assertEqual(self.pool.write(self.insert).wait(10), 1)
+        self.assertEqual(count(reader, 'elements'), 1)
+
+    def test_add_series(self):
+        series = list(coord.iter_res(sample_res))
+        check, check_match = coord.read_check(sample_res + '.check')
+        done = []
+        for ser in series[:3]:
+            pending = self.pool.write(catdb.add_series,
+                                      (ser, check, check_match), done.append)
+        pending.wait(10)
+        self.assertEqual([p.error for p in done], [None]*3)
+        self.assertEqual(catdb.satellites(self.pool.reader()),
+                         sorted(set(int(ser.ser_id) for ser in series[:3])))
+
+    def test_readers(self):
+        # One read-only connection per thread
+        readers = []
+        thread = threading.Thread(
+            target=lambda: readers.append(self.pool.reader()))
+        thread.start()
+        thread.join()
+        reader = self.pool.reader()
+        self.assertIs(self.pool.reader(), reader)
+        self.assertIsNot(readers[0], reader)
+        self.assertRaises(sqlite3.OperationalError, reader.execute,
+                          """DELETE FROM observations""")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ephemcache import EphemerisCache
+
+
+class Catalog(object):
+    # Stub of the catalog queries recording their calls
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.calls = []
+
+    def query(self, id, catid, epoch):
+        self.calls.append(('query', id, catid, epoch))
+        if id in self.missing:
+            raise IndexError(id)
+        return (id, catid, epoch)
+
+    def query_many(self, ids, catid, epoch):
+        self.calls.append(('query_many', tuple(ids), catid, epoch))
+        return [None if id in self.missing else (id, catid, epoch)
+                for id in ids]
+
+
+class EphemerisCacheTest(unittest.TestCase):
+    def test_prefetch_one_query_per_epoch(self):
+        catalog = Catalog()
+        cache = EphemerisCache(catalog.query, 100, catalog.query_many)
+        requests = [(id, 'geo', epoch) for epoch in (1, 2, 3)
+                    for id in (10, 11, 12, 10)]
+        self.assertEqual(cache.prefetch(requests), 9)
+        self.assertEqual(catalog.calls, [
+            ('query_many', (10, 11, 12), 'geo', epoch)
+            for epoch in (1, 2, 3)])
+        for id, catid, epoch in requests:
+            self.assertEqual(cache(id, catid, epoch), (id, catid, epoch))
+        self.assertEqual(len(catalog.calls), 3)
+        self.assertEqual((cache.hits, cache.misses), (12, 9))
+        # Nothing left to fetch
+        self.assertEqual(cache.prefetch(requests), 0)
+        self.assertEqual(len(catalog.calls), 3)
+
+    def test_missing_objects(self):
+        catalog = Catalog(missing=[11])
+        cache = EphemerisCache(catalog.query, 100, catalog.query_many)
+        cache.prefetch([(10, 'geo', 1), (11, 'geo', 1)])
+        self.assertEqual(len(cache), 1)
+        # Still raises as without the prefetch
+        self.assertRaises(IndexError, cache, 11, 'geo', 1)
+
+    def test_size_limit_and_items(self):
+        catalog = Catalog()
+        cache = EphemerisCache(catalog.query, 5, catalog.query_many)
+        cache.prefetch([(id, 'geo', 1) for id in range(8)])
+        self.assertEqual(len(cache), 5)
+        other = EphemerisCache(catalog.query, 5, catalog.query_many)
+        other.update(cache.items())
+        self.assertEqual(other.items(), cache.items())
+        self.assertEqual(other(7, 'geo', 1), (7, 'geo', 1))
+        self.assertEqual(other.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
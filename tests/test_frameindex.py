@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import frameindex
+
+
+def fits_header(cards):
+    # Primary header of a FITS file with the given (keyword, value) cards
+    text = ''.join('%-8s= %-70s' % card for card in
+                   [('SIMPLE', 'T')] + cards) + 'END'.ljust(80)
+    return text.ljust(-(-len(text)//2880)*2880)
+
+
+class FrameEpochsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = os.path.join(self.dir, '.frame_epochs')
+        self.start = datetime.datetime(2014, 5, 12, 23, 20)
+        self.names = [self.frame(k) for k in range(5)]
+        self.read = []
+        self.rename = frameindex.os.rename
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        frameindex.os.rename = self.rename
+        shutil.rmtree(self.dir)
+
+    def frame(self, k, seconds=0):
+        # Frame k with its epoch as contents
+        name = os.path.join(self.dir, 'frame%d.fit' % k)
+        with open(name, 'wb') as f:
+            f.write(self.epoch(k, seconds).strftime('%Y-%m-%dT%H:%M:%S'))
+        return name
+
+    def epoch(self, k, seconds=0):
+        return self.start + datetime.timedelta(minutes=2*k, seconds=seconds)
+
+    def reader(self, name):
+        self.read.append(name)
+        with open(name, 'rb') as f:
+            return datetime.datetime.strptime(f.read(), '%Y-%m-%dT%H:%M:%S')
+
+    def epochs(self, names=None, reader=None):
+        del self.read[:]
+        return frameindex.frame_epochs(
+            self.names if names is None else names, reader or self.reader,
+            self.index, threads=2)
+
+    def test_unchanged(self):
+        expected = dict((name, self.epoch(k))
+                        for k, name in enumerate(self.names))
+        self.assertEqual(self.epochs(), expected)
+        self.assertEqual(sorted(self.read), self.names)
+        with open(self.index, 'rb') as f:
+            text = f.read()
+        # Nothing is read or written again
+        self.assertEqual(self.epochs(), expected)
+        self.assertEqual(self.read, [])
+        with open(self.index, 'rb') as f:
+            self.assertEqual(f.read(), text)
+
+    def test_changed(self):
+        self.epochs()
+        # Same size, another modification time
+        st = os.stat(self.names[1])
+        self.frame(1, seconds=30)
+        os.utime(self.names[1], (st.st_atime, st.st_mtime + 10))
+        # Another size, unreadable
+        with open(self.names[3], 'ab') as f:
+            f.write('x')
+        epochs = self.epochs()
+        self.assertEqual(sorted(self.read), [self.names[1], self.names[3]])
+        self.assertEqual(epochs[self.names[1]], self.epoch(1, seconds=30))
+        self.assertNotIn(self.names[3], epochs)
+        # Unreadable frames are remembered too; gone ones are forgotten
+        os.remove(self.names[4])
+        epochs = self.epochs(self.names[:4])
+        self.assertEqual(self.read, [])
+        self.assertEqual(sorted(epochs), self.names[:3])
+        with open(self.index, 'rb') as f:
+            self.assertNotIn('frame4', f.read())
+
+    def test_other_reader(self):
+        self.epochs()
+        del self.read[:]
+        frameindex.frame_epochs(self.names, self.reader, self.index,
+                                tag='fits')
+        self.assertEqual(sorted(self.read), self.names)
+
+    def test_not_datetime(self):
+        # Epochs that are not datetimes are dropped and reported
+        def reader(name):
+            epoch = self.reader(name)
+            return epoch.date() if name == self.names[2] else epoch
+        epochs = self.epochs(reader=reader)
+        self.assertEqual(sorted(epochs),
+                         self.names[:2] + self.names[3:])
+        self.assertIn('Ignored 1 frame(s) with an epoch that is not a '
+                      'datetime, e.g. %s' % self.names[2],
+                      sys.stdout.getvalue())
+
+    def test_atomic_rewrite(self):
+        self.epochs(self.names[:3])
+        with open(self.index, 'rb') as f:
+            text = f.read()
+        # The index is replaced by a complete file from the same directory
+        renamed = []
+
+        def rename(src, dst):
+            with open(src, 'rb') as f:
+                renamed.append((os.path.dirname(src), dst, f.read()))
+            with open(dst, 'rb') as f:
+                self.assertEqual(f.read(), text)
+            self.rename(src, dst)
+        frameindex.os.rename = rename
+        self.epochs()
+        with open(self.index, 'rb') as f:
+            new_text = f.read()
+        self.assertEqual(renamed, [(self.dir, self.index, new_text)])
+        self.assertEqual(new_text.count('\n'), 1 + len(self.names))
+
+        # A failed rewrite keeps the old index and leaves no temporary file
+        def rename(src, dst):
+            raise OSError('rename failed')
+        frameindex.os.rename = rename
+        self.frame(0, seconds=30)
+        os.utime(self.names[0], (0, 0))
+        self.epochs()
+        self.assertIn('Cannot save frame index', sys.stdout.getvalue())
+        with open(self.index, 'rb') as f:
+            self.assertEqual(f.read(), new_text)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         sorted(['.frame_epochs'] +
+                                [os.path.basename(n) for n in self.names]))
+
+
+class FitsEpochTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def fits(self, cards):
+        name = os.path.join(self.dir, 'frame.fit')
+        with open(name, 'wb') as f:
+            f.write(fits_header(cards))
+        return name
+
+    def test_date_and_time(self):
+        epoch = datetime.datetime(2014, 5, 12, 23, 20, 1, 500000)
+        self.assertEqual(frameindex.fits_epoch(self.fits(
+            [('DATE-OBS', "'2014-05-12T23:20:01.5'")])), epoch)
+        self.assertEqual(frameindex.fits_epoch(self.fits(
+            [('DATE-OBS', "'2014-05-12'"), ('TIME-OBS', "'23:20:01.5'")])),
+            epoch)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, frameindex.fits_epoch,
+                          self.fits([('EXPTIME', '1.0')]))
+        name = os.path.join(self.dir, 'text.fit')
+        with open(name, 'wb') as f:
+            f.write('not a FITS file'.ljust(2880))
+        self.assertRaises(ValueError, frameindex.fits_epoch, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import identdb
+
+
+def entries(n, night=0, prefix='25546'):
+    # n targets of a night, with one or two match lines each
+    d = datetime.date(2014, 5, 12) + datetime.timedelta(days=night)
+    return [(d, '010092 %06d' % k,
+             ['%-40s  %3d/%-3d  %6.3f  %6.3f' % (
+                 '%s/%d' % (prefix, j), 10, 10, 0.001*k, -0.001*j)
+              for j in range(1 + k % 2)])
+            for k in range(n)]
+
+
+def rows(conn):
+    return conn.execute("""SELECT date, tag, matches FROM ident
+                           ORDER BY date, tag""").fetchall()
+
+
+def write_nights(db, txt, first, nights):
+    # One update and export per night, as separate station runs do
+    conn = identdb.connect(db)
+    try:
+        for night in range(first, first + nights):
+            identdb.update(conn, entries(20, night, str(first)))
+            identdb.export_text(conn, txt)
+    finally:
+        conn.close()
+
+
+class IdentDBTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, 'ident.db')
+        self.txt = os.path.join(self.dir, 'ident.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_export(self, per_night):
+        # Entries of ident.txt, checking that whole nights are exported
+        try:
+            with open(self.txt) as f:
+                text = f.read()
+        except IOError:
+            return {}
+        self.assertTrue(text.startswith(identdb.header))
+        ident = identdb.parse_text(text.splitlines())
+        self.assertEqual(len(ident) % per_night, 0)
+        self.assertEqual(text.count('\n'), len(identdb.header.split('\n')) +
+                         sum(len(matches) for matches in ident.values()))
+        return ident
+
+    def test_update(self):
+        conn = identdb.connect(self.db)
+        self.assertTrue(identdb.is_empty(conn))
+        self.assertEqual(identdb.update(conn, entries(5)), 5)
+        # Targets processed again are replaced, the others are kept
+        changed = entries(2, prefix='28884')
+        identdb.update(conn, changed)
+        ident = dict(((d, tag), matches) for d, tag, matches in rows(conn))
+        self.assertEqual(len(ident), 5)
+        for d, tag, matches in changed + entries(5)[2:]:
+            self.assertEqual(ident[str(d), tag], '\n'.join(matches))
+        conn.close()
+
+    def test_round_trip(self):
+        conn = identdb.connect(self.db)
+        identdb.update(conn, entries(5) + entries(3, 1))
+        self.assertEqual(identdb.export_text(conn, self.txt), 8)
+        with open(self.txt) as f:
+            text = f.read()
+        self.assertTrue(text.startswith(identdb.header))
+        # A new database imported from the export holds the same rows, and
+        # exports the same text
+        other = identdb.connect(os.path.join(self.dir, 'other.db'))
+        self.assertEqual(identdb.import_text(other, self.txt), 8)
+        self.assertEqual(rows(other), rows(conn))
+        txt = os.path.join(self.dir, 'other.txt')
+        identdb.export_text(other, txt)
+        with open(txt) as f:
+            self.assertEqual(f.read(), text)
+        conn.close()
+        other.close()
+        # Only the database and the exports are left
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['ident.db', 'ident.txt', 'other.db', 'other.txt'])
+
+    def test_concurrent_writers(self):
+        # Two stations update and export the same store at the same time
+        writers = [multiprocessing.Process(
+            target=write_nights, args=(self.db, self.txt, first, 10))
+            for first in (0, 100)]
+        for p in writers:
+            p.start()
+        try:
+            # Any ident.txt seen meanwhile is a complete export
+            while any(p.is_alive() for p in writers):
+                self.check_export(20)
+        finally:
+            for p in writers:
+                p.join()
+        self.assertEqual([p.exitcode for p in writers], [0, 0])
+        conn = identdb.connect(self.db)
+        try:
+            stored = rows(conn)
+            self.assertEqual(len(stored), 2*10*20)
+            # The entries of the last export are the stored ones
+            ident = self.check_export(20)
+            self.assertGreaterEqual(len(ident), 10*20)
+            stored = dict(((d, tag), matches) for d, tag, matches in stored)
+            for (d, tag), matches in ident.iteritems():
+                self.assertEqual('\n'.join(matches), stored[str(d), tag])
+        finally:
+            conn.close()
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['ident.db', 'ident.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import catdb
+import coord
+import ingest
+from tests import sample_res
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.res_db = os.path.join(self.dir, 'res.db')
+        self.el_db = os.path.join(self.dir, 'el.db')
+        # The series of the sample in 5 files, each one with the whole
+        # .check, listed against the order of their names
+        with open(sample_res, 'rb') as f:
+            blocks = [b + '\r\n\r\n' for b in f.read().split('\r\n\r\n')
+                      if b.strip()]
+        self.paths = []
+        for k in range(5):
+            path = os.path.join(self.dir, '%d.res' % (9 - k))
+            with open(path, 'wb') as f:
+                f.write(''.join(blocks[k::5]))
+            shutil.copy(sample_res + '.check', path + '.check')
+            self.paths.append(path)
+        # A bzip2 file that cannot be decompressed
+        self.bad = os.path.join(self.dir, 'bad.res')
+        with open(self.bad, 'wb') as f:
+            f.write('BZh91AY&SY' + '\0'*100)
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.stderr, sys.stderr = sys.stderr, StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        shutil.rmtree(self.dir)
+
+    def run_ingest(self, paths, workers=2):
+        return ingest.ingest(paths, workers, 2, self.res_db, self.el_db,
+                             verbose=False)
+
+    def counts(self):
+        res_conn, el_conn = catdb.connect(self.res_db, self.el_db)
+        try:
+            return [conn.execute("""SELECT COUNT(*) FROM %s""" %
+                                 table).fetchone()[0]
+                    for conn, table in ((res_conn, 'observations'),
+                                        (el_conn, 'elements'))]
+        finally:
+            res_conn.close()
+            el_conn.close()
+
+    def expected_counts(self):
+        # The sample stored at once in memory
+        res_conn, el_conn = catdb.connect(':memory:', ':memory:', wal=False)
+        meas, series = coord.read_res_arrays(sample_res)
+        check, check_match = coord.check_elements(
+            coord.read_check_arrays(sample_res + '.check'))
+        with catdb.BulkWriter(res_conn, el_conn) as writer:
+            writer.add_arrays(meas, series, check, check_match)
+        return [conn.execute("""SELECT COUNT(*) FROM %s""" %
+                             table).fetchone()[0]
+                for conn, table in ((res_conn, 'observations'),
+                                    (el_conn, 'elements'))]
+
+    def test_bad_file(self):
+        # Unreadable files are reported, the others are all stored
+        missing = os.path.join(self.dir, 'missing.res')
+        paths = self.paths[:2] + [self.bad] + self.paths[2:] + [missing]
+        failed = self.run_ingest(paths)
+        self.assertEqual([path for path, error in failed],
+                         [self.bad, missing])
+        self.assertIn('bad.res', sys.stderr.getvalue())
+        nobs, nel = self.expected_counts()
+        self.assertGreater(nel, 0)
+        self.assertEqual(self.counts(), [nobs, nel])
+
+    def test_input_order(self):
+        self.assertEqual(self.run_ingest(self.paths), [])
+        # Rows are inserted file after file, in the order given
+        res_conn = catdb.connect(self.res_db, self.el_db)[0]
+        sat_ids = [row[0] for row in res_conn.execute(
+            """SELECT sat_id FROM observations ORDER BY rowid""")]
+        file_of = {}
+        for k, path in enumerate(self.paths):
+            for ser in coord.read_res_arrays(path)[1]:
+                file_of[ser['ser_id']] = k
+        order = [file_of[sat_id] for sat_id in sat_ids]
+        self.assertEqual(order, sorted(order))
+        self.assertEqual(sorted(set(order)), range(len(self.paths)))
+
+    def test_reingest(self):
+        self.run_ingest(self.paths)
+        counts = self.counts()
+        self.assertEqual(self.run_ingest(self.paths[::-1], workers=1), [])
+        self.assertEqual(self.counts(), counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
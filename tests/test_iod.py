@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+import astrodyn
+import coord
+import iod
+from tests import sample_res
+
+# Station of the sample .res file
+site = (48.5635, 22.4565, 0.231)
+
+
+def observe(r0, v0, epoch, mjd):
+    # J2000 RA (hours) and Dec (degrees) of objects with TOD states r0, v0
+    # at epoch, seen from the site at mjd, with light time
+    dt = (mjd - epoch)*astrodyn.day
+    r_site = astrodyn.site_state(site[0], site[1], site[2], mjd)[0]
+    lt = 0
+    for _ in xrange(3):
+        rho = astrodyn.propagate_state(r0, v0, dt - lt)[0] - r_site
+        lt = np.sqrt((rho*rho).sum(-1))/astrodyn.c_light
+    u = np.matmul(np.swapaxes(astrodyn.tod_matrix(mjd), -1, -2),
+                  rho[..., None])[..., 0]
+    return (np.rad2deg(np.arctan2(u[..., 1], u[..., 0])) % 360/15,
+            np.rad2deg(np.arcsin(u[..., 2]/np.sqrt((u*u).sum(-1)))))
+
+
+class PropagatePartialsTest(unittest.TestCase):
+    def test_central_differences(self):
+        rng = np.random.RandomState(0)
+        r0 = rng.normal(0, 1, (20, 3))
+        r0 *= (rng.uniform(7000, 45000, 20)/np.sqrt((r0*r0).sum(1)))[
+            :, None]
+        v0 = rng.normal(0, 1, (20, 3))
+        v0 *= (rng.uniform(0.8, 1.2, 20)*np.sqrt(
+            astrodyn.mu/np.sqrt((r0*r0).sum(1)))/np.sqrt((v0*v0).sum(1)))[
+            :, None]
+        dt = rng.uniform(-3000, 3000, 20)
+        r, jac = astrodyn.propagate_partials(r0, v0, dt)
+        np.testing.assert_array_equal(
+            r, astrodyn.propagate_state(r0, v0, dt)[0])
+        x = np.hstack([r0, v0])
+        for j, h in enumerate([1e-3]*3 + [1e-7]*3):
+            xp, xm = x.copy(), x.copy()
+            xp[:, j] += h
+            xm[:, j] -= h
+            d = (astrodyn.propagate_state(xp[:, :3], xp[:, 3:], dt)[0] -
+                 astrodyn.propagate_state(xm[:, :3], xm[:, 3:], dt)[0])/(2*h)
+            np.testing.assert_allclose(jac[..., j], d, rtol=1e-5,
+                                       atol=1e-6*np.abs(d).max())
+
+
+class FitArcsTest(unittest.TestCase):
+    def test_exact_measurements(self):
+        # Slightly eccentric and inclined orbits near GEO, measured every
+        # 2 minutes for 14 minutes and in longer arcs
+        rng = np.random.RandomState(1)
+        n = 30
+        epoch = 56789.9 + rng.uniform(0, 0.1, n)
+        lengths = rng.choice([5, 8, 15], n)
+        r0, v0 = astrodyn.elements_to_state(
+            rng.uniform(41000, 43500, n), rng.uniform(0, 0.02, n),
+            rng.uniform(0, 10, n), rng.uniform(0, 360, n),
+            rng.uniform(0, 360, n), rng.uniform(0, 360, n))
+        # Objects above the horizon of the site, east of its longitude
+        lon = astrodyn.sublon(r0, epoch)
+        r0, v0 = [np.matmul(astrodyn._rotation(
+            2, np.deg2rad(lon - site[1] - 10)), x[..., None])[..., 0]
+                  for x in (r0, v0)]
+        mjd = np.concatenate([t + (np.arange(k) - (k - 1)/2.0)*2/1440.0
+                              for t, k in zip(epoch, lengths)])
+        stop = np.cumsum(lengths)
+        start = stop - lengths
+        ra, dec = observe(np.repeat(r0, lengths, 0),
+                          np.repeat(v0, lengths, 0),
+                          np.repeat(epoch, lengths), mjd)
+        elements, residuals = iod.fit_arcs(mjd, ra, dec, start, stop, site)
+        self.assertTrue(elements['converged'].all())
+        self.assertLess(np.median(elements['iterations']), 20)
+        self.assertLess(np.abs(residuals['tan']).max(), 1e-3)
+        self.assertLess(np.abs(residuals['norm']).max(), 1e-3)
+        np.testing.assert_allclose(elements['epoch'], epoch, atol=1e-9)
+        np.testing.assert_allclose(elements['r'], r0, atol=1.0)
+
+    def test_sample(self):
+        meas, series = coord.read_res_arrays(sample_res)
+        elements, residuals = iod.fit_res(meas, series, site)
+        self.assertTrue(np.isfinite(residuals['tan']).all())
+        # A 4-point series (as fitted by Apex too) ends on a parabolic orbit,
+        # the rest are near GEO
+        lengths = series['stop'] - series['start']
+        bad = ~elements['converged']
+        self.assertEqual(lengths[bad].tolist(), [4])
+        self.assertGreater(elements['e'][bad][0], 0.99)
+        a = elements['a'][~bad]
+        self.assertTrue(((a > 26000) & (a < 75000)).all())
+
+        # The converged fits agree with the Apex ones of the .check file;
+        # series of both files are paired by the epoch and RA of the first
+        # measurement, as by "benchmarks.py iod"
+        check = coord.read_check_arrays(sample_res + '.check')
+        mjd = coord.res_mjd(meas['date'], meas['time'])
+        key = lambda t, ra: (round(t, 6), round(ra, 5))
+        first = dict((key(check.residuals['mjd'][s['start']],
+                          check.residuals['RA'][s['start']]), k)
+                     for k, s in enumerate(check.series))
+        ref = dict((r['series'], r) for r in check.iod)
+        pairs = [(k, first.get(key(mjd[s['start']], meas['RA'][s['start']])))
+                 for k, s in enumerate(series)]
+        pairs = [(k, c) for k, c in pairs
+                 if c in ref and elements['converged'][k]]
+        self.assertEqual(len(pairs), 41)
+        ours = elements[[k for k, c in pairs]]
+        apex = np.array([ref[c] for k, c in pairs])
+        for d, median, limit in (
+                (ours['a'] - apex['a'], 20, 400),
+                (ours['e'] - apex['e'], 0.001, 0.01),
+                (ours['i'] - apex['i'], 0.001, 0.02),
+                ((ours['Lon'] - apex['Lon'] + 180) % 360 - 180, 0.2, 0.65)):
+            self.assertLess(np.median(np.abs(d)), median)
+            self.assertLess(np.abs(d).max(), limit)
+
+    def test_short_arcs(self):
+        mjd = 56789 + np.arange(4)/1440.0
+        elements, residuals = iod.fit_arcs(mjd, [1.0]*4, [0.0]*4, [0, 2],
+                                           [2, 4], site)
+        self.assertTrue(np.isnan(elements['a']).all())
+        self.assertFalse(elements['converged'].any())
+        self.assertTrue(np.isnan(residuals['tan']).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
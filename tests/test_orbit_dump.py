@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+import numpy as np
+
+from tests import apexstub
+
+apexstub.install()
+# orbit_dump prints its usage and exits without a command line argument
+_argv, sys.argv = sys.argv, ['orbit_dump.py', 'stub']
+try:
+    import orbit_dump
+finally:
+    sys.argv = _argv
+
+import checkreport
+import coord
+import identdb
+import residuals
+
+site = (48.6, 22.3, 0.2)
+apexstub.objects.update({'25546': 56.1, '28884': 60.0})
+
+
+def target(id, start, n=10, ddec=0.0):
+    # Measurements of a catalog object every 2 minutes and their matches
+    epochs = [start + timedelta(minutes=2*i) for i in range(n)]
+    measurements = dict((t, apexstub.observe(id, t, site, ddec=ddec))
+                        for t in epochs)
+    for obj in measurements.itervalues():
+        obj.match = apexstub.Match(id)
+    return measurements
+
+
+class _ReportFormat(object):
+    # Measurement file format returning fixed blocks
+    descr = 'stub'
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def load_measurements(self, filename):
+        return self.blocks
+
+    def format_epoch(self, t):
+        return t
+
+    def parse_epoch(self, s):
+        return s
+
+
+class ProcessTargetTest(unittest.TestCase):
+    def setUp(self):
+        self.start = datetime(2014, 5, 12, 23, 20)
+        self.measurements = target('25546', self.start, ddec=10.0)
+        self.matches = dict((((10092, 1), t), obj.match)
+                            for t, obj in self.measurements.iteritems())
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        orbit_dump.new_ephemeris_cache()
+        orbit_dump.prefetch_ephemerides(self.matches)
+        self.text, self.ident = orbit_dump.process_target(
+            (10092, 1), self.measurements, self.matches, {}, site)
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_residuals(self):
+        tables = coord.read_check_arrays(StringIO(self.text))
+        self.assertEqual(len(tables.series), 1)
+        rows = tables.residuals
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(list(tables.match_ids), ['25546'])
+        np.testing.assert_allclose(rows['int_tan'], 0.1)
+        np.testing.assert_allclose(rows['int_norm'], -0.1)
+        # The Dec offset is across the apparent motion of a GEO object
+        self.assertLess(np.abs(rows['ext_tan']).max(), 0.05)
+        np.testing.assert_allclose(np.abs(rows['ext_norm']), 10.0,
+                                   atol=0.05)
+
+    def test_same_as_ext_residuals(self):
+        epochs = sorted(self.measurements)
+        ra = np.array([self.measurements[t].ra for t in epochs])
+        dec = np.array([self.measurements[t].dec for t in epochs])
+        pv = []
+        for t in epochs:
+            obj = apexstub.CatalogObject('25546', t)
+            p0, v0 = apexstub.obs_eci(site[0], site[2], apexstub.utc_to_lst(
+                t, site[1]/15))
+            pv.append(np.concatenate([obj.p - p0*1e-3, obj.v - v0*1e-3]))
+        dtan, dnorm = residuals.ext_residuals(ra, dec, pv)
+        rows = coord.read_check_arrays(StringIO(self.text)).residuals
+        np.testing.assert_allclose(rows['ext_tan'], dtan, atol=0.006)
+        np.testing.assert_allclose(rows['ext_norm'], dnorm, atol=0.006)
+
+    def test_topo(self):
+        # Topocentric states of a series are computed with array calls, and
+        # are those of per-point calls
+        self.assertIs(orbit_dump._vector_topo, True)
+        apply_topo = apexstub.apply_topo
+
+        def scalar_apply_topo(pv, pv0):
+            pv -= np.reshape(pv0, 6)
+        orbit_dump.apex.sitedef.apply_topo = scalar_apply_topo
+        try:
+            for vector in (False, None):
+                orbit_dump._vector_topo = vector
+                text = orbit_dump.process_target(
+                    (10092, 1), self.measurements, self.matches, {}, site)[0]
+                self.assertEqual(text, self.text)
+                self.assertIs(orbit_dump._vector_topo, False)
+        finally:
+            orbit_dump.apex.sitedef.apply_topo = apply_topo
+            orbit_dump._vector_topo = None
+
+    def test_elements(self):
+        tables = coord.read_check_arrays(StringIO(self.text))
+        iod, matched = tables.iod, tables.matched
+        self.assertEqual(len(iod), 1)
+        self.assertEqual(matched['sat_ID'].tolist(), ['25546'])
+        orbit = apexstub.Orbit(self.start, apexstub.r_geo)
+        for row in (iod[0], matched[0]):
+            self.assertEqual([row[name] for name in 'eiWwM'],
+                             [orbit.ecc, orbit.incl, orbit.raan, orbit.argp,
+                              orbit.anmean])
+            self.assertEqual(row['Lon'], 56.1)
+        self.assertEqual(iod['a'][0], apexstub.r_geo)
+        self.assertAlmostEqual(matched['a'][0], apexstub.r_geo, delta=0.01)
+        self.assertTrue(self.text.endswith(checkreport.target_end))
+
+    def test_ident(self):
+        date, tagstr, matches = self.ident
+        self.assertEqual(date, self.start.date())
+        self.assertEqual(tagstr, '010092 000001')
+        self.assertEqual(len(matches), 1)
+        match_id, num, totnum, dtan, dnorm = matches[0]
+        self.assertEqual((match_id, num, totnum), ('25546', 10, 10))
+        self.assertAlmostEqual(abs(dnorm)*3600, 10.0, 1)
+
+    def test_uncorrelated(self):
+        text, ident = orbit_dump.process_target(
+            (10092, 2), self.measurements, {}, {}, site)
+        self.assertIn(checkreport.uncorrelated, text)
+        self.assertEqual(ident[2], [(None, 10, 10, None, None)])
+
+
+class PostprocessTest(unittest.TestCase):
+    def setUp(self):
+        start = datetime(2014, 5, 12, 23, 20)
+        blocks = {
+            (10092, 1): target('25546', start),
+            (10092, 2): target('28884', start + timedelta(seconds=30)),
+            (10092, 3): target('25546', start + timedelta(hours=1), n=5)}
+        self.formats = orbit_dump.geo_report_formats.plugins
+        self.formats['stub'] = _ReportFormat(blocks)
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.workers = orbit_dump.workers.value
+        self.export_ident = orbit_dump.export_ident.value
+        self.residual_table = checkreport.residual_table
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        checkreport.residual_table = self.residual_table
+        orbit_dump.workers.value = self.workers
+        orbit_dump.export_ident.value = self.export_ident
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        del self.formats['stub']
+
+    def run_postprocess(self, workers):
+        orbit_dump.workers.value = workers
+        orbit_dump.postprocess('obs.txt')
+        with open('obs.txt.check') as f:
+            return f.read()
+
+    def test_workers(self):
+        serial = self.run_postprocess(1)
+        self.assertEqual(
+            len(coord.read_check_arrays(StringIO(serial)).series), 3)
+        self.assertEqual(self.run_postprocess(2), serial)
+
+    def test_ident(self):
+        # Identifications are kept in the database, and exported on demand
+        self.run_postprocess(1)
+        self.assertFalse(os.path.exists('ident.txt'))
+        conn = identdb.connect()
+        try:
+            text = '\n'.join(row[0] for row in conn.execute(
+                """SELECT matches FROM ident"""))
+        finally:
+            conn.close()
+        self.assertEqual(text.count('25546'), 2)
+        self.assertEqual(text.count('28884'), 1)
+        orbit_dump.export_ident.value = True
+        self.run_postprocess(1)
+        with open('ident.txt') as f:
+            self.assertEqual(f.read().count('25546'), 2)
+        # No temporary file is left
+        self.assertEqual(sorted(name for name in os.listdir('.')
+                                if name.startswith('ident')),
+                         ['ident.db', 'ident.txt'])
+
+    def test_main(self):
+        # Stage timings are written only if requested
+        argv, sys.argv = sys.argv, ['orbit_dump.py', 'obs.txt']
+        try:
+            orbit_dump.main()
+            self.assertEqual(sorted(os.listdir('.')),
+                             ['ident.db', 'obs.txt.check'])
+        finally:
+            sys.argv = argv
+
+    def test_worker_failure(self):
+        # A failing target stops processing and leaves no worker processes
+        def fail(*args, **kwargs):
+            raise RuntimeError('residual table failed')
+        checkreport.residual_table = fail
+        self.assertRaises(RuntimeError, self.run_postprocess, 2)
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
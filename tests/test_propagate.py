@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import math
+import unittest
+
+import numpy as np
+
+import astrodyn
+import propagate
+
+# Station of the sample .res file
+site = (48.5635, 22.4565, 0.231)
+
+
+def reference_gast(mjd):
+    # Greenwich apparent sidereal time, radians: IAU 1982 mean sidereal time
+    # at 0h UT plus the UT part, and the equation of the equinoxes from the
+    # four largest nutation terms (good to 0.5")
+    day = math.floor(mjd)
+    t0 = (day - 51544.5)/36525
+    gmst = (24110.54841 + 8640184.812866*t0 + 0.093104*t0**2 -
+            6.2e-6*t0**3 + 1.002737909350795*(mjd - day)*86400)
+    t = (mjd - 51544.5)/36525
+    node = math.radians(125.04452 - 1934.136261*t)
+    L = math.radians(280.4665 + 36000.7698*t)
+    L_moon = math.radians(218.3165 + 481267.8813*t)
+    dpsi = (-17.20*math.sin(node) - 1.32*math.sin(2*L) -
+            0.23*math.sin(2*L_moon) + 0.21*math.sin(2*node))
+    return (math.radians(gmst/240) +
+            math.radians(dpsi/3600)*math.cos(math.radians(23.4393))) % \
+        (2*math.pi)
+
+
+def reference_site(mjd):
+    # TOD position of the station, km
+    lat, lon = math.radians(site[0]), math.radians(site[1])
+    f = 1/298.257223563
+    e2 = f*(2 - f)
+    n = 6378.137/math.sqrt(1 - e2*math.sin(lat)**2)
+    x = (n + site[2])*math.cos(lat)*math.cos(lon)
+    y = (n + site[2])*math.cos(lat)*math.sin(lon)
+    z = (n*(1 - e2) + site[2])*math.sin(lat)
+    theta = reference_gast(mjd)
+    return (x*math.cos(theta) - y*math.sin(theta),
+            x*math.sin(theta) + y*math.cos(theta), z)
+
+
+def reference_position(elements, epoch, t):
+    # Position of one object at one epoch, km
+    a, e, i, W, w, M = elements
+    M = math.radians(M) + math.sqrt(398600.4418/a**3)*(t - epoch)*86400
+    M = math.fmod(M, 2*math.pi)
+    E = M
+    for _ in xrange(50):
+        dE = (E - e*math.sin(E) - M)/(1 - e*math.cos(E))
+        E -= dE
+        if abs(dE) < 1e-13:
+            break
+    i, W, w = math.radians(i), math.radians(W), math.radians(w)
+    x = a*(math.cos(E) - e)
+    y = a*math.sqrt(1 - e*e)*math.sin(E)
+    x, y = (x*math.cos(w) - y*math.sin(w), x*math.sin(w) + y*math.cos(w))
+    y, z = y*math.cos(i), y*math.sin(i)
+    return (x*math.cos(W) - y*math.sin(W), x*math.sin(W) + y*math.cos(W), z)
+
+
+def reference_ephemeris(elements, epoch, t):
+    # Position, RA (hours), Dec (degrees), range and sub-satellite longitude
+    # of one object at one epoch, with the light time solved by iteration
+    r = reference_position(elements, epoch, t)
+    lon = math.degrees(math.atan2(r[1], r[0]) - reference_gast(t)) % 360
+    obs = reference_site(t)
+    tau = 0
+    for _ in xrange(3):
+        rho = [x - x0 for x, x0 in
+               zip(reference_position(elements, epoch, t - tau/86400), obs)]
+        dist = math.sqrt(sum(x*x for x in rho))
+        tau = dist/299792.458
+    ra = math.degrees(math.atan2(rho[1], rho[0])) % 360/15
+    dec = math.degrees(math.asin(rho[2]/dist))
+    return r, ra, dec, dist, lon
+
+
+def catalog():
+    # GEO, drifting and eccentric objects, with elements up to 10 days old
+    rng = np.random.RandomState(2)
+    n = 12
+    elements = np.column_stack((
+        np.concatenate([42164.0 + rng.normal(0, 50, 6),
+                        rng.uniform(36000, 41000, 3),
+                        rng.uniform(24000, 27000, 3)]),
+        np.concatenate([rng.uniform(0, 0.01, 9), rng.uniform(0.3, 0.7, 3)]),
+        rng.uniform(0, 15, n), rng.uniform(0, 360, n),
+        rng.uniform(0, 360, n), rng.uniform(0, 360, n)))
+    epoch = 56789.0 + rng.uniform(-10, 0, n)
+    mjd = 56789.75 + np.arange(0, 12*60, 30)/1440.0
+    return elements, epoch, mjd
+
+
+def dangle(a, b, period=360.0):
+    # Differences of angles, wrapped to [-period/2, period/2)
+    return (np.asarray(a) - b + period/2) % period - period/2
+
+
+class ReferenceTest(unittest.TestCase):
+    def test_gast(self):
+        mjd = 51544.5 + np.linspace(-3000, 8000, 50)
+        ref = [reference_gast(t) for t in mjd]
+        self.assertLess(np.abs(dangle(astrodyn.gast(mjd), ref,
+                                      2*np.pi)).max(), 5e-6)
+        # Without the equation of the equinoxes (up to 1.2 s of time)
+        self.assertGreater(np.abs(dangle(astrodyn.gmst(mjd), ref,
+                                         2*np.pi)).max(), 5e-5)
+
+    def test_site(self):
+        mjd = 56789.75 + np.linspace(0, 1, 25)
+        r, v = astrodyn.site_state(site[0], site[1], site[2], mjd)
+        ref = np.array([reference_site(t) for t in mjd])
+        self.assertLess(np.abs(r - ref).max(), 0.05)
+        np.testing.assert_allclose(np.sqrt((r*r).sum(-1)),
+                                   np.sqrt((ref*ref).sum(-1)), atol=1e-9)
+        np.testing.assert_allclose(r[:, 2], ref[:, 2], atol=1e-9)
+        np.testing.assert_allclose(
+            v, astrodyn.omega_earth*np.column_stack(
+                (-r[:, 1], r[:, 0], np.zeros(len(r)))), atol=1e-12)
+
+
+class EphemerisTest(unittest.TestCase):
+    def check(self, elements, epoch, mjd):
+        eph = propagate.ephemeris(elements, epoch, mjd, site)
+        self.assertEqual(eph.shape, (len(elements), len(mjd)))
+        ref = [[reference_ephemeris(el, t0, t) for t in mjd]
+               for el, t0 in zip(elements, epoch)]
+        r, ra, dec, dist, lon = [np.array(x) for x in zip(*[
+            row for obj in ref for row in obj])]
+        eph = eph.ravel()
+        np.testing.assert_allclose(eph['r'], r, rtol=0, atol=1e-6)
+        # Directions and ranges differ with the sidereal time, by the
+        # station displacement (15 m for 0.5")
+        self.assertLess(np.abs(dangle(eph['RA'], ra, 24)*
+                               np.cos(np.deg2rad(dec))).max()*54000, 0.2)
+        self.assertLess(np.abs(eph['DEC'] - dec).max()*3600, 0.2)
+        self.assertLess(np.abs(eph['range'] - dist).max(), 0.05)
+        self.assertLess(np.abs(dangle(eph['Lon'], lon)).max(), 3e-4)
+        self.assertTrue(((eph['RA'] >= 0) & (eph['RA'] < 24)).all())
+        self.assertTrue(((eph['Lon'] >= 0) & (eph['Lon'] < 360)).all())
+        # Geocentric directions are those of the positions
+        geo = propagate.ephemeris(elements, epoch, mjd).ravel()
+        np.testing.assert_allclose(geo['r'], eph['r'], rtol=0, atol=0)
+        np.testing.assert_allclose(geo['range'],
+                                   np.sqrt((r*r).sum(-1)), rtol=1e-12)
+        self.assertLess(np.abs(dangle(
+            geo['RA'], np.rad2deg(np.arctan2(r[:, 1], r[:, 0]))/15,
+            24)).max(), 1e-9)
+        return eph.reshape(len(elements), len(mjd))
+
+    def test_same_as_loop(self):
+        self.check(*catalog())
+
+    def test_longitude_wrap(self):
+        # Objects below and above GEO, drifting east and west across the
+        # Greenwich meridian in the middle of the ephemeris
+        elements, epoch, mjd = catalog()
+        elements = np.tile(elements[6:9], (2, 1))
+        epoch = np.tile(epoch[6:9], 2)
+        elements[3:, 0] = 2*42164.0 - elements[3:, 0]
+        mid = mjd[len(mjd)//2]
+        for el, t0 in zip(elements, epoch):
+            for _ in range(2):
+                el[5] -= dangle(reference_ephemeris(el, t0, mid)[-1], 0)
+        eph = self.check(elements, epoch, mjd)
+        lon = eph['Lon']
+        self.assertTrue(((lon < 10).any(1) & (lon > 350).any(1)).all())
+        # Longitudes move smoothly across 0/360
+        steps = dangle(lon[:, 1:], lon[:, :-1])
+        self.assertLess(np.abs(steps).max(), 10)
+        self.assertTrue((np.sign(steps) == np.sign(steps[:, :1])).all())
+        self.assertEqual(sorted(set(np.sign(steps[:, 0]))), [-1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+import astrodyn
+import catdb
+import query
+
+epoch = 56789.75
+
+
+def insert(conn, rows):
+    # rows of (sat_id, station, series_id, epoch, a, e, i, W, w, M, Lon)
+    conn.executemany(
+        """INSERT INTO elements (sat_id, station, series_id, epoch, a, e, i,
+                                 W, we, M, Lon)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    conn.commit()
+
+
+def geo(sat_id, lon, t=epoch, series_id=1):
+    # Elements of a geostationary object at longitude lon at t
+    M = (lon + np.rad2deg(astrodyn.gast(t))) % 360
+    return (sat_id, 10092, series_id, t, 42164.17, 0.0, 0.0, 0.0, 0.0, M,
+            lon)
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.res_conn, self.conn = catdb.connect(':memory:', ':memory:',
+                                                 wal=False)
+
+    def tearDown(self):
+        self.res_conn.close()
+        self.conn.close()
+
+    def test_fetch_array(self):
+        dtype = np.dtype([('sat_id', 'i8'), ('a', 'f8')])
+        sql = """SELECT sat_id, a FROM elements ORDER BY sat_id, epoch"""
+        empty = query.fetch_array(self.conn.execute(sql), dtype)
+        self.assertEqual((empty.shape, empty.dtype), ((0,), dtype))
+        insert(self.conn, [geo(k, k) for k in range(7)] +
+               [(7, 10092, 1, epoch) + (None,)*7])
+        rows = query.fetch_array(self.conn.execute(sql), dtype, size=3)
+        self.assertEqual(rows['sat_id'].tolist(), range(8))
+        # NULL becomes NaN; chunks are joined in order
+        self.assertTrue(np.isnan(rows['a'][-1]))
+        self.assertEqual(
+            rows.tostring(),
+            query.fetch_array(self.conn.execute(sql), dtype).tostring())
+
+    def test_empty(self):
+        self.assertEqual(len(query.latest_elements(self.conn, epoch)), 0)
+        self.assertEqual(len(query.objects_in_longitude_band(
+            self.conn, 350, 10, epoch)), 0)
+        self.assertEqual(len(query.observations(self.res_conn, 1)), 0)
+        self.assertEqual(len(query.elements_history(self.conn, 1)), 0)
+        # No objects in the band
+        insert(self.conn, [geo(1, 180)])
+        band = query.objects_in_longitude_band(self.conn, 350, 10, epoch)
+        self.assertEqual((len(band), band.dtype), (0, query.BAND_DTYPE))
+
+    def test_latest_elements(self):
+        rows = [
+            # Newest one within the age
+            geo(1, 10, epoch - 5), geo(1, 11, epoch - 1),
+            geo(1, 12, epoch - 3),
+            # Newer than the epoch, and too old
+            geo(2, 20, epoch + 1), geo(2, 21, epoch - 2),
+            geo(2, 22, epoch - 40),
+            geo(3, 30, epoch - 40),
+            # The newest one has no elements
+            geo(4, 40, epoch - 2), (4, 10092, 9, epoch - 1) + (None,)*7,
+            # Same epoch: the first stored one
+            geo(5, 50, epoch - 1, series_id=2), geo(5, 51, epoch - 1)]
+        insert(self.conn, rows)
+        latest = query.latest_elements(self.conn, epoch)
+        self.assertEqual(latest['sat_id'].tolist(), [1, 2, 4, 5])
+        self.assertEqual(latest['Lon'].tolist(), [11, 21, 40, 50])
+        self.assertEqual(latest['series_id'].tolist(), [1, 1, 1, 2])
+        np.testing.assert_array_equal(
+            latest['epoch'], epoch - np.array([1, 2, 2, 1]))
+        # Linear scan of the stored rows
+        ref = {}
+        for row in rows:
+            if epoch - query.max_age <= row[3] <= epoch and \
+               row[4] is not None and \
+               (row[0] not in ref or ref[row[0]][3] < row[3]):
+                ref[row[0]] = row
+        self.assertEqual([tuple(row) for row in latest],
+                         [ref[sat_id] for sat_id in sorted(ref)])
+        self.assertEqual(query.latest_elements(self.conn, epoch, age=1.5)[
+            'sat_id'].tolist(), [1, 5])
+
+    def test_longitude_band(self):
+        lons = [350, 355, 359.5, 0.5, 5, 10, 180]
+        insert(self.conn, [geo(k, lon) for k, lon in enumerate(lons)])
+        # Elements of the epoch itself keep their longitude
+        rows = query.objects_in_longitude_band(self.conn, 0, 360, epoch)
+        np.testing.assert_allclose(rows['Lon'], lons, atol=1e-9)
+
+        def band(lon0, lon1):
+            return query.objects_in_longitude_band(
+                self.conn, lon0, lon1, epoch)['sat_id'].tolist()
+        # Across 0/360, also given as negative or > 360 longitudes
+        for lon0, lon1 in ((354, 6), (-6, 6), (354, 366)):
+            self.assertEqual(band(lon0, lon1), [1, 2, 3, 4])
+        self.assertEqual(band(170, 190), [6])
+        self.assertEqual(band(6, 354), [0, 5, 6])
+        self.assertEqual(band(20, 30), [])
+
+    def test_longitude_band_propagated(self):
+        # Longitudes drift from old elements of objects below GEO
+        el = list(geo(1, 359.0, epoch - 1))
+        el[4] = 42000.0
+        insert(self.conn, [tuple(el)])
+        lon = query.objects_in_longitude_band(self.conn, 0, 360,
+                                              epoch)['Lon'][0]
+        self.assertTrue(0 < lon < 10)
+        self.assertEqual(len(query.objects_in_longitude_band(
+            self.conn, 355, lon + 0.1, epoch)), 1)
+        self.assertEqual(len(query.objects_in_longitude_band(
+            self.conn, 355, 359.9, epoch)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+import coord
+import rescache
+from tests import sample_res
+
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = rescache.ParseCache(os.path.join(self.dir, 'cache'),
+                                         max_bytes=1 << 30)
+        self.res = self.copy(sample_res, 'a.res')
+        self.rmtree = rescache.shutil.rmtree
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        rescache.shutil.rmtree = self.rmtree
+        shutil.rmtree(self.dir)
+
+    def copy(self, source, name):
+        path = os.path.join(self.dir, name)
+        shutil.copy(source, path)
+        return path
+
+    def entry(self, path, kind='res'):
+        return os.path.join(self.cache.dirname, self.cache.key(path, kind))
+
+    def test_same_as_parse(self):
+        meas, series = coord.read_res_arrays(self.res)
+        check = coord.read_check_arrays(sample_res + '.check')
+        check_path = self.copy(sample_res + '.check', 'a.res.check')
+        for _ in range(2):
+            cached = self.cache.load_res(self.res)
+            self.assertEqual(cached[0].tostring(), meas.tostring())
+            self.assertEqual(cached[1].tostring(), series.tostring())
+            tables = self.cache.load_check(check_path)
+            for name in ('series', 'residuals', 'iod', 'matched',
+                         'match_ids'):
+                self.assertEqual(getattr(tables, name).tostring(),
+                                 getattr(check, name).tostring())
+        # The second time the arrays are memory-mapped from the cache
+        self.assertIsInstance(cached[0], np.memmap)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_counters(self):
+        self.cache.load_res(self.res)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        for _ in range(3):
+            self.cache.load_res(self.res)
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 1))
+        self.assertEqual(self.cache.stats(),
+                         'parse cache: 3 hit(s), 1 miss(es)')
+
+    def test_modified_source(self):
+        self.cache.load_res(self.res)
+        # Same size, another modification time
+        st = os.stat(self.res)
+        os.utime(self.res, (st.st_atime, st.st_mtime + 10))
+        self.cache.load_res(self.res)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        # Same modification time, another size: one series less
+        with open(sample_res, 'rb') as f:
+            text = f.read()
+        with open(self.res, 'wb') as f:
+            f.write(text[:text.rstrip().rindex('\r\n\r\n') + 4])
+        os.utime(self.res, (st.st_atime, st.st_mtime + 10))
+        meas, series = self.cache.load_res(self.res)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 3))
+        self.assertEqual(len(series),
+                         len(coord.read_res_arrays(sample_res)[1]) - 1)
+        self.cache.load_res(self.res)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+
+    def fill(self, n):
+        # Entries of n sources used one after another, oldest first
+        paths = [self.copy(sample_res, 'f%d.res' % k) for k in range(n)]
+        for k, path in enumerate(paths):
+            self.cache.load_res(path)
+            os.utime(self.entry(path), (1e9 + k, 1e9 + k))
+        return paths
+
+    def test_lru_eviction(self):
+        paths = self.fill(3)
+        size = self.cache.size()/3
+        # A hit makes the oldest entry the most recently used one
+        self.cache.load_res(paths[0])
+        self.cache.max_bytes = 2*size
+        self.cache.evict()
+        self.assertEqual([os.path.isdir(self.entry(path)) for path in paths],
+                         [True, False, True])
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+
+    def test_eviction_of_entries_in_use(self):
+        # An entry that cannot be removed is skipped, and the next least
+        # recently used one is evicted in its place
+        paths = self.fill(3)
+        size = self.cache.size()/3
+        busy = self.entry(paths[0])
+
+        def rmtree(path, ignore_errors=False):
+            if path != busy:
+                self.rmtree(path, ignore_errors)
+        rescache.shutil.rmtree = rmtree
+        self.cache.max_bytes = 2*size
+        self.cache.evict()
+        self.assertEqual([os.path.isdir(self.entry(path)) for path in paths],
+                         [True, False, True])
+        self.assertIn('Cannot remove parse cache entry',
+                      sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
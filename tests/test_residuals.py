@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+import residuals
+
+
+def geo_states(n, seed=0):
+    # Stub of the Apex ephemeris and site functions: topocentric states of
+    # GEO objects and their measured RA (hours) and Dec (degrees) with noise
+    rng = np.random.RandomState(seed)
+    lon = rng.uniform(0, 2*np.pi, n)
+    r, v = 42164.0, 3.0747
+    p = np.column_stack((r*np.cos(lon), r*np.sin(lon), rng.normal(0, 50, n)))
+    vel = np.column_stack((-v*np.sin(lon), v*np.cos(lon), np.zeros(n)))
+    site = 6378.0*np.array([np.cos(0.85), 0, np.sin(0.85)])
+    pv = np.column_stack((p - site, vel))
+    d = pv[:, :3] + rng.normal(0, 1e-3, (n, 3))
+    ra = np.rad2deg(np.arctan2(d[:, 1], d[:, 0])) % 360/15
+    dec = np.rad2deg(np.arcsin(d[:, 2]/np.sqrt((d**2).sum(1))))
+    return ra, dec, pv
+
+
+class ExtResidualsTest(unittest.TestCase):
+    def test_same_as_per_point(self):
+        ra, dec, pv = geo_states(1000)
+        dtan, dnorm = residuals.ext_residuals(ra, dec, pv)
+        ref = np.array([residuals.ext_residual(*args)
+                        for args in zip(ra, dec, pv)])
+        self.assertLess(np.abs(dtan - ref[:, 0]).max(), 1e-9)
+        self.assertLess(np.abs(dnorm - ref[:, 1]).max(), 1e-9)
+
+    def test_exact_direction(self):
+        # No residuals for a measurement along the line of sight
+        ra, dec, pv = geo_states(10)
+        d = pv[:, :3]
+        ra = np.rad2deg(np.arctan2(d[:, 1], d[:, 0])) % 360/15
+        dec = np.rad2deg(np.arcsin(d[:, 2]/np.sqrt((d**2).sum(1))))
+        dtan, dnorm = residuals.ext_residuals(ra, dec, pv)
+        self.assertLess(np.abs(dtan).max(), 1e-6)
+        self.assertLess(np.abs(dnorm).max(), 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
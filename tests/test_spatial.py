@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+import catdb
+import spatial
+
+
+def positions(n, rng):
+    # The GEO belt, with points around RA = 0h/24h and near the poles
+    ra = np.concatenate((rng.uniform(0, 24, n), rng.uniform(-0.01, 0.01, 50)
+                         % 24, rng.uniform(0, 24, 50)))
+    dec = np.concatenate((rng.normal(-5, 3, n), rng.normal(0, 0.05, 50),
+                          rng.uniform(89.9, 90, 50)*rng.choice([-1, 1], 50)))
+    return ra, dec
+
+
+def brute_force(ra, dec, q_ra, q_dec, radius):
+    # Distances between all query and indexed unit vectors
+    xyz, q = spatial.directions(ra, dec), spatial.directions(q_ra, q_dec)
+    d = np.sqrt(((q[:, None] - xyz[None])**2).sum(2))
+    return d, spatial.chord(radius)
+
+
+class SkyIndexTest(unittest.TestCase):
+    radius = 60.0
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.ra, self.dec = positions(3000, rng)
+        # Queries near indexed positions and anywhere
+        n = len(self.ra)
+        self.q_ra = np.concatenate((self.ra + rng.normal(0, 5e-4, n),
+                                    rng.uniform(0, 24, 500))) % 24
+        self.q_dec = np.clip(np.concatenate((
+            self.dec + rng.normal(0, 0.005, n), rng.normal(-5, 3, 500))),
+            -90, 90)
+        self.d, self.r = brute_force(self.ra, self.dec, self.q_ra,
+                                     self.q_dec, self.radius)
+
+    def check_backend(self, use_scipy):
+        index = spatial.SkyIndex(self.ra, self.dec, use_scipy)
+        self.assertEqual(len(index), len(self.ra))
+
+        q, k = index.query_radius(self.q_ra, self.q_dec, self.radius)
+        expected = np.nonzero(self.d <= self.r)
+        self.assertGreater(len(expected[0]), len(self.ra)/2)
+        np.testing.assert_array_equal(q, expected[0])
+        np.testing.assert_array_equal(k, expected[1])
+
+        k, sep = index.nearest(self.q_ra, self.q_dec, self.radius)
+        best = self.d.argmin(1)
+        d_best = self.d[np.arange(len(best)), best]
+        found = d_best <= self.r
+        np.testing.assert_array_equal(k, np.where(found, best, -1))
+        np.testing.assert_allclose(sep[found],
+                                   spatial.separation(d_best[found]),
+                                   atol=1e-6)
+        self.assertTrue(np.isnan(sep[~found]).all())
+
+    def test_grid(self):
+        self.check_backend(False)
+
+    @unittest.skipIf(spatial.cKDTree is None, 'scipy is not installed')
+    def test_ckdtree(self):
+        self.check_backend(True)
+
+    def test_empty(self):
+        for use_scipy in (False, True):
+            index = spatial.SkyIndex([], [], use_scipy)
+            q, k = index.query_radius(self.q_ra, self.q_dec, self.radius)
+            self.assertEqual((len(q), len(k)), (0, 0))
+            k, sep = index.nearest(self.q_ra[:3], self.q_dec[:3],
+                                   self.radius)
+            np.testing.assert_array_equal(k, -1)
+            self.assertTrue(np.isnan(sep).all())
+
+
+class MatchObservationsTest(unittest.TestCase):
+    def test_match(self):
+        res_conn, el_conn = catdb.connect(':memory:', ':memory:', wal=False)
+        # Two objects 0.1 deg apart observed every minute
+        epochs = 56789.5 + np.arange(10)/1440.0
+        for sat_id, ra, dec in ((25546, 3.0, -5.0), (28884, 3.0, -5.1)):
+            res_conn.executemany(
+                """INSERT INTO observations (sat_id, station, series_id,
+                   epoch, RA, DEC) VALUES (?, 10092, 1, ?, ?, ?)""",
+                [(sat_id, t, ra, dec) for t in epochs])
+        sat_id, sep = spatial.match_observations(
+            res_conn, [3.0, 3.0, 3.0, 12.0], [-5.004, -5.096, -5.05, 0.0],
+            [epochs[1], epochs[2] + 0.5/86400, epochs[5] + 10, epochs[3]],
+            radius=30.0)
+        self.assertEqual(sat_id, [25546, 28884, None, None])
+        np.testing.assert_allclose(sep[:2], 14.4, atol=1e-6)
+        self.assertTrue(np.isnan(sep[2:]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+import tracks
+
+
+def reference_tracks(mjd, max_len, labels):
+    # Series splitting as orbit_dump.main() did it before tracks
+    result = []
+    for label in sorted(set(labels)):
+        indices = [i for i in xrange(len(mjd)) if labels[i] == label]
+        t = mjd[indices]
+        istart = 0
+        for i in xrange(len(t)):
+            if i == len(t) - 1:
+                iend = i + 1
+            elif t[i] - t[istart] > max_len:
+                iend = i
+            else:
+                continue
+            result.append(indices[istart:iend])
+            istart = iend
+    return result
+
+
+class SplitTracksTest(unittest.TestCase):
+    max_len = 20.0/1440
+
+    def check(self, mjd, labels):
+        expected = reference_tracks(mjd, self.max_len, labels)
+        self.assertEqual([rows.tolist() for rows in tracks.split_tracks(
+            mjd, self.max_len, labels)], expected)
+        if len(set(labels)) == 1:
+            self.assertEqual(
+                [range(start, stop) for start, stop in
+                 tracks.track_bounds(mjd, self.max_len)], expected)
+
+    def test_random(self):
+        rng = np.random.RandomState(0)
+        mjd = 56789 + np.cumsum(rng.exponential(30.0/86400, 5000))
+        self.check(mjd, ['%05d' % k for k in rng.randint(0, 30, len(mjd))])
+        self.check(mjd, ['?']*len(mjd))
+
+    def test_limit(self):
+        # Epochs exactly max_len apart, where "t - t0 > max_len" and
+        # "t > t0 + max_len" may differ by rounding, and repeated epochs
+        rng = np.random.RandomState(1)
+        mjd = np.sort(np.concatenate((
+            56789 + self.max_len*np.arange(300),
+            56789.5 + self.max_len*rng.randint(0, 100, 300),
+            56790 + self.max_len*np.arange(300)/3.0)))
+        self.check(mjd, ['?']*len(mjd))
+        self.check(mjd, list('abc'*(len(mjd)//3)))
+
+    def test_short(self):
+        for mjd in ([], [56789.0], [56789.0, 56790.0],
+                    [56789.0, 56789.0, 56789.0]):
+            self.check(np.array(mjd), ['?']*len(mjd))
+        self.assertEqual(tracks.split_tracks([], self.max_len), [])
+        self.assertEqual(tracks.track_bounds([], self.max_len), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Timing of processing stages
+#
+# Stages are timed with Timings.stage() used as a context manager or with
+# functions decorated by timed(); wall time and the number of calls are
+# accumulated by (target, stage), where the target defaults to the current
+# one set by the caller. A disabled Timings returns a shared no-op context
+# manager, so instrumented code costs a method call per stage.
+#
+# The process-wide instance is "timings". Timings of other processes are
+# collected with take() and added with merge(). The results are written to a
+# CSV or JSON file by write().
+
+import collections
+import contextlib
+import csv
+import functools
+import json
+from timeit import default_timer as clock
+
+
+class _Stage(object):
+    __slots__ = ('timings', 'name', 'target', 't0')
+
+    def __init__(self, timings, name, target):
+        self.timings = timings
+        self.name = name
+        self.target = target
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, *args):
+        self.timings.add(self.name, clock() - self.t0, self.target)
+        return False
+
+
+class _NoStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+class Timings(object):
+    """Wall time and number of calls by (target, stage)"""
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # Target of stages started without one; '' for the whole run
+        self.target = ''
+        self._totals = collections.OrderedDict()
+
+    def stage(self, name, target=None):
+        '''
+        :param name: stage name
+        :param target: target tag; None for the current target
+        :return: context manager timing its block
+        '''
+        if not self.enabled:
+            return _no_stage
+        return _Stage(self, name, self.target if target is None else target)
+
+    def add(self, name, seconds, target=None, calls=1):
+        key = (str(self.target if target is None else target), name)
+        try:
+            total = self._totals[key]
+        except KeyError:
+            total = self._totals[key] = [0.0, 0]
+        total[0] += seconds
+        total[1] += calls
+
+    def rows(self):
+        '''
+        :return: list of (target, stage, seconds, calls) in the order of
+            first use
+        '''
+        return [key + tuple(total) for key, total in self._totals.iteritems()]
+
+    def take(self):
+        '''
+        :return: rows() and clear them
+        '''
+        rows = self.rows()
+        self._totals.clear()
+        return rows
+
+    def merge(self, rows):
+        for target, name, seconds, calls in rows:
+            self.add(name, seconds, target, calls)
+
+    def stage_totals(self):
+        '''
+        :return: OrderedDict {stage: (seconds, calls)} over all targets
+        '''
+        totals = collections.OrderedDict()
+        for target, name, seconds, calls in self.rows():
+            s, n = totals.get(name, (0.0, 0))
+            totals[name] = s + seconds, n + calls
+        return totals
+
+    def write(self, filename):
+        '''
+        Write timings to a CSV or, if the file name ends with ".json", JSON
+        file
+        '''
+        rows = self.rows()
+        if filename.lower().endswith('.json'):
+            with open(filename, 'wt') as f:
+                json.dump({
+                    'stages': [dict(stage=name, seconds=seconds, calls=calls)
+                               for name, (seconds, calls) in
+                               self.stage_totals().iteritems()],
+                    'targets': [dict(target=target, stage=name,
+                                     seconds=seconds, calls=calls)
+                                for target, name, seconds, calls in rows]},
+                    f, indent=1)
+        else:
+            with open(filename, 'wb') as f:
+                writer = csv.writer(f)
+                writer.writerow(('target', 'stage', 'seconds', 'calls'))
+                for target, name, seconds, calls in rows:
+                    writer.writerow((target, name, '%.6f' % seconds, calls))
+
+    def summary(self):
+        '''
+        :return: one line per stage with its total time and calls
+        '''
+        return '\n'.join('%-12s %10.3f s %8d call(s)' % (name, seconds, calls)
+                         for name, (seconds, calls) in
+                         self.stage_totals().iteritems())
+
+
+# Timings of the current process; disabled until enabled by the caller
+timings = Timings(enabled=False)
+
+
+def timed(name):
+    '''
+    Decorator timing every call of a function as stage "name" of "timings"
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timings.enabled:
+                return func(*args, **kwargs)
+            with timings.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def profiled(filename):
+    '''
+    Run the block under cProfile and dump the statistics
+    :param filename: statistics file (see pstats) or None not to profile
+    '''
+    if not filename:
+        yield None
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Splitting measurements into tracks (observation series)
+#
+# orbit_dump.main() splits the measurements of a target by matching catalog
+# object and then into tracks not longer than max_track_len, each track
+# starting at the first measurement that is too far from the start of the
+# previous one; catdb.migrate() starts a new series at every gap between
+# measurements. Both work on sorted MJD arrays: groups are found by a
+# stable argsort of the labels, and track boundaries with searchsorted() or
+# diff() for all groups at once. The tracks of split_tracks() are chained
+# by pointer doubling, so there is no Python loop per track or per
+# measurement.
+
+import numpy as np
+
+
+def _limits(mjd, max_len):
+    # Smallest epoch t with "t - t0 > max_len" for every t0, the original
+    # test of orbit_dump; it differs from "t > t0 + max_len" by rounding
+    # only, so t is one of the floats next to t0 + max_len
+    t = mjd + max_len
+    down, up = np.nextafter(t, -np.inf), np.nextafter(t, np.inf)
+    candidates = np.array([np.nextafter(down, -np.inf), down, t, up,
+                           np.nextafter(up, np.inf)])
+    first = (candidates - mjd > max_len).argmax(0)
+    return candidates[first, np.arange(len(mjd))]
+
+
+def _track_ranges(mjd, order, group, max_len):
+    '''
+    :param mjd: sorted epochs, days
+    :param order: row numbers sorted by group, then by epoch
+    :param group: non-decreasing group numbers of the rows in order
+    :param max_len: maximum duration of a track, days
+    :return: start, stop - arrays of ranges of all tracks in order
+    '''
+    n = len(mjd)
+    if not n:
+        return np.zeros(0, int), np.zeros(0, int)
+    # Epochs are compared by their rank among all epochs, which makes
+    # integer sort keys of (group, epoch) pairs; the queries are sorted
+    # like mjd for the speed of searchsorted()
+    keys = group*(n + 1) + np.searchsorted(mjd, mjd, 'left')[order]
+    limits = group*(n + 1) + np.searchsorted(
+        mjd, _limits(mjd, max_len), 'left')[order]
+    # End of the track started by every measurement; the last measurement
+    # of a group always belongs to its last track
+    stop = np.maximum(np.searchsorted(keys, limits, 'left'),
+                      np.arange(1, n + 1))
+    last = np.searchsorted(group, group, 'right')
+    stop = np.where(stop >= last - 1, last, stop)
+
+    # Tracks start at the first measurement of each group and at the ends
+    # of the previous tracks; every round of pointer doubling follows
+    # twice as many tracks, with node n standing for the end of data
+    on = np.zeros(n + 1, bool)
+    on[0] = True
+    on[last[:-1]] = True
+    jump = np.append(stop, n)
+    for _ in xrange(n.bit_length()):
+        on[jump[on]] = True
+        jump = jump[jump]
+    start = np.flatnonzero(on[:n])
+    return start, stop[start]
+
+
+def track_bounds(mjd, max_len):
+    '''
+    Split measurements into tracks of limited duration
+    :param mjd: sorted epochs, days
+    :param max_len: maximum duration of a track, days; a track ends before
+        the first measurement later than max_len from its start, but the
+        last measurement always belongs to the last track
+    :return: list of (start, stop) row ranges
+    '''
+    mjd = np.asarray(mjd, float)
+    n = len(mjd)
+    start, stop = _track_ranges(mjd, np.arange(n), np.zeros(n, int),
+                                max_len)
+    return zip(start.tolist(), stop.tolist())
+
+
+def track_starts(mjd, gap):
+    '''
+    :param mjd: sorted epochs, days
+    :param gap: interval between measurements that starts a new track, days
+    :return: boolean array, True for the first measurement of each track
+    '''
+    mjd = np.asarray(mjd, float)
+    starts = np.ones(len(mjd), bool)
+    starts[1:] = np.diff(mjd) > gap
+    return starts
+
+
+def split_tracks(mjd, max_len, labels=None):
+    '''
+    Split measurements by label (e.g. matching object ID) and then into
+    tracks of limited duration
+    :param mjd: sorted epochs, days
+    :param max_len: maximum duration of a track, days, see track_bounds()
+    :param labels: label of each measurement or None to split by time only
+    :return: list of row index arrays, one per track; tracks are ordered by
+        label, then by time
+    '''
+    mjd = np.asarray(mjd, float)
+    if labels is None:
+        order, group = np.arange(len(mjd)), np.zeros(len(mjd), int)
+    else:
+        inverse = np.unique(np.asarray(labels), return_inverse=True)[1]
+        order = np.argsort(inverse, kind='mergesort')
+        group = inverse[order]
+    start, stop = _track_ranges(mjd, order, group, max_len)
+    return [order[i:j] for i, j in zip(start.tolist(), stop.tolist())]